@@ -6,7 +6,7 @@ from SparseSC.fit import fit, TrivialUnitsWarning
 from SparseSC.fit_fast import fit_fast, _fit_fast_inner, _fit_fast_match
 from SparseSC.utils.match_space import (
     keras_reproducible, MTLassoCV_MatchSpace_factory, MTLasso_MatchSpace_factory, MTLassoMixed_MatchSpace_factory, MTLSTMMixed_MatchSpace_factory, 
-    Fixed_V_factory, D_LassoCV_MatchSpace_factory
+    Fixed_V_factory, D_LassoCV_MatchSpace_factory, MatchSpaceMemo
 )
 from SparseSC.utils.penalty_utils import RidgeCVSolution
 from SparseSC.fit_loo import loo_v_matrix, loo_weights, loo_score
@@ -22,7 +22,11 @@ from SparseSC.cross_validation import (
     score_train_test,
     score_train_test_sorted_v_pens,
     CV_score,
+    CV_score_iter,
+    CVScoreRecord,
 )
+from SparseSC.utils.result_cache import ScoreCache
+from SparseSC.utils.donor_pool import DonorPool, nearest_donor_pool
 from SparseSC.tensor import tensor
 from SparseSC.weights import weights
 from SparseSC.utils.penalty_utils import get_max_w_pen, get_max_v_pen, w_pen_guestimate
@@ -4,12 +4,15 @@ Implements the cross-fold Validation and parallelization methods
 
 from os.path import join
 import atexit
+from collections import namedtuple
 import numpy as np
 from concurrent import futures
 
 from SparseSC.fit_fold import fold_v_matrix
 from SparseSC.fit_loo import loo_v_matrix
 from SparseSC.fit_ct import ct_v_matrix, ct_score
+from SparseSC.utils.planner import plan_gradient
+from SparseSC.utils.result_cache import _as_result_cache
 
 
 def score_train_test(
@@ -23,6 +26,8 @@ def score_train_test(
     grad_splits=None,
     progress=None,  # pylint: disable=unused-argument
     w_pen_inner=False,
+    memory_budget=None,
+    result_cache=None,
     **kwargs
 ):
     """ 
@@ -58,13 +63,25 @@ def score_train_test(
     :param progress: Should progress messages be printed to the console?
     :type progress: boolean
 
+    :param memory_budget: Memory budget (in bytes) for the gradient.  When the
+        leave-one-out gradient is estimated to exceed it, gradient folds are
+        used instead (see :func:`SparseSC.utils.planner.plan_gradient`).
+        Defaults to the available memory. The ``result_cache`` is keyed on
+        the resulting gradient strategy rather than on the budget.
+    :type memory_budget: float, optional
+
+    :param result_cache: An on-disk cache of results, or the name of the
+        directory in which to keep one.  Calls with the same arrays and
+        parameters are read from the cache rather than recomputed.
+    :type result_cache: :class:`SparseSC.utils.result_cache.ScoreCache` or str, optional
+
     :param kwargs: additional arguments passed to the underlying matrix method
 
     :raises ValueError: when X, Y, X_treat, or Y_treat are not coercible to a
        :class:`numpy.float64` or have incompatible dimensions
 
-    :raises RuntimeError: When a MemoryError is raised and grad_splits
-        (which reduces memory requirements) is not used.
+    :raises RuntimeError: When no gradient strategy is estimated to fit within
+        the ``memory_budget``
 
     :returns: tuple containing the matrix of covariate weights, the unit
         weights penalty, and the out-of-sample score
@@ -75,6 +92,43 @@ def score_train_test(
             "parameters `X_treat` and `Y_treat` must both be Matrices or None"
         )
 
+    # resolve the gradient strategy up front: it depends on the memory
+    # available at run time, and the results depend on it
+    if X_treat is not None:
+        # fail before allocating the partial derivatives
+        plan = plan_gradient(
+            np.shape(X)[0],
+            np.shape(X)[1],
+            N1=len(train),
+            treated_holdout=True,
+            memory_budget=memory_budget,
+        )
+    elif grad_splits is None:
+        # fall back to gradient folds when the leave-one-out gradient
+        # won't fit in memory
+        plan = plan_gradient(len(train), np.shape(X)[1], memory_budget=memory_budget)
+        grad_splits = plan.grad_splits
+    else:
+        plan = None
+
+    result_cache = _as_result_cache(result_cache)
+    if result_cache is not None:
+        cache_key = result_cache.key(
+            X=np.asarray(X),
+            Y=np.asarray(Y),
+            train=np.asarray(train),
+            test=np.asarray(test),
+            X_treat=None if X_treat is None else np.asarray(X_treat),
+            Y_treat=None if Y_treat is None else np.asarray(Y_treat),
+            grad_splits=grad_splits,
+            gradient_strategy=plan.strategy if plan is not None else "fold",
+            w_pen_inner=w_pen_inner,
+            **kwargs
+        )
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     if X_treat is not None:
         # >> K-fold validation on the Treated units; assuming that Y and
         # Y_treat are pre-intervention outcomes
@@ -168,23 +222,20 @@ def score_train_test(
             # FIT THE V-MATRIX AND POSSIBLY CALCULATE THE w_pen
             # note that the weights, score, and loss function value returned
             # here are for the in-sample predictions
-            try:
-                _, v_mat, _, _, w_pen, _ = loo_v_matrix(
-                    X=X[train, :],
-                    Y=Y[train, :],
-                    # treated_units = [X.shape[0] + i for i in  range(len(train))],
-                    w_pen_inner=w_pen_inner, 
-                    **kwargs
-                )
-            except MemoryError:
-                raise RuntimeError(
-                    "MemoryError encountered.  Try setting `grad_splits` "
-                    + "parameter to reduce memory requirements."
-                )
+            _, v_mat, _, _, w_pen, _ = loo_v_matrix(
+                X=X[train, :],
+                Y=Y[train, :],
+                # treated_units = [X.shape[0] + i for i in  range(len(train))],
+                w_pen_inner=w_pen_inner, 
+                **kwargs
+            )
 
             # GET THE OUT-OF-SAMPLE PREDICTION ERROR
             s = ct_score(X=X, Y=Y, treated_units=test, V=v_mat, w_pen=w_pen)
 
+    if result_cache is not None:
+        result_cache.put(cache_key, v_mat, w_pen, s)
+
     return v_mat, w_pen, s
 
 
@@ -275,29 +326,106 @@ def score_train_test_sorted_v_pens(
     return list(zip(*values))
 
 
-def CV_score(
-    X,
-    Y,
-    v_pen,
-    w_pen,
-    X_treat=None,
-    Y_treat=None,
-    splits=5,
-    # sub_splits=None,
-    quiet=False,
-    parallel=False,
-    batchDir=None,
-    max_workers=None,
-    cv_seed=110011,
-    # this is here for API consistency:
-    progress=None,  # pylint: disable=unused-argument
-    w_pen_inner=False,
-    **kwargs
+def score_train_test_penalty_grid(
+    v_pen, w_pen, start=None, mask=None, warm_start=None, progress=False, FoldNumber=None, **kwargs
 ):
-    """ 
-    Cross fold validation for 1 or more v Penalties, holding the w penalty fixed.
+    """ a wrapper which calls score_train_test() for each combination of
+        the `v_pen`'s (columns) and `w_pen`'s (rows).  The grid is traversed in
+        serpentine order (alternating the direction of each row of `v_pen`'s),
+        so that each point can be warm-started from the optimized v_mat of its
+        neighbor.  Points for which `mask` is False are skipped, and their
+        score is NaN.
+
+        Warm starts are disabled by default with ``constrain="simplex"``:
+        the L1 norm is constant on the simplex, so the penalty only acts
+        through the descent path from the starting point, and a warm start
+        would make every point look like its predecessor.
+    """
+    if warm_start is None:
+        warm_start = kwargs.get("constrain", None) != "simplex"
+    n_w, n_v = len(w_pen), len(v_pen)
+    if mask is None:
+        mask = np.full((n_w, n_v), True)
+
+    v_mats = [[None] * n_v for _ in range(n_w)]
+    w_pens = np.full((n_w, n_v), np.nan)
+    scores = np.full((n_w, n_v), np.nan)
+
+    if progress > 0:
+        import time
+
+        t0 = time.time()
+
+    n_done = 0
+    for i, _w_pen in enumerate(w_pen):
+        cols = range(n_v) if i % 2 == 0 else range(n_v - 1, -1, -1)
+        for j in cols:
+            if not mask[i, j]:
+                continue
+            v_mat, w_pens[i, j], scores[i, j] = score_train_test(
+                v_pen=v_pen[j], w_pen=_w_pen, start=start, **kwargs
+            )
+            v_mats[i][j] = v_mat
+            if warm_start:
+                start = np.diag(v_mat)
+            n_done += 1
+            if progress > 0 and (n_done % progress) == 0:
+                t1 = time.time()
+                print(
+                    "%sv_pen: %0.4f, w_pen: %0.4f, value %s of %s, time elapsed: %0.4f sec."
+                    % (
+                        "" if FoldNumber is None else "Fold %s, " % FoldNumber,
+                        v_pen[j],
+                        _w_pen,
+                        n_done,
+                        mask.sum(),
+                        t1 - t0,
+                    )
+                )
+                t0 = time.time()
+
+    return v_mats, w_pens, scores
+
+
+#: A single cross validation result, as yielded by :func:`CV_score_iter`
+CVScoreRecord = namedtuple(
+    "CVScoreRecord", ["fold", "index", "penalty", "v_mat", "w_pen", "score", "elapsed"]
+)
+CVScoreRecord.__doc__ = """
+A single cross validation result, as yielded by :func:`CV_score_iter`
+
+:ivar fold: index of the fold in the train/test splits
+:ivar index: position of the penalty in `v_pen` (or `w_pen`) when one of
+    them is iterable, a ``(w_pen index, v_pen index)`` tuple for a grid of
+    penalties, and ``None`` otherwise
+:ivar penalty: the ``(v_pen, w_pen)`` pair which was scored
+:ivar v_mat: the fitted covariate weights
+:ivar w_pen: the unit weights penalty (possibly calculated)
+:ivar score: the out-of-sample score in this fold
+:ivar elapsed: wall clock seconds since the start of the cross validation
+"""
+
+
+def _prune_penalty_grid(fold_scores, n_splits, mask):
+    """ Racing for a grid of penalties: drop the points whose estimated total
+    score (from the folds scored so far) is worse than that of the current
+    best point by more than both of their standard errors.
     """
+    partial = np.array(fold_scores)
+    est_total = n_splits * partial.mean(axis=0)
+    est_se = np.sqrt(n_splits) * partial.std(axis=0)
+    est_total[~mask] = np.inf
+    best = np.unravel_index(np.argmin(est_total), mask.shape)
+    return mask & (est_total - est_se <= est_total[best] + est_se[best])
 
+
+def _setup_cv(X, Y, v_pen, w_pen, X_treat, Y_treat, splits, cv_seed, w_pen_inner):
+    """ Parameter QC shared by :func:`CV_score` and :func:`CV_score_iter`
+
+    :returns: the coerced ``X``, ``Y``, ``X_treat`` and ``Y_treat``, the kind
+        of penalty search (one of ``"scalar"``, ``"v_pen"``, ``"w_pen"`` or
+        ``"grid"``), and the list of train/test splits
+    """
     # PARAMETER QC
     try:
         X = np.float64(X)
@@ -325,14 +453,12 @@ def CV_score(
             % (X.shape[0], Y.shape[0])
         )
 
-    __score_train_test__ = score_train_test
     try:
         iter(w_pen)
     except TypeError:
         w_pen_is_iterable = False
     else:
         w_pen_is_iterable = True
-        __score_train_test__ = score_train_test_sorted_w_pens
 
     try:
         iter(v_pen)
@@ -340,10 +466,17 @@ def CV_score(
         v_pen_is_iterable = False
     else:
         v_pen_is_iterable = True
-        __score_train_test__ = score_train_test_sorted_v_pens
 
     if v_pen_is_iterable and w_pen_is_iterable:
-        raise ValueError("v_pen and w_pen must not both be iterable")
+        if w_pen_inner:
+            raise ValueError("w_pen must not be iterable when w_pen_inner is True")
+        kind = "grid"
+    elif v_pen_is_iterable:
+        kind = "v_pen"
+    elif w_pen_is_iterable:
+        kind = "w_pen"
+    else:
+        kind = "scalar"
 
     if X_treat is not None:
 
@@ -370,231 +503,364 @@ def CV_score(
                 % (X_treat.shape[0], Y_treat.shape[0])
             )
 
-        try:
-            iter(splits)
-        except TypeError:
-            from sklearn.model_selection import KFold
+    try:
+        iter(splits)
+    except TypeError:
+        from sklearn.model_selection import KFold
 
-            splits = KFold(splits, shuffle=True, random_state=cv_seed).split(
-                np.arange(X_treat.shape[0])
-            )
-        train_test_splits = list(splits)
-        n_splits = len(train_test_splits)
-
-        # MESSAGING
-        if not quiet:
-            print(
-                "%s-fold validation with %s control and %s treated units %s "
-                "predictors and %s outcomes, holding out one fold among "
-                "Treated units; Assumes that `Y` and `Y_treat` are pre-intervention outcomes"
-                % (n_splits, X.shape[0], X_treat.shape[0], X.shape[1], Y.shape[1])
-            )
+        splits = KFold(splits, shuffle=True, random_state=cv_seed).split(
+            np.arange((X if X_treat is None else X_treat).shape[0])
+        )
+    train_test_splits = list(splits)
 
-        if batchDir is not None:
-            from yaml import load, dump
+    return X, Y, X_treat, Y_treat, kind, train_test_splits
 
-            try:
-                from yaml import CLoader as Loader, CDumper as Dumper
-            except ImportError:
-                from yaml import Loader, Dumper
-
-            _params = kwargs.copy()
-            _params.update(
-                {
-                    "X": X,
-                    "Y": Y,
-                    "v_pen": v_pen,
-                    "w_pen": w_pen,
-                    "X_treat": X_treat,
-                    "Y_treat": Y_treat,
-                    "folds": train_test_splits,
-                }
+
+def _cv_message(X, Y, X_treat, n_splits):
+    if X_treat is not None:
+        return (
+            "%s-fold validation with %s control and %s treated units %s "
+            "predictors and %s outcomes, holding out one fold among "
+            "Treated units; Assumes that `Y` and `Y_treat` are pre-intervention outcomes"
+            % (n_splits, X.shape[0], X_treat.shape[0], X.shape[1], Y.shape[1])
+        )
+    return (
+        "%s-fold Cross Validation with %s control units, "
+        "%s predictors and %s outcomes; Y may contain "
+        "post-intervention outcomes"
+        % (n_splits, X.shape[0], X.shape[1], Y.shape[1])
+    )
+
+
+def _fold_records(fold, result, v_pen, w_pen, kind, elapsed):
+    """ unpack the results of one fold into :class:`CVScoreRecord`'s """
+    if kind == "scalar":
+        v_mat, _w_pen, score = result
+        return [CVScoreRecord(fold, None, (v_pen, w_pen), v_mat, _w_pen, score, elapsed)]
+    v_mats, w_pens, scores = result
+    if kind == "grid":
+        return [
+            CVScoreRecord(
+                fold, (i, j), (v_pen[j], w_pen[i]), v_mats[i][j], w_pens[i, j], scores[i, j], elapsed
             )
-            with open(join(batchDir,"cv_parameters.yaml"), "w") as fp:
-                fp.write(dump(_params, Dumper=Dumper))
-            return
+            for i in range(len(w_pen))
+            for j in range(len(v_pen))
+            if v_mats[i][j] is not None
+        ]
+    return [
+        CVScoreRecord(
+            fold,
+            i,
+            (v_pen[i], w_pen) if kind == "v_pen" else (v_pen, w_pen[i]),
+            v_mats[i],
+            w_pens[i],
+            scores[i],
+            elapsed,
+        )
+        for i in range(len(scores))
+    ]
 
-        if parallel:
 
-            if max_workers is None:
-                # CALCULATE A DEFAULT FOR MAX_WORKERS
-                import multiprocessing
+def _score_counting_cache(score_fn, **kwargs):
+    """ score a fold in a worker process, along with the hits, misses and
+    evictions of its copy of the ``result_cache`` (which are otherwise lost
+    with the copy) """
+    result_cache = kwargs.get("result_cache")
+    if result_cache is None:
+        return score_fn(**kwargs), None
+    before = result_cache.counts()
+    result = score_fn(**kwargs)
+    return result, [after - start for after, start in zip(result_cache.counts(), before)]
 
-                multiprocessing.cpu_count()
-                if n_splits == 1:
-                    print(
-                        "WARNING: Using Parallel options with a single "
-                        "split is expected reduce performance"
-                    )
-                max_workers = min(
-                    max(multiprocessing.cpu_count() - 2, 1), len(train_test_splits)
-                )
-                if max_workers == 1 and n_splits > 1:
-                    print(
-                        "WARNING: Default for max_workers is 1 on a machine with %s cores is 1."
-                    )
 
-            _initialize_Global_worker_pool(max_workers)
+def _iter_cv_records(
+    X,
+    Y,
+    v_pen,
+    w_pen,
+    X_treat,
+    Y_treat,
+    kind,
+    train_test_splits,
+    parallel,
+    max_workers,
+    progress,
+    w_pen_inner,
+    prune,
+    abort,
+    **kwargs
+):
+    """ Score each fold, yielding a :class:`CVScoreRecord` for each penalty as
+    its fold completes (see :func:`CV_score_iter`)
+    """
+    import time
+
+    t0 = time.time()
+    n_splits = len(train_test_splits)
+    __score_train_test__ = {
+        "scalar": score_train_test,
+        "v_pen": score_train_test_sorted_v_pens,
+        "w_pen": score_train_test_sorted_w_pens,
+        "grid": score_train_test_penalty_grid,
+    }[kind]
+    if kwargs.get("result_cache") is not None:
+        # one cache object, into which the workers' hits and misses are added
+        kwargs["result_cache"] = _as_result_cache(kwargs["result_cache"])
+    result_cache = kwargs.get("result_cache")
+    common = dict(X=X, Y=Y, v_pen=v_pen, w_pen=w_pen, progress=progress, **kwargs)
+    if X_treat is not None:
+        common.update(X_treat=X_treat, Y_treat=Y_treat)
+    if kind != "grid":
+        common["w_pen_inner"] = w_pen_inner
 
-            try:
+    if parallel:
 
-                promises = [
-                    _worker_pool.submit(
-                        __score_train_test__,
-                        X=X,
-                        Y=Y,
-                        v_pen=v_pen,
-                        w_pen=w_pen,
-                        X_treat=X_treat,
-                        Y_treat=Y_treat,
-                        train=train,
-                        test=test,
-                        FoldNumber=fold,
-                        w_pen_inner=w_pen_inner,
-                        **kwargs
-                    )
-                    for fold, (train, test) in enumerate(train_test_splits)
-                ]
-                results = [
-                    promise.result() for promise in futures.as_completed(promises)
-                ]
+        if max_workers is None:
+            # CALCULATE A DEFAULT FOR MAX_WORKERS
+            import multiprocessing
 
-            finally:
+            if n_splits == 1:
+                print(
+                    "WARNING: Using Parallel options with a "
+                    "single split is expected reduce performance"
+                )  # pylint: disable=line-too-long
+            max_workers = min(
+                max(multiprocessing.cpu_count() - 2, 1), len(train_test_splits)
+            )
+            if max_workers == 1 and n_splits > 1:
+                print(
+                    "WARNING: Default for max_workers is 1 on a machine with %s cores is 1."
+                )
 
-                _clean_up_worker_pool()
+        _initialize_Global_worker_pool(max_workers)
 
-        else:
+        promises = {}
+        try:
 
-            results = [
-                __score_train_test__(
-                    X=X,
-                    Y=Y,
-                    X_treat=X_treat,
-                    Y_treat=Y_treat,
-                    v_pen=v_pen,
-                    w_pen=w_pen,
+            for fold, (train, test) in enumerate(train_test_splits):
+                promise = _worker_pool.submit(
+                    _score_counting_cache,
+                    __score_train_test__,
                     train=train,
                     test=test,
                     FoldNumber=fold,
-                    progress=progress,
-                    w_pen_inner=w_pen_inner,
-                    **kwargs
+                    **common
                 )
-                for fold, (train, test) in enumerate(train_test_splits)
-            ]
+                promises[promise] = fold
+
+            for promise in futures.as_completed(promises):
+                result, cache_counts = promise.result()
+                if result_cache is not None:
+                    result_cache.add_counts(cache_counts)
+                for record in _fold_records(
+                    promises[promise], result, v_pen, w_pen, kind, time.time() - t0
+                ):
+                    yield record
+                    if abort is not None and abort(record):
+                        return
+
+        finally:
+
+            # cancel the folds which have not yet started (when aborted, or
+            # when the caller stops iterating)
+            for promise in promises:
+                promise.cancel()
+            _clean_up_worker_pool()
 
-    else:  # X_treat *is* None
+    else:
 
-        try:
-            iter(splits)
-        except TypeError:
-            from sklearn.model_selection import KFold
+        mask = None
+        if kind == "grid":
+            mask = np.full((len(w_pen), len(v_pen)), True)
+            fold_scores = []
 
-            splits = KFold(splits, shuffle=True, random_state=cv_seed).split(
-                np.arange(X.shape[0])
-            )
-        train_test_splits = [x for x in splits]
-        n_splits = len(train_test_splits)
-
-        # MESSAGING
-        if not quiet:
-            print(
-                "%s-fold Cross Validation with %s control units, "
-                "%s predictors and %s outcomes; Y may contain "
-                "post-intervention outcomes"
-                % (n_splits, X.shape[0], X.shape[1], Y.shape[1])
-            )
+        for fold, (train, test) in enumerate(train_test_splits):
+            if kind == "grid":
+                result = __score_train_test__(
+                    train=train, test=test, FoldNumber=fold, mask=mask.copy(), **common
+                )
+                fold_scores.append(result[2])
+                if prune and 3 <= fold + 1 < n_splits:
+                    mask = _prune_penalty_grid(fold_scores, n_splits, mask)
+            else:
+                result = __score_train_test__(
+                    train=train, test=test, FoldNumber=fold, **common
+                )
+            for record in _fold_records(
+                fold, result, v_pen, w_pen, kind, time.time() - t0
+            ):
+                yield record
+                if abort is not None and abort(record):
+                    return
 
-        if batchDir is not None:
-            from yaml import load, dump
 
-            try:
-                from yaml import CLoader as Loader, CDumper as Dumper
-            except ImportError:
-                from yaml import Loader, Dumper
-
-            _params = kwargs.copy()
-            _params.update(
-                {
-                    "X": X,
-                    "Y": Y,
-                    "v_pen": v_pen,
-                    "w_pen": w_pen,
-                    "folds": train_test_splits,
-                }
-            )
-            with open(join(batchDir,"cv_parameters.yaml"), "w") as fp:
-                fp.write(dump(_params, Dumper=Dumper))
-            return
-
-        if parallel:
-
-            if max_workers is None:
-                # CALCULATE A DEFAULT FOR MAX_WORKERS
-                import multiprocessing
-
-                multiprocessing.cpu_count()
-                if n_splits == 1:
-                    print(
-                        "WARNING: Using Parallel options with a "
-                        "single split is expected reduce performance"
-                    )  # pylint: disable=line-too-long
-                max_workers = min(
-                    max(multiprocessing.cpu_count() - 2, 1), len(train_test_splits)
-                )
-                if max_workers == 1 and n_splits > 1:
-                    print(
-                        "WARNING: Default for max_workers is 1 on a machine with %s cores is 1."
-                    )
+def CV_score_iter(
+    X,
+    Y,
+    v_pen,
+    w_pen,
+    X_treat=None,
+    Y_treat=None,
+    splits=5,
+    quiet=False,
+    parallel=False,
+    max_workers=None,
+    cv_seed=110011,
+    progress=None,
+    w_pen_inner=False,
+    prune=True,
+    abort=None,
+    **kwargs
+):
+    """
+    Streaming version of :func:`CV_score`, which yields a
+    :class:`CVScoreRecord` for each fold and penalty as soon as the fold
+    completes (in order of completion when ``parallel`` is True), rather
+    than blocking until all the folds are done.
 
-            _initialize_Global_worker_pool(max_workers)
+    :param abort: Optional early-abort hook, called with each record. When it
+        returns True no more records are yielded, and (with ``parallel``) the
+        folds which have not yet started are cancelled.  Closing the generator
+        (e.g. breaking out of the loop) has the same effect.
+    :type abort: callable, optional
 
-            try:
+    The remaining parameters are as for :func:`CV_score`. Points of a grid of
+    penalties which are pruned are not yielded for the remaining folds.
 
-                promises = [
-                    _worker_pool.submit(
-                        __score_train_test__,
-                        X=X,
-                        Y=Y,
-                        v_pen=v_pen,
-                        w_pen=w_pen,
-                        train=train,
-                        test=test,
-                        FoldNumber=fold,
-                        progress=progress,
-                        w_pen_inner=w_pen_inner,
-                        **kwargs
-                    )
-                    for fold, (train, test) in enumerate(train_test_splits)
-                ]
+    :returns: generator of :class:`CVScoreRecord`
+    """
+    X, Y, X_treat, Y_treat, kind, train_test_splits = _setup_cv(
+        X, Y, v_pen, w_pen, X_treat, Y_treat, splits, cv_seed, w_pen_inner
+    )
+
+    # MESSAGING
+    if not quiet:
+        print(_cv_message(X, Y, X_treat, len(train_test_splits)))
+
+    return _iter_cv_records(
+        X,
+        Y,
+        v_pen,
+        w_pen,
+        X_treat,
+        Y_treat,
+        kind,
+        train_test_splits,
+        parallel,
+        max_workers,
+        progress,
+        w_pen_inner,
+        prune,
+        abort,
+        **kwargs
+    )
 
-                results = [
-                    promise.result() for promise in futures.as_completed(promises)
-                ]
 
-            finally:
+def CV_score(
+    X,
+    Y,
+    v_pen,
+    w_pen,
+    X_treat=None,
+    Y_treat=None,
+    splits=5,
+    # sub_splits=None,
+    quiet=False,
+    parallel=False,
+    batchDir=None,
+    max_workers=None,
+    cv_seed=110011,
+    # this is here for API consistency:
+    progress=None,  # pylint: disable=unused-argument
+    w_pen_inner=False,
+    prune=True,
+    callback=None,
+    **kwargs
+):
+    """ 
+    Cross fold validation for 1 or more v Penalties, holding the w penalty
+    fixed, 1 or more w penalties, holding the v penalty fixed, or a grid of v
+    and w penalties.
+
+    When both `v_pen` and `w_pen` are iterables, the returned scores and
+    standard errors are arrays with one row per `w_pen` and one column per
+    `v_pen` (see :func:`score_train_test_penalty_grid`). Unless ``prune`` is
+    False (or ``parallel`` is True), the folds are evaluated one at a time and
+    points whose estimated score is worse than the best point by more than
+    both standard errors are not evaluated in the remaining folds; their
+    score and standard error are ``inf``.
+
+    ``callback``, if given, is called with a :class:`CVScoreRecord` for each
+    fold and penalty as they complete (e.g. to report progress). Use
+    :func:`CV_score_iter` to stop a cross validation early.
+    """
+    X, Y, X_treat, Y_treat, kind, train_test_splits = _setup_cv(
+        X, Y, v_pen, w_pen, X_treat, Y_treat, splits, cv_seed, w_pen_inner
+    )
+    n_splits = len(train_test_splits)
 
-                _clean_up_worker_pool()
+    # MESSAGING
+    if not quiet:
+        print(_cv_message(X, Y, X_treat, n_splits))
 
-        else:
-            results = [
-                __score_train_test__(
-                    X=X,
-                    Y=Y,
-                    v_pen=v_pen,
-                    w_pen=w_pen,
-                    train=train,
-                    test=test,
-                    FoldNumber=fold,
-                    progress=progress,
-                    w_pen_inner=w_pen_inner,
-                    **kwargs
-                )
-                for fold, (train, test) in enumerate(train_test_splits)
-            ]
+    if batchDir is not None:
+        from yaml import load, dump
 
-    # extract the score.
-    _, _, scores = list(zip(*results))
+        try:
+            from yaml import CLoader as Loader, CDumper as Dumper
+        except ImportError:
+            from yaml import Loader, Dumper
+
+        _params = kwargs.copy()
+        _params.pop("result_cache", None)
+        _params.update(
+            {
+                "X": X,
+                "Y": Y,
+                "v_pen": v_pen,
+                "w_pen": w_pen,
+                "folds": train_test_splits,
+            }
+        )
+        if X_treat is not None:
+            _params.update({"X_treat": X_treat, "Y_treat": Y_treat})
+        with open(join(batchDir,"cv_parameters.yaml"), "w") as fp:
+            fp.write(dump(_params, Dumper=Dumper))
+        return
+
+    # COLLECT THE SCORES BY FOLD (pruned points of a grid remain NaN)
+    if kind == "grid":
+        scores = np.full((n_splits, len(w_pen), len(v_pen)), np.nan)
+    elif kind == "scalar":
+        scores = [None] * n_splits
+    else:
+        scores = [[None] * len(v_pen if kind == "v_pen" else w_pen) for _ in range(n_splits)]
+
+    for record in _iter_cv_records(
+        X,
+        Y,
+        v_pen,
+        w_pen,
+        X_treat,
+        Y_treat,
+        kind,
+        train_test_splits,
+        parallel,
+        max_workers,
+        progress,
+        w_pen_inner,
+        prune,
+        None,
+        **kwargs
+    ):
+        if kind == "scalar":
+            scores[record.fold] = record.score
+        elif kind == "grid":
+            scores[(record.fold,) + record.index] = record.score
+        else:
+            scores[record.fold][record.index] = record.score
+        if callback is not None:
+            callback(record)
 
     # TODO: np.sqrt(len(scores)) * np.std(scores) is a quick and dirty hack for
     # calculating the standard error of the sum from the partial sums.  It's
@@ -603,7 +869,13 @@ def CV_score(
     # fixed effects framework, and leveraging the individual errors.
     # https://stats.stackexchange.com/a/271223/67839
 
-    if v_pen_is_iterable or w_pen_is_iterable:
+    if kind == "grid":
+        total_score = scores.sum(axis=0)
+        se = np.sqrt(len(scores)) * np.std(scores, axis=0)
+        pruned = np.isnan(total_score)
+        total_score[pruned] = np.inf
+        se[pruned] = np.inf
+    elif kind != "scalar":
         total_score = [sum(s) for s in zip(*scores)]
         se = [np.sqrt(len(s)) * np.std(s) for s in zip(*scores)]
     else:
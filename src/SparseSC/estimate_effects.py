@@ -4,12 +4,16 @@ Effect estimation routines
 # To do:
 # - Rename the pl_res
 # - Allow pass in in label (rather than #idx) for treated units. 
+import itertools
 import numpy as np
 import pandas as pd
-from .utils.metrics_utils import _gen_placebo_stats_from_diffs
+import scipy.sparse
+from functools import partial
+from .utils.metrics_utils import _gen_placebo_stats_from_diffs, _spawn_placebo_seeds
 from .fit import fit
 from .fit_fast import fit_fast
-from .utils.misc import par_map
+from .utils.match_space import MatchSpaceMemo
+from .utils.misc import par_map, default_n_multi, SharedArrays, shared_arrays
 
 #Note https://stackoverflow.com/questions/31917964/
 # - that pandas can only store datetime[ns]
@@ -32,7 +36,7 @@ def _fit_p_wrapper(f, test_folds, fit_fn, **kwargs):
 
     return (fit_fn(treated_units=test, **kwargs), test)
     
-def get_c_predictions_honest(X_and_Y_pre_c, Y_post_c, Y_c, model_type= "retrospective", cf_folds = 10, cf_seed=110011, fast = True, verbose=1, progress=False, print_path=False, n_multi=0, **kwargs):
+def get_c_predictions_honest(X_and_Y_pre_c, Y_post_c, Y_c, model_type= "retrospective", cf_folds = 10, cf_seed=110011, fast = True, verbose=1, progress=False, print_path=False, n_multi=0, warm_start=None, needed=None, pool=None, **kwargs):
     r"""
     Cross-fits the model across the controls for single considered treatment period
 
@@ -44,13 +48,26 @@ def get_c_predictions_honest(X_and_Y_pre_c, Y_post_c, Y_c, model_type= "retrospe
     :param cf_seed: Seed for cross-fit fold splitting    
     :param fast: Whether to use the fast approximate solution (fit_fast() rather than fit())
     :type fast: bool
-    :param n_multi: Number of processes use (0=single threaded)
+    :param n_multi: Number of processes use (0=single threaded). Use None to
+        spread the folds over the available cores (fitting them one at a time
+        if the parameters can't be pickled).
+    :param warm_start: The fit on the full sample, whose selected penalties
+        are reused by the folds. For fit(), its ``V`` is also the starting
+        point of the gradient descent, and for fit_fast(), pass the same
+        ``match_space_memo`` to both so that the folds refine its match space.
+    :type warm_start: SparseSCFit, Optional
+    :param needed: Mask of the controls whose honest predictions are needed.
+        Folds without any are not fit, and their predictions are NaN.
+    :type needed: bool[], Optional
+    :param pool: A persistent process pool for the folds, rather than starting
+        one with ``n_multi`` processes (see :func:`SparseSC.utils.misc.par_map`)
+    :type pool: multiprocessing.pool.Pool, Optional
     :param kwargs: Additional parameters passed to fit() or fit_fast()
 
     :returns: Y_local_c_sc_honest, [(f_train_fit, f_test_idxs) for f in folds]
+        (``(None, f_test_idxs)`` for folds that were skipped)
     """
     # TODO: Maybe build this into the FitResults object or the fit methods?
-    from functools import partial
     fit_fn = fit_fast if fast else fit
     try:
         iter(cf_folds)
@@ -58,8 +75,14 @@ def get_c_predictions_honest(X_and_Y_pre_c, Y_post_c, Y_c, model_type= "retrospe
         from sklearn.model_selection import KFold
         cf_folds = KFold(cf_folds, shuffle=True, random_state=cf_seed).split(np.arange(Y_c.shape[0]))
     train_test_splits = list(cf_folds)
-    F = len(train_test_splits)
     test_folds = [test for (_, test) in train_test_splits]
+    if needed is None:
+        fit_folds = list(range(len(train_test_splits)))
+    else:
+        fit_folds = [fold for fold, test in enumerate(test_folds) if np.any(needed[test])]
+    F = len(fit_folds)
+    if warm_start is not None:
+        kwargs.update(_warm_start_args(warm_start, fast, kwargs))
     part_fn = partial(_fit_p_wrapper, test_folds=test_folds, fit_fn=fit_fn, features=X_and_Y_pre_c,
     targets=Y_post_c,
     model_type=model_type,
@@ -67,15 +90,149 @@ def get_c_predictions_honest(X_and_Y_pre_c, Y_post_c, Y_c, model_type= "retrospe
     print_path=print_path,
     progress=progress,
     **kwargs)
+    if n_multi is None and pool is None:
+        n_multi = default_n_multi(F, part_fn)
 
-    fits = par_map(part_fn, range(F), F, verbose, n_multi=n_multi, header="CROSS-FITTING")
+    fits = dict(zip(fit_folds, par_map(part_fn, fit_folds, F, verbose, n_multi=n_multi, header="CROSS-FITTING", pool=pool)))
         
-    Y_c_sc_honest = Y_c
+    Y_c_sc_honest = np.array(Y_c, dtype=np.float64)
     for fold, (_, test) in enumerate(train_test_splits):
+        if fold not in fits:
+            Y_c_sc_honest[test,:] = np.nan
+            continue
         fit_k, _ = fits[fold]
         Y_c_sc_honest[test,:] = fit_k.predict(Y_c)[test,:]
 
-    return Y_c_sc_honest, fits
+    return Y_c_sc_honest, [fits.get(fold, (None, test)) for fold, test in enumerate(test_folds)]
+
+
+def _warm_start_args(full_fit, fast, kwargs):
+    """ parameters for the cross-fit folds which reuse the full sample fit """
+    if fast:
+        if full_fit.fitted_w_pen is None:
+            return {}
+        return {"w_pens": [full_fit.fitted_w_pen]}
+    warm_args = {"v_pen": full_fit.fitted_v_pen, "w_pen": full_fit.fitted_w_pen}
+    if full_fit.match_space is None and "start" not in kwargs:
+        warm_args["start"] = np.diag(full_fit.V)
+    return warm_args
+
+
+def _shared_period_wrapper(period_arg, period_fn):
+    shared = shared_arrays()
+    return period_fn(period_arg, Y=shared["Y"], X=shared["X"])
+
+
+def _estimate_period(period_arg, Y, X, unit_treatment_periods_idx_fit, dt_index, T0, T1, Tpost, Teval,
+                     model_type, fast, cv_folds, cf_folds, cf_seed, treatment_unit_size, max_n_pl, pl_unique, cf_warm_start, cf_n_multi, placebo_units=None, cf_pool=None, **kwargs):
+    """
+    Fits a single treatment period for :func:`estimate_effects`, and gets
+    the (honest) differences of the treated and control units from their
+    synthetic controls.
+
+    :param period_arg: The treatment period (as an index into the columns
+        of ``Y``, shifted by ``T1`` for prospective designs) and the
+        :class:`numpy.random.SeedSequence` for its placebos
+
+    :returns: the period's label, its fit, a dict of the differences
+        (treated and control, pre and post, control blocks repeated for
+        each treated unit, see :func:`_merge_period_diffs`) and the seed for
+        the placebos of its individual CIs
+    """
+    treatment_period_idx_fit, period_seed = period_arg
+    rmspe_seed, ind_ci_seed = period_seed.spawn(2)
+    fit_fn = fit_fast if fast else fit
+    if fast and cf_warm_start and cf_folds!=1 and kwargs.get("match_space_maker") is None and kwargs.get("match_space_memo") is None:
+        # the cross-fit folds refine the match space of the full sample fit
+        kwargs["match_space_memo"] = MatchSpaceMemo()
+    treatment_period_idx = treatment_period_idx_fit if model_type=='retrospective' else treatment_period_idx_fit + T1
+    user_index = dt_index[treatment_period_idx] if dt_index is not None else treatment_period_idx
+    c_units_mask_full, t_units_mask_full, ct_units_mask_full = get_sample_masks(unit_treatment_periods_idx_fit, treatment_period_idx_fit, Tpost)
+    c_units_mask_local = c_units_mask_full[ct_units_mask_full]
+    t_units_mask_local = t_units_mask_full[ct_units_mask_full]
+    n_treated = np.sum(t_units_mask_full)
+    n_control = np.sum(c_units_mask_full)
+    Y_local = Y[ct_units_mask_full,(treatment_period_idx_fit-T0):(treatment_period_idx_fit+Tpost)]
+    treated_units = t_units_mask_local.nonzero()[0]
+    control_units = c_units_mask_local.nonzero()[0]
+    # the other controls are only donors, so their honest predictions aren't needed
+    needed = None if placebo_units is None else placebo_units[c_units_mask_full]
+    placebo_controls = control_units if needed is None else control_units[needed]
+    if treatment_unit_size is not None:
+        doses = treatment_unit_size[t_units_mask_full]
+        doses[np.isnan(doses)] = 1
+
+    Y_pre = Y_local[:,:T0]
+    #Y_post = Y_local[:,T0:]
+    Y_post_fit = Y_local[:,T0:(T0+T1)]
+    if X is None:
+        X_and_Y_pre = Y_pre
+    else:
+        X_and_Y_pre = np.hstack((X[ct_units_mask_full,:], Y_pre))
+
+    fit_res = fit_fn(
+        features=X_and_Y_pre,
+        targets=Y_post_fit,
+        model_type=model_type,
+        treated_units=treated_units,
+        cv_folds=cv_folds,
+        cv_seed=cf_seed,
+        **kwargs
+    )
+
+    #Get the fit on match variables. Nothing was fit so that these would fit well, so don't worry about overfitting
+    M = fit_res.match_space if fit_res.match_space is not None else fit_res.features
+    if M is None or M.shape[1]==0 or len(fit_res.V) == 0: #think last test is redundant
+        rmspe_M_w_p = np.nan
+    else:
+        M_diffs_2 = np.square(M - fit_res.predict(M))
+        #rmspe_M_unw = np.sqrt(np.mean(M_diff_2, axis=1))
+        V_fit = np.diag(fit_res.V)
+        V_fit_norm = V_fit / np.sum(V_fit)
+        rmspe_M_w = np.sqrt(np.mean(np.asarray(M_diffs_2) * V_fit_norm, axis=1))
+        rmspe_M_w_p = _gen_placebo_stats_from_diffs(rmspe_M_w[placebo_controls,None], rmspe_M_w[treated_units,None], max_n_pl, False, True,
+                                                     seed=rmspe_seed, unique=pl_unique).rms_joint_effect.p
+    setattr(fit_res, 'rmspe_M_w_p', rmspe_M_w_p)
+
+    #Get honest predictions (for honest placebo effects)
+    Y_sc = fit_res.predict(Y_local) #doesn't have honest ones for the control units
+    cf_weights = None
+    if cf_folds!=1:
+        if cf_warm_start:
+            cf_args = dict(kwargs, warm_start=fit_res)
+        else:
+            cf_args = dict(kwargs, w_pen=fit_res.initial_w_pen, v_pen=fit_res.initial_v_pen)
+        Y_sc[control_units,:], cf_fits = get_c_predictions_honest(X_and_Y_pre[c_units_mask_local,:], Y_post_fit[c_units_mask_local,:], Y_local[c_units_mask_local,:], 
+                                                    model_type, cf_folds if cf_folds!="all" else n_control, cf_seed,
+                                                    n_multi=cf_n_multi, needed=needed, pool=cf_pool, cv_seed=cf_seed, **cf_args)
+        cf_weights = _honest_weights(cf_fits)
+    setattr(fit_res, 'cf_weights', cf_weights) # for SparseSCEstResults.extend()
+
+
+    #Get statistical significance
+    diffs = Y_local - Y_sc
+    rmspes_pre = np.sqrt(np.mean(np.square(diffs[:,:T0]), axis=1))
+    diffs_post_eval_scaled = np.diagflat(1/rmspes_pre).dot(diffs[:,T0+Tpost-Teval:T0+Tpost])
+
+    if treatment_unit_size is None:
+        doses = np.ones(n_treated)
+    # the control blocks are repeated for each treated unit (technically only
+    # needed if len(treatment_periods)>1, but consistency is nice). They're
+    # kept as (block, repeats), scaled by each run of equal doses.
+    dose_runs = [(dose, len(list(run))) for dose, run in itertools.groupby(doses)]
+    period_diffs = {
+        "pre_t": diffs[treated_units,:T0],
+        "post_fit_t": diffs[treated_units,T0:(T0+T1)],
+        "post_t": diffs[treated_units,T0+Tpost-Teval:T0+Tpost] / doses[:, np.newaxis], #scale rows
+        "post_scaled_t": diffs_post_eval_scaled[treated_units,:] / doses[:, np.newaxis],
+        "pre_c": [(diffs[placebo_controls,:T0], n_treated)],
+        "post_fit_c": [(diffs[placebo_controls,T0:(T0+T1)], n_treated)],
+        "post_c": [(diffs[placebo_controls,T0+Tpost-Teval:T0+Tpost] / dose, repeats) for dose, repeats in dose_runs],
+        "post_scaled_c": [(diffs_post_eval_scaled[placebo_controls,:] / dose, repeats) for dose, repeats in dose_runs],
+        "doses": doses,
+    }
+
+    return user_index, fit_res, period_diffs, ind_ci_seed
 
 
 def estimate_effects(
@@ -94,6 +251,12 @@ def estimate_effects(
     cv_folds = 10,
     cf_folds = 10, #sync with helper
     cf_seed=110011, #sync with helper
+    exact_p=False,
+    pl_seed=None,
+    pl_unique=False,
+    n_multi_periods=0,
+    cf_warm_start=True,
+    placebo_units=None,
     **kwargs
 ):
     r"""
@@ -121,7 +284,11 @@ def estimate_effects(
     :param ret_pl: Return the matrix of placebos (different from the SC of
             the controls when N1>1)
     :type ret_pl: bool
-    :param ret_CI: Whether to return confidence intervals (requires more memory during execution)
+    :param ret_CI: Whether to return confidence intervals (requires more memory during execution).
+            The placebo statistics are computed when they are first accessed
+            on the returned results, with ``ret_pl``, ``ret_CI`` and ``level``
+            as the defaults; others can be requested later (e.g. with
+            :meth:`SparseSCEstResults.get_CI`) without re-estimating.
     :param level: Level for confidence intervals
     :type level: float (between 0 and 1)
     :param fast: Whether to use the fast approximate solution (fit_fast() rather than fit())
@@ -130,7 +297,45 @@ def estimate_effects(
     :param T2: If model='prospective' then the period of which to evaluate the effect
     :param cv_folds: Number of CV Folds fit CVed fitting.
     :param cf_folds: Number of Cross-fit folds for getting honest predictions for control units. Use 1 to re-use the initial fit from whole distribution (not honest). Use "all" for one for every control unit. 
-    :param kwargs: Additional parameters passed to fit() or fit_fast()
+    :param exact_p: Compute the p-values of the per-period, average and RMS
+            effects against all choose(N0,N1) placebos, whatever
+            ``max_n_pl``, from the distribution of the means of the control
+            effects rather than enumerating the combinations. They're exact
+            for one or two treated units (or few combinations), and otherwise
+            conservative within a tolerance. Where that's too costly (e.g.
+            for many treated units) the p-values are still from the
+            ``max_n_pl`` placebos, which are also drawn for ``ret_pl`` and
+            ``ret_CI``.
+    :type exact_p: bool
+    :param pl_seed: Seed for drawing the placebos when there are more than
+            ``max_n_pl``. Each set of placebos (pre-period, post-period, each
+            treatment period's, etc.) is drawn from an independent stream
+            spawned from it. By default
+            the seed is drawn from the global ``numpy.random`` state.
+    :type pl_seed: int or numpy.random.SeedSequence, Optional
+    :param pl_unique: Draw the random placebos without replacement
+    :type pl_unique: bool
+    :param n_multi_periods: Number of processes over which to estimate the
+            treatment periods concurrently (0=one at a time). ``outcomes``
+            and ``covariates`` are shared with the workers once (in shared
+            memory) and the results are merged in the order of the periods,
+            so they don't depend on the number of processes.
+    :type n_multi_periods: int
+    :param cf_warm_start: Warm start the cross-fitting from the fit of each
+            treatment period: the folds reuse its selected penalties and (for
+            fit()) start the gradient descent from its ``V``, and (for
+            fit_fast()) refine its match space rather than searching the
+            full penalty grid. Use False to refit each fold from scratch.
+    :type cf_warm_start: bool
+    :param placebo_units: Mask of the units whose (honest) placebo effects
+            are used for inference. The other control units are still
+            donors, but are left out of the placebo tests, and the cross-fit
+            folds with none of these units aren't fit. By default, all the
+            control units.
+    :type placebo_units: bool[] or pd.Series with shape (N), Optional
+    :param kwargs: Additional parameters passed to fit() or fit_fast().
+            ``n_multi`` is the number of processes for the cross-fitting
+            (see :func:`get_c_predictions_honest`, by default one at a time).
 
     :returns: An instance of SparseSCEstResults with the fitted results
     :raises ValueError:  when invalid parameters are passed
@@ -147,6 +352,8 @@ def estimate_effects(
             X = X.reindex(Y_df.index)
         if isinstance(unit_treatment_periods, pd.Series):
             unit_treatment_periods = unit_treatment_periods.reindex(Y_df.index)
+        if isinstance(placebo_units, pd.Series):
+            placebo_units = placebo_units.reindex(Y_df.index, fill_value=False)
     X_df = None
     if X is not None and isinstance(X, pd.DataFrame):
         X_df = X
@@ -173,6 +380,10 @@ def estimate_effects(
     if model_type == 'full': 
         raise ValueError("parameter 'model_type' can't be 'full'" )
     N,T = Y.shape #pylint: disable=unused-variable
+    if placebo_units is not None:
+        placebo_units = np.asarray(placebo_units, dtype=bool)
+        if placebo_units.shape != (N,):
+            raise ValueError("placebo_units must have an entry for each unit")
     finite_t_idx = unit_treatment_periods_idx[np.isfinite(unit_treatment_periods_idx)].astype('int')
     t_max_before = min(finite_t_idx[finite_t_idx>=1])
     t_max_after = T-max(finite_t_idx[finite_t_idx<=(T-1)])
@@ -242,168 +453,57 @@ def estimate_effects(
 
     treatment_periods_idx_fit = np.unique(finite_t_idx_fit[np.logical_and(finite_t_idx_fit>=T0,finite_t_idx_fit<=(T-Tpost))]) #sorts
     fits = {}
-    ind_CI = {} if ret_CI else None
-    diffs_pre_c = np.empty((0,T0))
-    diffs_pre_t = np.empty((0,T0))
-    if model_type!="retrospective":
-        diffs_post_fit_c = np.empty((0,T1))
-        diffs_post_fit_t = np.empty((0,T1))
-    diffs_post_eval_c = np.empty((0,Teval))
-    diffs_post_eval_t = np.empty((0,Teval))
-    diffs_post_eval_scaled_c = np.empty((0,Teval))
-    diffs_post_eval_scaled_t = np.empty((0,Teval))
-
-    for treatment_period_idx_fit in treatment_periods_idx_fit:
-        #Get the local values
-        treatment_period_idx = treatment_period_idx_fit if model_type=='retrospective' else treatment_period_idx_fit + T1
-        if using_dt_index:
-            treatment_period = dt_index[treatment_period_idx]
-        user_index = treatment_period if using_dt_index else treatment_period_idx
-        c_units_mask_full, t_units_mask_full, ct_units_mask_full = get_sample_masks(unit_treatment_periods_idx_fit, treatment_period_idx_fit, Tpost)
-        c_units_mask_local = c_units_mask_full[ct_units_mask_full]
-        t_units_mask_local = t_units_mask_full[ct_units_mask_full]
-        n_treated = np.sum(t_units_mask_full)
-        n_control = np.sum(c_units_mask_full)
-        Y_local = Y[ct_units_mask_full,(treatment_period_idx_fit-T0):(treatment_period_idx_fit+Tpost)]
-        if Y_df is not None:
-            col_index = Y_df.columns[(treatment_period_idx_fit-T0):(treatment_period_idx_fit+Tpost)]
-        else:
-            col_index = None
-        treated_units = t_units_mask_local.nonzero()[0]
-        control_units = c_units_mask_local.nonzero()[0]
-        if treatment_unit_size is not None:
-            doses = treatment_unit_size[t_units_mask_full]
-            doses[np.isnan(doses)] = 1
-
-        Y_pre = Y_local[:,:T0]
-        #Y_post = Y_local[:,T0:]
-        Y_post_fit = Y_local[:,T0:(T0+T1)]
-        if X is None:
-            X_and_Y_pre = Y_pre
-        else:
-            X_and_Y_pre = np.hstack((X[ct_units_mask_full,:], Y_pre))
-
-        fit_res = fit_fn(
-            features=X_and_Y_pre,
-            targets=Y_post_fit,
-            model_type=model_type,
-            treated_units=treated_units,
-            cv_folds=cv_folds,
-            cv_seed=cf_seed,
-            **kwargs
-        )
-        fits[user_index] = fit_res
+    ind_ci_seeds = {}
+    period_diffs = {}
+    pl_seeds = _spawn_placebo_seeds(pl_seed, 5)
 
-        #Get the fit on match variables. Nothing was fit so that these would fit well, so don't worry about overfitting
-        M = fit_res.match_space if fit_res.match_space is not None else fit_res.features
-        if M is None or M.shape[1]==0 or len(fit_res.V) == 0: #think last test is redundant
-            rmspe_M_w_p = np.nan
-        else:
-            M_diffs_2 = np.square(M - fit_res.predict(M))
-            #rmspe_M_unw = np.sqrt(np.mean(M_diff_2, axis=1))
-            V_fit = np.diag(fit_res.V)
-            V_fit_norm = V_fit / np.sum(V_fit)
-            rmspe_M_w = np.sqrt(np.mean(np.asarray(M_diffs_2) * V_fit_norm, axis=1))
-            rmspe_M_w_p = _gen_placebo_stats_from_diffs(rmspe_M_w[control_units,None], rmspe_M_w[treated_units,None], max_n_pl, False, True).rms_joint_effect.p
-        setattr(fit_res, 'rmspe_M_w_p', rmspe_M_w_p)
-
-        #Get honest predictions (for honest placebo effects)
-        Y_sc = fit_res.predict(Y_local) #doesn't have honest ones for the control units
-        if cf_folds!=1:
-            Y_sc[control_units,:], _ = get_c_predictions_honest(X_and_Y_pre[c_units_mask_local,:], Y_post_fit[c_units_mask_local,:], Y_local[c_units_mask_local,:], 
-                                                        model_type, cf_folds if cf_folds!="all" else n_control, cf_seed, w_pen=fit_res.initial_w_pen, v_pen=fit_res.initial_v_pen,
-                                                        cv_seed=cf_seed, **kwargs)
-
-
-        #Get statistical significance
-        diffs = Y_local - Y_sc
-        rmspes_pre = np.sqrt(np.mean(np.square(diffs[:,:T0]), axis=1))
-        diffs_post_eval_scaled = np.diagflat(1/rmspes_pre).dot(diffs[:,T0+Tpost-Teval:T0+Tpost])
-
-        diffs_pre_t = np.vstack((diffs_pre_t,diffs[treated_units,:T0]))
-        if model_type!="retrospective":
-            diffs_post_fit_t = np.vstack((diffs_post_fit_t,diffs[treated_units,T0:(T0+T1)]))
-        diffs_post_eval_t_i = diffs[treated_units,T0+Tpost-Teval:T0+Tpost]
-        diffs_post_eval_scaled_t_i = diffs_post_eval_scaled[treated_units,:]
-        if treatment_unit_size is not None:
-            diffs_post_eval_t_i = diffs_post_eval_t_i / doses[:, np.newaxis] #scale rows
-            diffs_post_eval_scaled_t_i = diffs_post_eval_scaled_t_i / doses[:, np.newaxis] #scale rows
-        diffs_post_eval_t = np.vstack((diffs_post_eval_t,diffs_post_eval_t_i))
-        diffs_post_eval_scaled_t = np.vstack((diffs_post_eval_scaled_t,diffs_post_eval_scaled_t_i))
-
-        for t_i in range(n_treated): #technically only need to do if len(treatment_periods)>1, but consistency is nice
-            diffs_pre_c = np.vstack((diffs_pre_c, diffs[control_units,:T0]))
-            if model_type!="retrospective":
-                diffs_post_fit_c = np.vstack((diffs_post_fit_c, diffs[control_units,T0:(T0+T1)]))
-            diffs_post_eval_c_i = diffs[control_units,T0+Tpost-Teval:T0+Tpost]
-            diffs_post_eval_scaled_c_i = diffs_post_eval_scaled[control_units,:]
-            if treatment_unit_size is not None:
-                diffs_post_eval_c_i = diffs_post_eval_c_i / doses[t_i]
-                diffs_post_eval_scaled_c_i = diffs_post_eval_scaled_c_i / doses[t_i]
-            diffs_post_eval_c = np.vstack((diffs_post_eval_c, diffs_post_eval_c_i))
-            diffs_post_eval_scaled_c = np.vstack((diffs_post_eval_scaled_c, diffs_post_eval_scaled_c_i))
-
-
-        if ret_CI:
-            Y_sc_full = fit_res.predict(Y[ct_units_mask_full,:])
-            diffs_full = Y[ct_units_mask_full,:] - Y_sc_full
-            ind_ci_vals = _gen_placebo_stats_from_diffs(diffs_full[control_units,:], np.zeros((1,diffs_full.shape[1])),
-                                                                     max_n_pl, False, True, level, vec_index=col_index).effect_vec.ci
-            ind_CI[user_index] = ind_ci_vals
+    cf_n_multi = kwargs.pop('n_multi', 0)
+    if n_multi_periods > 0 and cf_n_multi is None:
+        cf_n_multi = 0 # the periods are already spread over the cores
+    period_fn = partial(_estimate_period,
+        unit_treatment_periods_idx_fit=unit_treatment_periods_idx_fit, dt_index=dt_index if using_dt_index else None, T0=T0, T1=T1, Tpost=Tpost, Teval=Teval, model_type=model_type,
+        fast=fast, cv_folds=cv_folds, cf_folds=cf_folds, cf_seed=cf_seed, treatment_unit_size=treatment_unit_size,
+        max_n_pl=max_n_pl, pl_unique=pl_unique, cf_warm_start=cf_warm_start,
+        cf_n_multi=cf_n_multi, placebo_units=placebo_units, **kwargs)
+    # each period draws its placebos from its own stream, so the results don't depend on the scheduling
+    period_args = list(zip(treatment_periods_idx_fit, pl_seeds[4].spawn(len(treatment_periods_idx_fit))))
+    if n_multi_periods > 0 and len(period_args) > 1:
+        from concurrent import futures
 
-    if len(treatment_periods_idx_fit) == 1 and Y_df is not None:
-        treatment_period_idx_fit = treatment_periods_idx_fit[0]
-        pre_index = Y_df.columns[(treatment_period_idx_fit-T0):treatment_period_idx_fit]
-        #post_index = Y_df.columns[treatment_period:(treatment_period+Tpost)]
-        post_eval_index = Y_df.columns[(treatment_period_idx_fit+Tpost-Teval):(treatment_period_idx_fit+Tpost)]
-        if model_type!="retrospective":
-            post_fit_index = Y_df.columns[treatment_period_idx_fit:(treatment_period_idx_fit+T1)]
+        with SharedArrays({"Y": Y, "X": X}) as shared:
+            with futures.ProcessPoolExecutor(max_workers=min(n_multi_periods, len(period_args)),
+                                             initializer=shared.initializer, initargs=shared.initargs) as pool:
+                period_results = list(pool.map(partial(_shared_period_wrapper, period_fn=period_fn), period_args))
+    elif cf_n_multi and cf_folds!=1:
+        from multiprocessing import Pool
+
+        # one pool for the cross-fitting of all the periods
+        with Pool(cf_n_multi) as cf_pool:
+            period_results = [period_fn(period_arg, Y=Y, X=X, cf_pool=cf_pool) for period_arg in period_args]
     else:
-        pre_index, post_fit_index, post_eval_index = None, None, None
-    # diagnostics
-    pl_res_pre = _gen_placebo_stats_from_diffs(
-        diffs_pre_c,
-        diffs_pre_t,
-        max_n_pl,
-        ret_pl,
-        ret_CI,
-        level,
-        vec_index = pre_index
-    )
+        period_results = [period_fn(period_arg, Y=Y, X=X) for period_arg in period_args]
 
+    # merge in the order of the treatment periods
+    for user_index, fit_res, diffs_i, ind_ci_seed in period_results:
+        fits[user_index] = fit_res
+        period_diffs[user_index] = diffs_i
+        ind_ci_seeds[user_index] = ind_ci_seed
+
+    widths = {"pre": T0, "post": Teval, "post_scaled": Teval}
     if model_type!="retrospective":
-        pl_res_post_fit = _gen_placebo_stats_from_diffs(
-            diffs_post_fit_c,
-            diffs_post_fit_t,
-            max_n_pl,
-            ret_pl,
-            ret_CI,
-            level,
-            vec_index = post_fit_index
-        )
+        widths["post_fit"] = T1
+    if len(treatment_periods_idx_fit) == 1 and Y_df is not None:
+        treatment_period_idx_fit = treatment_periods_idx_fit[0]
+        vec_index = {
+            "pre": Y_df.columns[(treatment_period_idx_fit-T0):treatment_period_idx_fit],
+            "post": Y_df.columns[(treatment_period_idx_fit+Tpost-Teval):(treatment_period_idx_fit+Tpost)],
+            "post_fit": Y_df.columns[treatment_period_idx_fit:(treatment_period_idx_fit+T1)],
+        }
+        vec_index["post_scaled"] = vec_index["post"]
     else:
-        pl_res_post_fit = None
-
-    # effects
-    pl_res_post_eval = _gen_placebo_stats_from_diffs(
-        diffs_post_eval_c,
-        diffs_post_eval_t,
-        max_n_pl,
-        ret_pl,
-        ret_CI,
-        level,
-        vec_index = post_eval_index
-    )
-
-    pl_res_post_eval_scaled = _gen_placebo_stats_from_diffs(
-        diffs_post_eval_scaled_c,
-        diffs_post_eval_scaled_t,
-        max_n_pl,
-        ret_pl,
-        ret_CI,
-        level,
-        vec_index = post_eval_index
-    )
+        vec_index = {}
+    # the placebo statistics are computed from these on first access
+    diffs = _merge_period_diffs(period_diffs, widths, vec_index)
 
     #reset to dataframes if possible
     if Y_df is not None:
@@ -413,14 +513,67 @@ def estimate_effects(
 
     est_ret = SparseSCEstResults(
         Y, fits, unit_treatment_periods, unit_treatment_periods_idx, unit_treatment_periods_idx_fit, 
-        T0, T1, pl_res_pre, pl_res_post_eval, pl_res_post_eval_scaled, max_n_pl, X, ind_CI, model_type, 
-        T2, pl_res_post_fit
+        T0, T1, max_n_pl=max_n_pl, covariates=X, model_type=model_type, T2=T2, diffs=diffs,
+        pl_seeds={"pre": pl_seeds[0], "post_fit": pl_seeds[1], "post": pl_seeds[2], "post_scaled": pl_seeds[3]},
+        ind_ci_seeds=ind_ci_seeds, ret_pl=ret_pl, ret_CI=ret_CI, level=level, exact_p=exact_p, pl_unique=pl_unique,
+        period_diffs=period_diffs, placebo_units=placebo_units,
     )
     if treatment_unit_size is not None:
         setattr(est_ret, 'treatment_unit_size', treatment_unit_size)
 
     return est_ret
 
+def _merge_period_diffs(period_diffs, widths, vec_index=None):
+    """
+    Stacks the differences of the treatment periods for the placebo tests.
+
+    :param period_diffs: dictionary of period->dict of the differences of
+        the treated units (``kind + "_t"``, a matrix) and of the control units
+        (``kind + "_c"``, a list of ``(block, repeats)`` pairs, as the control
+        blocks are repeated for each treated unit)
+    :param widths: dictionary of kind->number of periods of its differences
+    :param vec_index: dictionary of kind->index for the placebo statistics
+    :returns: dictionary of kind->(control diffs, treated diffs, vec_index)
+    """
+    vec_index = {} if vec_index is None else vec_index
+    diffs = {}
+    for kind, width in widths.items():
+        diffs[kind] = (
+            [block for diffs_i in period_diffs.values() for block in diffs_i[kind + "_c"]],
+            np.vstack([np.empty((0, width))] + [diffs_i[kind + "_t"] for diffs_i in period_diffs.values()]),
+            vec_index.get(kind),
+        )
+    return diffs
+
+
+def _honest_weights(cf_fits):
+    """
+    What :func:`_predict_honest` needs of the cross-fit folds: the rows of
+    each fold's weights for its test units and the donors they're over
+    (rather than the fits, with their own copies of the data).
+
+    :returns: [(weights, donors, test) for each fold] (``(None, None, test)``
+        for folds that were skipped)
+    """
+    return [(None, None, test) if fit_k is None else (fit_k.sc_weights[test], fit_k.control_units, test)
+            for fit_k, test in cf_fits]
+
+
+def _predict_honest(fit_res, Y_ct, control_units):
+    """
+    Predictions for the treated and control units of a treatment period,
+    with those of the control units from the cross-fit folds (kept in
+    ``fit_res.cf_weights``, if any) so that they are honest.
+    """
+    Y_sc = fit_res.predict(Y_ct)
+    cf_weights = getattr(fit_res, "cf_weights", None)
+    if cf_weights is not None:
+        Y_c = Y_ct[control_units,:]
+        for weights, donors, test in cf_weights:
+            Y_sc[control_units[test],:] = weights.dot(Y_c[donors,:]) if weights is not None else np.nan
+    return Y_sc
+
+
 def get_sample_masks(unit_treatment_periods, treatment_period, T1):
     """
     Returns the sample mask for a particular treatment period
@@ -442,8 +595,10 @@ class SparseSCEstResults(object):
 
     # pylint: disable=redefined-outer-name
     def __init__(self, outcomes, fits, unit_treatment_periods, unit_treatment_periods_idx, 
-    unit_treatment_periods_idx_fit, T0, T1, pl_res_pre, pl_res_post, pl_res_post_scaled, 
-    max_n_pl, covariates = None, ind_CI=None, model_type="retrospective", T2=None, pl_res_post_fit=None):
+    unit_treatment_periods_idx_fit, T0, T1, pl_res_pre=None, pl_res_post=None, pl_res_post_scaled=None, 
+    max_n_pl=10000, covariates = None, ind_CI=None, model_type="retrospective", T2=None, pl_res_post_fit=None,
+    diffs=None, pl_seeds=None, ind_ci_seeds=None, ret_pl=False, ret_CI=False, level=0.95, exact_p=False,
+    pl_unique=False, period_diffs=None, placebo_units=None):
         """
         :param outcomes: Outcome for the whole sample
         :param fits: The fit() return objects
@@ -474,6 +629,25 @@ class SparseSCEstResults(object):
         :param T2: T2 (if prospective-type design)
         :param pl_res_post_fit: If prospective-type designs, the PlaceboResults for target period used for fit 
             (still before actual treatment)
+        :param diffs: The differences from which the placebo statistics that
+            weren't passed in are computed (on first access), as
+            ``(control diffs, treated diffs, vec_index)`` for each of "pre",
+            "post", "post_scaled" and (if prospective-type designs) "post_fit"
+        :type diffs: dict
+        :param pl_seeds: Seeds for the placebos of each of the ``diffs``
+        :type pl_seeds: dict
+        :param ind_ci_seeds: Seeds for the placebos of the individual CIs
+        :type ind_ci_seeds: dictionary of period->seed
+        :param ret_pl: Whether the placebo statistics hold the placebos by default
+        :param ret_CI: Whether the placebo statistics hold CIs by default
+        :param level: Default level of the CIs
+        :param exact_p: Whether the p-values are exact (see :func:`estimate_effects`)
+        :param pl_unique: Whether the random placebos are drawn without replacement
+        :param period_diffs: The differences of each treatment period, from
+            which ``diffs`` are merged (needed by :meth:`extend`)
+        :type period_diffs: dictionary of period->dict
+        :param placebo_units: Mask of the units whose placebo effects are used
+            for inference (or None for all the control units)
         """
         self.Y = outcomes
         self.X = covariates
@@ -484,15 +658,108 @@ class SparseSCEstResults(object):
         self.T0 = T0
         self.T1 = T1
         self.T2 = T2
-        self.pl_res_pre = pl_res_pre
-        self.pl_res_post = pl_res_post
-        self.pl_res_post_scaled = pl_res_post_scaled
-        self.ind_CI = ind_CI
         self.model_type = model_type
-        self.pl_res_post_fit = pl_res_post_fit
         self.Tpost = T1 if model_type=='retrospective' else T1+T2
+        #: Number of periods the evaluation window has been extended by (see :meth:`extend`)
+        self.T_extended = 0
         self.max_n_pl = max_n_pl
+        self.ret_pl = ret_pl
+        self.ret_CI = ret_CI
+        self.level = level
+        self.exact_p = exact_p
+        self.pl_unique = pl_unique
+        self.placebo_units = placebo_units
         self._using_dt_index = (unit_treatment_periods.dtype.kind=='M')
+        self._diffs = diffs if diffs is not None else {}
+        self._period_diffs = period_diffs
+        self._pl_seeds = pl_seeds if pl_seeds is not None else {}
+        self._ind_ci_seeds = ind_ci_seeds if ind_ci_seeds is not None else {}
+        self._pl_res_cache = {}
+        self._ind_CI_cache = {}
+        default_key = (ret_pl, ret_CI, level if ret_CI else None)
+        for kind, pl_res in (("pre", pl_res_pre), ("post", pl_res_post), ("post_scaled", pl_res_post_scaled),
+                             ("post_fit", pl_res_post_fit)):
+            if pl_res is not None:
+                self._pl_res_cache[(kind,) + default_key] = pl_res
+        if ind_CI is not None:
+            self._ind_CI_cache[level] = ind_CI
+
+    def get_pl_res(self, kind="post", level=None, ret_pl=None, ret_CI=None):
+        """
+        Placebo statistics, computed on first access and then cached.
+
+        :param kind: Which differences: "pre" (the pre-period fit), "post" (the
+            treatment effects), "post_scaled" (the effects scaled by the
+            pre-period RMS fit) or "post_fit" (the target period used for fit
+            in prospective-type designs)
+        :param level: Level of the CIs (implies ``ret_CI``). Defaults to the
+            one passed to :func:`estimate_effects`.
+        :param ret_pl: Keep the placebos. Defaults to the one passed to
+            :func:`estimate_effects`.
+        :param ret_CI: Compute CIs. Defaults to the one passed to
+            :func:`estimate_effects`.
+
+        :returns: the statistics (or None for "post_fit" in retrospective designs)
+        :rtype: PlaceboResults
+        :raises ValueError: when the differences for ``kind`` weren't kept
+        """
+        if ret_CI is None:
+            ret_CI = self.ret_CI or level is not None
+        if ret_pl is None:
+            ret_pl = self.ret_pl
+        if level is None:
+            level = self.level
+        key = (kind, ret_pl, ret_CI, level if ret_CI else None)
+        if key not in self._pl_res_cache:
+            if kind == "post_fit" and self.model_type == "retrospective":
+                return None
+            if kind not in self._diffs:
+                raise ValueError("The differences for '%s' weren't kept" % kind)
+            control_diffs, treated_diffs, vec_index = self._diffs[kind]
+            self._pl_res_cache[key] = _gen_placebo_stats_from_diffs(
+                control_diffs,
+                treated_diffs,
+                self.max_n_pl,
+                ret_pl,
+                ret_CI,
+                level,
+                vec_index = vec_index,
+                exact = self.exact_p,
+                seed = self._pl_seeds.get(kind),
+                unique = self.pl_unique,
+            )
+        return self._pl_res_cache[key]
+
+    @property
+    def pl_res_pre(self):
+        """
+        Statistics for the average fit of the treated units in the pre-period
+        (used for diagnostics).
+        """
+        return self.get_pl_res("pre")
+
+    @property
+    def pl_res_post(self):
+        """
+        Statistics for the average treatment effect in the post-period.
+        """
+        return self.get_pl_res("post")
+
+    @property
+    def pl_res_post_scaled(self):
+        """
+        Statistics for the average scaled treatment effect (difference divided
+        by pre-treatment RMS fit) in the post-period.
+        """
+        return self.get_pl_res("post_scaled")
+
+    @property
+    def pl_res_post_fit(self):
+        """
+        If prospective-type designs, the statistics for target period used for
+        fit (still before actual treatment), else None.
+        """
+        return self.get_pl_res("post_fit")
 
     @property
     def p_value(self):
@@ -511,7 +778,149 @@ class SparseSCEstResults(object):
         p-value for the current model if relevant, else None.
         """
         return self.pl_res_post.avg_joint_effect
+
+    def get_CI(self, level=None):
+        """
+        The average treatment effect with its confidence interval, computed
+        for ``level`` (by default the one passed to :func:`estimate_effects`)
+        on first access.
+
+        :rtype: EstResultCI
+        """
+        return self.get_pl_res("post", level=level if level is not None else self.level).avg_joint_effect
+
+    @property
+    def ind_CI(self):
+        """
+        Confidence intervals for SC predictions at the unit level (if
+        ``ret_CI``, else None). See :meth:`get_ind_CI`.
+        """
+        if not self.ret_CI and self.level not in self._ind_CI_cache:
+            return None
+        return self.get_ind_CI()
+
+    def get_ind_CI(self, level=None):
+        """
+        Confidence intervals for SC predictions at the unit level (not
+        averaged over N1), computed on first access. Used for graphing rather
+        than treatment effect statistics.
+
+        :param level: Level of the CIs. Defaults to the one passed to
+            :func:`estimate_effects`.
+        :returns: dictionary of period->CI_int. Each CI_int is for the full
+            sample (not necessarily T0+T1)
+        """
+        if level is None:
+            level = self.level
+        if level not in self._ind_CI_cache:
+            if isinstance(self.Y, pd.DataFrame):
+                Y, vec_index = self.Y.values, self.Y.columns
+            else:
+                Y, vec_index = self.Y, None
+            ind_CI = {}
+            for treatment_period in self.fits:
+                if treatment_period not in self._ind_ci_seeds:
+                    raise ValueError("The seeds for the individual CIs weren't kept")
+                _, treatment_period_idx_fit, _ = self.get_tr_time_info(treatment_period)
+                c_units_mask, _, ct_units_mask = get_sample_masks(self.unit_treatment_periods_idx_fit, treatment_period_idx_fit, self.Tpost)
+                if self.placebo_units is not None:
+                    c_units_mask = c_units_mask & self.placebo_units
+                diffs_full = Y[ct_units_mask,:] - self.fits[treatment_period].predict(Y[ct_units_mask,:])
+                ind_CI[treatment_period] = _gen_placebo_stats_from_diffs(
+                    diffs_full[c_units_mask[ct_units_mask],:], np.zeros((1,diffs_full.shape[1])),
+                    self.max_n_pl, False, True, level, vec_index=vec_index,
+                    seed=self._ind_ci_seeds[treatment_period], unique=self.pl_unique).effect_vec.ci
+            self._ind_CI_cache[level] = ind_CI
+        return self._ind_CI_cache[level]
     
+    def extend(self, new_outcomes):
+        """
+        Extends the evaluation window of each treatment period with new
+        (later) outcome periods, e.g. as they are observed, without
+        re-estimating. The synthetic controls for the new periods come from
+        the stored fits (and, for the control units, the cross-fit folds), so
+        the match, weights and placebo draws stay as they were. The placebo
+        statistics of the post-period and the individual CIs are recomputed
+        on their next access.
+
+        The fits can't be reused once any of a treatment period's controls
+        is treated within its extended window (e.g. with staggered adoption),
+        as :func:`estimate_effects` would drop it from the controls. Use
+        :func:`estimate_effects` to re-estimate then, and to estimate new
+        treatment periods.
+
+        :param new_outcomes: Outcomes for the new periods (appended to the
+            columns of the outcomes)
+        :type new_outcomes: np.array or pd.DataFrame (if the outcomes were)
+            with shape (N,T_new)
+        :raises ValueError: when the differences of the treatment periods
+            weren't kept, ``new_outcomes`` doesn't match the outcomes, or a
+            control unit would be treated within the extended window
+        """
+        if self._period_diffs is None:
+            raise ValueError("The differences of the treatment periods weren't kept")
+        if isinstance(self.Y, pd.DataFrame):
+            if not isinstance(new_outcomes, pd.DataFrame):
+                raise ValueError("new_outcomes must be a pd.DataFrame (as the outcomes are)")
+            Y = pd.concat((self.Y, new_outcomes.reindex(self.Y.index)), axis=1)
+            Y_vals = Y.values
+        else:
+            new_outcomes = np.asarray(new_outcomes)
+            if new_outcomes.ndim != 2 or new_outcomes.shape[0] != self.Y.shape[0]:
+                raise ValueError("new_outcomes must have a row for each unit")
+            Y = np.hstack((self.Y, new_outcomes))
+            Y_vals = Y
+        T_new = Y.shape[1] - self.Y.shape[1]
+        Teval = self.T1 if self.model_type=="retrospective" else self.T2
+
+        masks = {}
+        for treatment_period in self._period_diffs:
+            _, treatment_period_idx_fit, _ = self.get_tr_time_info(treatment_period)
+            masks[treatment_period] = get_sample_masks(self.unit_treatment_periods_idx_fit, treatment_period_idx_fit, self.Tpost)
+            c_units_mask_ext, _, _ = get_sample_masks(self.unit_treatment_periods_idx_fit, treatment_period_idx_fit,
+                                                      self.Tpost + self.T_extended + T_new)
+            if np.any(masks[treatment_period][0] != c_units_mask_ext):
+                raise ValueError("Some controls of treatment period %s are treated within its extended window. "
+                                 "Re-estimate with estimate_effects()." % (treatment_period,))
+
+        for treatment_period, diffs_i in self._period_diffs.items():
+            _, treatment_period_idx_fit, _ = self.get_tr_time_info(treatment_period)
+            c_units_mask, t_units_mask, ct_units_mask = masks[treatment_period]
+            control_units = c_units_mask[ct_units_mask].nonzero()[0]
+            treated_units = t_units_mask[ct_units_mask].nonzero()[0]
+            placebo_controls = control_units if self.placebo_units is None else control_units[self.placebo_units[c_units_mask]]
+            # the evaluation window continues into the next periods
+            start = treatment_period_idx_fit + self.Tpost + self.T_extended
+            Y_ct = Y_vals[ct_units_mask, start:(start+T_new)]
+            diffs = Y_ct - _predict_honest(self.fits[treatment_period], Y_ct, control_units)
+            rmspes_pre = np.sqrt(np.mean(np.square(diffs_i["pre_c"][0][0]), axis=1))
+            diffs_scaled = diffs[placebo_controls,:] / rmspes_pre[:, np.newaxis]
+            doses = diffs_i["doses"]
+            diffs_i["post_t"] = np.hstack((diffs_i["post_t"], diffs[treated_units,:] / doses[:, np.newaxis]))
+            rmspes_pre_t = np.sqrt(np.mean(np.square(diffs_i["pre_t"]), axis=1))
+            diffs_i["post_scaled_t"] = np.hstack((diffs_i["post_scaled_t"],
+                                                  diffs[treated_units,:] / (rmspes_pre_t * doses)[:, np.newaxis]))
+            dose_runs = [dose for dose, _ in itertools.groupby(doses)]
+            diffs_i["post_c"] = [(np.hstack((block, diffs[placebo_controls,:] / dose)), repeats)
+                                 for (block, repeats), dose in zip(diffs_i["post_c"], dose_runs)]
+            diffs_i["post_scaled_c"] = [(np.hstack((block, diffs_scaled / dose)), repeats)
+                                        for (block, repeats), dose in zip(diffs_i["post_scaled_c"], dose_runs)]
+
+        vec_index = {kind: index for kind, (_, _, index) in self._diffs.items() if index is not None}
+        if "post" in vec_index:
+            # a single treatment period
+            new_index = Y.columns[start:(start+T_new)]
+            vec_index["post"] = vec_index["post_scaled"] = vec_index["post"].append(new_index)
+        widths = {kind: treated_diffs.shape[1] for kind, (_, treated_diffs, _) in self._diffs.items()}
+        widths["post"] = widths["post_scaled"] = Teval + self.T_extended + T_new
+        self._diffs = _merge_period_diffs(self._period_diffs, widths, vec_index)
+
+        self.Y = Y
+        self.T_extended += T_new
+        self._pl_res_cache = {key: pl_res for key, pl_res in self._pl_res_cache.items()
+                              if key[0] not in ("post", "post_scaled")}
+        self._ind_CI_cache = {}
+
     def _default_treatment_period(self, treatment_period=None):
         if treatment_period is None:
             t_periods = self.fits.keys()
@@ -543,14 +952,18 @@ class SparseSCEstResults(object):
 
     def get_W(self, treatment_period=None):
         """
-        Get W (np.ndarray 2D or pd.DataFrame depends on what was passed in) for one of the treatment periods
+        Get W (np.ndarray 2D or pd.DataFrame depends on what was passed in) for one of the treatment periods.
+        For compressed fits these are a scipy.sparse matrix or a sparse pd.DataFrame.
         """
         treatment_period = self._default_treatment_period(treatment_period)
         _, treatment_period_idx_fit, _ = self.get_tr_time_info(treatment_period)
         fit = self.fits[treatment_period]
         if isinstance(self.Y, pd.DataFrame):
             c_units_mask, _, ct_units_mask = get_sample_masks(self.unit_treatment_periods_idx_fit, treatment_period_idx_fit, self.Tpost)
-            return pd.DataFrame(fit.sc_weights, index=self.Y.iloc[ct_units_mask,:].index, columns = self.Y.iloc[c_units_mask,:].index)
+            index, columns = self.Y.iloc[ct_units_mask,:].index, self.Y.iloc[c_units_mask,:].index
+            if scipy.sparse.issparse(fit.sc_weights): # compressed fit
+                return pd.DataFrame.sparse.from_spmatrix(fit.sc_weights, index=index, columns=columns)
+            return pd.DataFrame(fit.sc_weights, index=index, columns=columns)
         else:
             return fit.sc_weights
 
@@ -6,6 +6,7 @@ from os.path import join
 from warnings import warn
 from inspect import signature
 import numpy as np
+import scipy.sparse
 from sklearn.metrics import r2_score
 
 from .utils.penalty_utils import get_max_w_pen, get_max_v_pen, w_pen_guestimate
@@ -13,7 +14,10 @@ from .cross_validation import CV_score
 from .tensor import tensor
 from .weights import weights
 from .utils.warnings import SparseSCWarning
-from .utils.misc import _ensure_good_donor_pool, _get_fit_units
+from .utils.misc import _get_fit_units
+from .utils.donor_pool import as_donor_pool
+from .utils.planner import plan_gradient, _format_bytes
+from .utils.result_cache import _as_result_cache
 
 # pylint: disable=too-many-lines, inconsistent-return-statements, fixme
 
@@ -50,6 +54,8 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
     gradient_folds=10,
     w_pen_inner=False,
     match_space_maker=None,
+    memory_budget=None,
+    search="grid",
     **kwargs
 ):
     r"""
@@ -116,6 +122,28 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         associated with the lowest cross validation error.
     :type choice: str or function. default = ``"min"``
 
+    :param search: How the penalty grid (``v_pen`` or ``w_pen``, whichever
+        is an iterable) is searched.  ``"grid"`` scores every point with
+        cross validation.  ``"adaptive"`` treats the grid as a range and a
+        resolution: it brackets the minimum of the cross validation error
+        with a coarse pass over ``log(penalty)`` and refines it by
+        golden-section search (see :func:`_adaptive_search`), which
+        typically needs 6-8 cross validations rather than one per grid point.
+        Every evaluated penalty is recorded in ``scores`` and the ``choice``
+        rule is applied to the evaluated points.  ``"joint"`` replaces the
+        alternating (coordinate descent) search over ``v_pen`` and ``w_pen``
+        with a single cross validation over the grid of both: ``v_pen``
+        defaults to ``grid`` times the maximum ``v_pen``, and ``w_pen`` (or
+        the ``w_pen`` guestimate when it is not provided) is multiplied by
+        ``numpy.logspace(-2, 2, 5)`` unless it is already an iterable.  The
+        grid is traversed with warm starts and hopeless regions are pruned
+        unless ``prune=False`` (see
+        :func:`SparseSC.cross_validation.CV_score`), and ``scores`` is a 2-D
+        array with one row per ``w_pen`` and one column per ``v_pen``.
+        When both ``v_pen`` and ``w_pen`` are iterables the joint search is
+        always used.
+    :type search: str, default = ``"grid"``
+
     :param cv_folds: An integer number of Cross Validation folds passed to
         :func:`sklearn.model_selection.KFold`, or an explicit list of train
         validation folds. TODO: These folds are calculated with
@@ -131,6 +159,22 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
     :type gradient_folds: int or (int[],int[])[]
 
 
+    :param memory_budget: Memory budget in bytes for the gradient descent.
+        Before fitting, the memory and compute required by the requested
+        gradient strategy are estimated (see
+        :func:`SparseSC.utils.planner.plan_gradient`) and when it does not fit,
+        fewer gradient folds are used or an error is raised up front. Defaults
+        to the available memory (``MemAvailable``, where it can be determined,
+        and otherwise no budget). The plan is recorded in the
+        ``gradient_plan`` attribute of the returned fit.
+    :type memory_budget: float, optional
+
+    :param result_cache: An opt-in on-disk cache for the cross validation
+        scores (see :class:`SparseSC.utils.result_cache.ScoreCache`), or the
+        name of a directory in which to keep one.  Repeated fits with the
+        same data and parameters read their scores from the cache.
+    :type result_cache: :class:`SparseSC.utils.result_cache.ScoreCache` or str, optional
+
     :param cv_seed:  passed to :func:`sklearn.model_selection.KFold`
         to allow for consistent cross validation folds across calls
     :type cv_seed: int, default = 10101
@@ -151,7 +195,10 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
     :param custom_donor_pool: By default all control units are allowed to be donors
         for all units. There are cases where this is not desired and so the user
         can pass in a matrix specifying a unit-specific donor pool (NxC matrix
-        of booleans).
+        of booleans, dense or :mod:`scipy.sparse`), a list with the positions
+        of the donors of each unit, or a
+        :class:`SparseSC.utils.donor_pool.DonorPool` (e.g. from
+        ``DonorPool.from_groups()`` to only allow donors in the same region).
         Common reasons for restricting the allowability:
         (a) When we would like to reduce interpolation bias by restricting the
         donor pool to those units similar along certain features.
@@ -160,7 +207,7 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         Single Unit Treatment Value Assumption (SUTVA).
         Note: These are not used in the fitting stage (of V and penalties) just
         in final unit weight determination.
-    :type custom_donor_pool: boolean, default = ``None``
+    :type custom_donor_pool: boolean or :class:`SparseSC.utils.donor_pool.DonorPool`, default = ``None``
 
     :Keyword Args:
 
@@ -213,13 +260,16 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
     Y = np.asmatrix(Y) # this needs to be deprecated properly -- bc Array.dot(Array) != matrix(Array).dot(matrix(Array)) -- not even close !!!
     X = np.asmatrix(X)
 
+    if search not in ("grid", "adaptive", "joint"):
+        raise ValueError("Unexpected value for search parameter: %s" % search)
+
     w_pen_is_iterable = False
     try:
         iter(w_pen)
     except TypeError:
         pass
     else:
-        if v_pen is None:
+        if v_pen is None and search != "joint":
             raise ValueError("When w_pen is an iterable, v_pen must be provided")
         w_pen_is_iterable = True
 
@@ -230,19 +280,16 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         pass
     else:
         v_pen_is_iterable = True
-        if w_pen is None:
+        if w_pen is None and search != "joint":
             raise ValueError("When v_pen is an iterable, w_pen must be provided")
 
-    if v_pen_is_iterable and w_pen_is_iterable:
-        #We should be able to swap these in for the grids below and still do coordinate-descent.
-        raise ValueError("Feature weight and unit weight penalties are both iterables and this is not currently implemented.")
-
     if (
-        v_pen_is_iterable
-        or w_pen_is_iterable
-        or (v_pen is not None and w_pen is not None)
+        (v_pen_is_iterable and w_pen_is_iterable)
+        or (search != "joint" and v_pen_is_iterable)
+        or (search != "joint" and w_pen_is_iterable)
+        or (search != "joint" and v_pen is not None and w_pen is not None)
     ):
-        return _fit(X, Y, treated_units, w_pen, v_pen, gradient_folds=gradient_folds,**kwargs)
+        return _fit(X, Y, treated_units, w_pen, v_pen, gradient_folds=gradient_folds, memory_budget=memory_budget, search=search, **kwargs)
     
     if treated_units is not None:
         control_units = [u for u in range(Y.shape[0]) if u not in treated_units]
@@ -261,13 +308,11 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
             control_units = [u for u in range(Y.shape[0])]
         N = Y.shape[0]
         N0 = len(control_units)
-        custom_donor_pool = kwargs.get("custom_donor_pool", np.full((N,N0), True))
-        assert custom_donor_pool.shape == (N,N0)
-        custom_donor_pool = _ensure_good_donor_pool(custom_donor_pool, control_units)
+        custom_donor_pool = as_donor_pool(kwargs.get("custom_donor_pool"), N, N0).exclude_self(control_units)
         sc_weights = np.full((N,N0), 0.)
         for i in range(N):
-            allowed = custom_donor_pool[i,:]
-            sc_weights[i,allowed] = 1/np.sum(allowed)
+            allowed = custom_donor_pool.donors(i)
+            sc_weights[i,allowed] = 1/len(allowed)
 
         Y_sc = sc_weights.dot(Y[control_units, :])
         fit_units = _get_fit_units(model_type, control_units, treated_units, Y.shape[0])
@@ -297,12 +342,12 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         X_v = X[fit_units, :]
         Y_v = Y[fit_units,:]
         def _fit_model_wrapper(MatchSpace, V): #disregard V
-            return fit(MatchSpace.transform(X), Y, treated_units, w_pen, v_pen, grid, grid_min, grid_max, grid_length, stopping_rule, gradient_folds, w_pen_inner, **kwargs)
+            return fit(MatchSpace.transform(X), Y, treated_units, w_pen, v_pen, grid, grid_min, grid_max, grid_length, stopping_rule, gradient_folds, w_pen_inner, memory_budget=memory_budget, search=search, **kwargs)
         MatchSpace, _, _, MatchSpaceDesc = match_space_maker(X_v, Y_v, fit_model_wrapper=_fit_model_wrapper) #drop V, best_v_pen
 
         M = MatchSpace.transform(X)
 
-        fit_inner = fit(M, Y, treated_units, w_pen, v_pen, grid, grid_min, grid_max, grid_length, stopping_rule, gradient_folds, w_pen_inner, **kwargs)
+        fit_inner = fit(M, Y, treated_units, w_pen, v_pen, grid, grid_min, grid_max, grid_length, stopping_rule, gradient_folds, w_pen_inner, memory_budget=memory_budget, search=search, **kwargs)
         #fix-up
         fit_inner.match_space = M
         fit_inner.features = X
@@ -310,6 +355,18 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         fit_inner.match_space_desc = MatchSpaceDesc
         return(fit_inner)
 
+    # --------------------------------------------------
+    # PRE-FLIGHT: CHOOSE A GRADIENT STRATEGY THAT FITS IN MEMORY
+    # --------------------------------------------------
+    gradient_plan = _plan_gradient(
+        X, treated_units, model_type, gradient_folds, memory_budget
+    )
+    gradient_folds = gradient_plan.grad_splits
+
+    if kwargs.get("result_cache", None) is not None:
+        # share the hit / miss counts across the iterations
+        kwargs["result_cache"] = _as_result_cache(kwargs["result_cache"])
+
     # --------------------------------------------------
     # BUILD THE COORDINATE DESCENT PARAMETERS
     # --------------------------------------------------
@@ -321,6 +378,41 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
     else:
         _X, _Y = X, Y
 
+    if search == "joint":
+        # --------------------------------------------------
+        # JOINT SEARCH OVER THE GRID OF BOTH PENALTIES
+        # --------------------------------------------------
+        if w_pen_inner:
+            raise ValueError("search='joint' can't be combined with w_pen_inner")
+        if w_pen is None:
+            w_pen = w_pen_guestimate(_X)
+        if not w_pen_is_iterable:
+            w_pen = w_pen * _JOINT_W_PEN_GRID
+        if v_pen is None:
+            # the maximum v_pen is inversely proportional to w_pen (see
+            # get_max_w_pen), so span the grid at each end of the w_pen's
+            max_v_pen_w1 = get_max_v_pen(
+                _X, _Y, w_pen=1, grad_splits=gradient_folds, verbose=kwargs.get("verbose", 1)
+            )
+            v_pen = np.exp(
+                np.linspace(
+                    np.log(np.min(grid) * max_v_pen_w1 / np.max(w_pen)),
+                    np.log(np.max(grid) * max_v_pen_w1 / np.min(w_pen)),
+                    len(grid),
+                )
+            )
+        elif not v_pen_is_iterable:
+            v_pen = [v_pen]
+
+        model_fit = _fit(X, Y, treated_units, w_pen, v_pen, gradient_folds=gradient_folds, memory_budget=memory_budget,
+                         gradient_plan=gradient_plan, **kwargs)
+        if not model_fit:
+            # this happens when only a batch file is being produced but not executed
+            return
+        model_fit.model_fits = [model_fit]
+        model_fit.gradient_plan = gradient_plan
+        return model_fit
+
     # Herein, either v_pen or w_pen is None (possibly both)
     if w_pen_inner:
         N, K = X.shape
@@ -382,7 +474,8 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         if w_pen_inner:
             w_pen = base_w_pen
 
-        model_fit = _fit(X, Y, treated_units, w_pen, v_pen, gradient_folds=gradient_folds, w_pen_inner=w_pen_inner, **kwargs)
+        model_fit = _fit(X, Y, treated_units, w_pen, v_pen, gradient_folds=gradient_folds, w_pen_inner=w_pen_inner, memory_budget=memory_budget, search=search,
+                         gradient_plan=gradient_plan, **kwargs)
 
         if not model_fit:
             # this happens when only a batch file is being produced but not executed
@@ -404,9 +497,46 @@ def fit(  # pylint: disable=differing-type-doc, differing-param-doc
         _iteration += 1
 
     model_fit.model_fits = model_fits
+    model_fit.gradient_plan = gradient_plan
     return model_fit
 
 
+#: Multiples of the w_pen used by ``fit(..., search="joint")``
+_JOINT_W_PEN_GRID = np.logspace(-2, 2, 5)
+
+
+def _plan_gradient(X, treated_units, model_type, gradient_folds, memory_budget):
+    """ Estimate the cost of the requested gradient strategy and choose one
+    that fits within the memory budget (see :func:`plan_gradient`)
+    """
+    N, K = X.shape
+    if treated_units is None:
+        N1 = 0
+    else:
+        _t = list(treated_units)
+        N1 = sum(_t) if _t and isinstance(_t[0], (bool, np.bool_)) else len(_t)
+
+    if model_type == "prospective-restricted":
+        plan = plan_gradient(
+            N - N1, K, N1=N1, treated_holdout=True, memory_budget=memory_budget
+        )
+        # gradient folds are not used by the treated / control gradient
+        plan.grad_splits = gradient_folds
+        return plan
+
+    if model_type == "retrospective":
+        N = N - N1
+    plan = plan_gradient(N, K, grad_splits=gradient_folds, memory_budget=memory_budget)
+    if plan.changed:
+        warn(
+            "The %s gradient is estimated to require more than the memory budget "
+            "(%s); using %s (%s) instead"
+            % (plan.requested, _format_bytes(plan.memory_budget), plan.label, _format_bytes(plan.memory)),
+            SparseSCParameterWarning,
+        )
+    return plan
+
+
 def _build_penalties(X, Y, v_pen, w_pen, grid, gradient_folds, verbose):
     """ Build (sensible?) defaults for the v_pen and w_pen
     """
@@ -456,6 +586,11 @@ def _fit(
     progress=True,
     batchDir=None,
     w_pen_inner=False,
+    memory_budget=None,
+    result_cache=None,
+    search="grid",
+    prune=True,
+    gradient_plan=None,
     **kwargs
 ):
     assert X.shape[0] == Y.shape[0]
@@ -463,6 +598,16 @@ def _fit(
     if (not callable(choice)) and (choice not in ("min", "1se")):
         # Fail Faster (tm)
         raise ValueError("Unexpected value for choice parameter: %s" % choice)
+    if search not in ("grid", "adaptive", "joint"):
+        raise ValueError("Unexpected value for search parameter: %s" % search)
+
+    if gradient_plan is None:
+        # not already planned by fit()
+        gradient_plan = _plan_gradient(
+            X, treated_units, model_type, gradient_folds, memory_budget
+        )
+    gradient_folds = gradient_plan.grad_splits
+    result_cache = _as_result_cache(result_cache)
 
     w_pen_is_iterable = False
     try:
@@ -485,7 +630,8 @@ def _fit(
             raise ValueError("When v_pen is an iterable, w_pen must be provided")
 
     if v_pen_is_iterable and w_pen_is_iterable:
-        raise ValueError("Features and Weights penalties are both iterables")
+        # joint search over the grid of both penalties
+        v_pen, w_pen = np.asarray(v_pen), np.asarray(w_pen)
 
     if batchDir is not None:
 
@@ -517,6 +663,34 @@ def _fit(
         with open(join(batchDir, _BATCH_FIT_FILE_NAME), "w") as fp:
             fp.write(dump(_fit_params, Dumper=Dumper))
 
+    def _score_penalties(**cv_kwargs):
+        """ Cross validation scores for the penalty grid, or for the points
+        chosen by the adaptive search, in which case the penalty grid is
+        replaced with the evaluated penalties
+
+        Nested here for access to v_pen, w_pen, search and choice via Lexical
+        Scoping
+        """
+        nonlocal v_pen, w_pen
+        if search != "adaptive" or batchDir is not None or not (
+            v_pen_is_iterable != w_pen_is_iterable
+        ):
+            return CV_score(v_pen=v_pen, w_pen=w_pen, prune=prune, **cv_kwargs)
+
+        if v_pen_is_iterable:
+            v_pen, scores, scores_se = _adaptive_search(
+                lambda _v_pen: CV_score(v_pen=_v_pen, w_pen=w_pen, **cv_kwargs),
+                v_pen,
+                choice,
+            )
+        else:
+            w_pen, scores, scores_se = _adaptive_search(
+                lambda _w_pen: CV_score(v_pen=v_pen, w_pen=_w_pen, **cv_kwargs),
+                w_pen,
+                choice,
+            )
+        return scores, scores_se
+
     def _choose(scores, scores_se):
         """ helper function which implements the choice of covariate weights penalty parameter
 
@@ -524,6 +698,9 @@ def _fit(
         v_pen_is_iterable, and choice, via Lexical Scoping
         """
         # GET THE INDEX OF THE BEST SCORE
+        if w_pen_is_iterable and v_pen_is_iterable:
+            indx = _which_2d(scores, scores_se, choice, w_pen, v_pen)
+            return v_pen[indx[1]], w_pen[indx[0]], scores[indx], indx
         if w_pen_is_iterable:
             indx = _which(scores, scores_se, choice)
             return v_pen, w_pen[indx], scores[indx], indx
@@ -576,18 +753,18 @@ def _fit(
             # --------------------------------------------------
 
             # SCORES FOR EACH VALUE OF THE GRID: very slow ( minutes to hours )
-            ret = CV_score(
+            ret = _score_penalties(
                 X=Xtrain,
                 Y=Ytrain,
                 splits=cv_folds,
-                v_pen=v_pen,
-                w_pen=w_pen,
                 progress=progress,
                 grad_splits=gradient_folds,
                 random_state=gradient_seed,  # TODO: Cleanup Task 1
                 quiet=not progress,
                 batchDir=batchDir,
                 w_pen_inner=w_pen_inner,
+                memory_budget=memory_budget,
+                result_cache=result_cache,
                 **kwargs
             )
             if not ret:
@@ -665,18 +842,18 @@ def _fit(
             # --------------------------------------------------
 
             # SCORES FOR EACH VALUE OF THE GRID: very slow ( minutes to hours )
-            ret = CV_score(
+            ret = _score_penalties(
                 X=X,
                 Y=Y,
                 splits=cv_folds,
-                v_pen=v_pen,
-                w_pen=w_pen,
                 progress=progress,
                 grad_splits=gradient_folds,
                 random_state=gradient_seed,  # TODO: Cleanup Task 1
                 quiet=not progress,
                 batchDir=batchDir,
                 w_pen_inner=w_pen_inner,
+                memory_budget=memory_budget,
+                result_cache=result_cache,
                 **kwargs
             )
             if not ret:
@@ -712,18 +889,18 @@ def _fit(
             # --------------------------------------------------
 
             # SCORES FOR EACH VALUE OF THE GRID: very slow ( minutes to hours )
-            ret = CV_score(
+            ret = _score_penalties(
                 X=Xtrain,
                 Y=Ytrain,
                 X_treat=Xtest,
                 Y_treat=Ytest,
                 splits=cv_folds,
-                v_pen=v_pen,
-                w_pen=w_pen,
                 progress=progress,
                 quiet=not progress,
                 batchDir=batchDir,
                 w_pen_inner=w_pen_inner,
+                memory_budget=memory_budget,
+                result_cache=result_cache,
                 **kwargs
             )
             if not ret:
@@ -759,8 +936,9 @@ def _fit(
             custom_donor_pool_t = None
             custom_donor_pool_c = None
         else:
-            custom_donor_pool_t = custom_donor_pool[treated_units, :]
-            custom_donor_pool_c = custom_donor_pool[control_units, :]
+            custom_donor_pool = as_donor_pool(custom_donor_pool, X.shape[0], len(control_units))
+            custom_donor_pool_t = custom_donor_pool.subset(treated_units)
+            custom_donor_pool_c = custom_donor_pool.subset(control_units)
         sc_weights[treated_units, :] = weights(
             Xtrain,
             Xtest,
@@ -786,18 +964,18 @@ def _fit(
         # --------------------------------------------------
 
         # SCORES FOR EACH VALUE OF THE GRID: very slow ( minutes to hours )
-        ret = CV_score(
+        ret = _score_penalties(
             X=X,
             Y=Y,
             splits=cv_folds,
-            v_pen=v_pen,
             progress=progress,
-            w_pen=w_pen,
             grad_splits=gradient_folds,
             random_state=gradient_seed,  # TODO: Cleanup Task 1
             quiet=not progress,
             batchDir=batchDir,
             w_pen_inner=w_pen_inner,
+            memory_budget=memory_budget,
+            result_cache=result_cache,
             **kwargs
         )
         if not ret:
@@ -827,7 +1005,7 @@ def _fit(
             X, V=best_V, w_pen=best_w_pen, custom_donor_pool=custom_donor_pool
         )
 
-    return SparseSCFit(
+    model_fit = SparseSCFit(
         features=X,
         targets=Y,
         control_units=control_units,
@@ -845,6 +1023,8 @@ def _fit(
         scores=scores,
         selected_score=which,
     )
+    model_fit.gradient_plan = gradient_plan
+    return model_fit
 
 
 class SparseSCFit(object):
@@ -853,6 +1033,8 @@ class SparseSCFit(object):
     """
 
     model_fits = None
+    #: The :class:`SparseSC.utils.planner.GradientPlan` used when fitting V
+    gradient_plan = None
 
     def __init__(
         self,
@@ -907,9 +1089,7 @@ class SparseSCFit(object):
         if match_space is not None:
             M=match_space
         if len(V)>0:
-            self.trivial_units = np.apply_along_axis(
-                lambda x: (x == 0).all(), 1, np.hstack([M[:, np.diag(V) != 0], targets])
-            )
+            self.trivial_units = _trivial_units(M[:, np.diag(V) != 0], targets)
         else:
             self.trivial_units = np.full((targets.shape[0]), False)
         if self.trivial_units.any():
@@ -926,7 +1106,10 @@ class SparseSCFit(object):
             targets_sc = sc_weights.dot(targets[control_units, :])
         elif sc_weights is None:
             self.targets_sc = targets_sc
-        self.score_R2 = r2_score(targets[fit_units,:].flatten(), targets_sc[fit_units,:].flatten())
+        self.score_R2 = _blocked_r2(targets, targets_sc, fit_units)
+
+    #: Approximation error of :meth:`compress` (``None`` until it is called)
+    compression_error = None
 
     @property
     def sc_weights(self):
@@ -935,17 +1118,31 @@ class SparseSCFit(object):
         """
         return self.get_weights()
 
+    def _trivial_donors(self):
+        if self.model_type != "full":
+            return self.trivial_units[self.control_units]
+        return self.trivial_units
+
     def get_weights(self, include_trivial_donors=True):
         """
         getter for the sc_weights. By default, the trivial
+
+        The weights are a :class:`scipy.sparse.csr_matrix` once the fit has
+        been compressed (see :meth:`compress`).
         """
         if include_trivial_donors or not self.trivial_units.any():
             return self._sc_weights
 
-        if self.model_type != "full":
-            trivial_donors = self.trivial_units[self.control_units]
-        else:
-            trivial_donors = self.trivial_units
+        trivial_donors = self._trivial_donors()
+
+        if scipy.sparse.issparse(self._sc_weights):
+            __weights = self._sc_weights.tocoo(copy=True)
+            __weights.data[
+                np.logical_not(self.trivial_units[__weights.row]) & trivial_donors[__weights.col]
+            ] = 0
+            __weights = __weights.tocsr()
+            __weights.eliminate_zeros()
+            return __weights
 
         __weights = self._sc_weights.copy()
         __weights[np.ix_(np.logical_not(self.trivial_units), trivial_donors)] = 0
@@ -970,7 +1167,7 @@ class SparseSCFit(object):
 
         :raises ValueError: When ``targets.shape[0]`` is inconsistent with the fitted model.
         """
-        if targets is None and self.sc_weights is None:
+        if targets is None and self._sc_weights is None:
             return self.targets_sc
         if targets is None:
             targets = self.targets
@@ -983,7 +1180,63 @@ class SparseSCFit(object):
         if self.model_type != "full":
             targets = targets[self.control_units, :]
 
-        return self.get_weights(include_trivial_donors).dot(targets)
+        predictions = self._sc_weights.dot(targets)
+        if not include_trivial_donors and self.trivial_units.any():
+            # remove the contribution of the trivial donors rather than
+            # copying the weights
+            non_trivial = np.flatnonzero(np.logical_not(self.trivial_units))
+            trivial_donors = np.flatnonzero(self._trivial_donors())
+            # select the block directly, rather than copying (and, if
+            # compressed, densifying) every non-trivial row first
+            predictions[non_trivial] -= self._sc_weights[np.ix_(non_trivial, trivial_donors)].dot(
+                targets[trivial_donors]
+            )
+        return predictions
+
+    def compress(self, top_k=None, threshold=None, renormalize=True):
+        """
+        Store the synthetic control weights as a
+        :class:`scipy.sparse.csr_matrix`, optionally dropping the small
+        weights.  Most of the weights are typically tiny, so this reduces the
+        memory and the time taken by :meth:`predict` by orders of magnitude
+        for large numbers of units.
+
+        The approximation error is recorded in :attr:`compression_error`: the
+        largest and mean (over units) absolute weight dropped, and the root
+        mean squared change in the in-sample predictions.  The ``score`` of
+        the fit is not updated.
+
+        :param top_k: Keep (at most) the ``top_k`` largest weights (in
+            absolute value) of each unit
+        :type top_k: int, optional
+
+        :param threshold: Drop the weights smaller than ``threshold`` (in
+            absolute value)
+        :type threshold: float, optional
+
+        :param renormalize: Rescale the remaining weights of each unit so that
+            they sum to the same total as before
+        :type renormalize: boolean, default = ``True``
+
+        :returns: The fit (compressed in place)
+        :rtype: :class:`SparseSCFit`
+
+        :raises ValueError: When the fit does not keep the weights (i.e. it
+            was fit with ``avoid_NxN_mats=True``)
+        """
+        if self._sc_weights is None:
+            raise ValueError("The fit does not contain the weights (see `avoid_NxN_mats`)")
+        before = self.predict()
+        self._sc_weights, dropped = _compress_weights(
+            self._sc_weights, top_k=top_k, threshold=threshold, renormalize=renormalize
+        )
+        after = self.predict()
+        self.compression_error = {
+            "max_dropped_weight": float(dropped.max()) if len(dropped) else 0.0,
+            "mean_dropped_weight": float(dropped.mean()) if len(dropped) else 0.0,
+            "predictions_rmse": float(np.sqrt(np.mean(np.square(np.asarray(after - before))))),
+        }
+        return self
 
     def __str__(self):
         """ 
@@ -1016,19 +1269,110 @@ class SparseSCFit(object):
             print("consider installing pandas for a better fit.summary() experience")
         else:
             DF = pd.DataFrame
-        return [
-            DF(
-                {
-                    "v_pen": _fit.initial_v_pen,
-                    "w_pen": _fit.initial_w_pen,
-                    "score": _fit.scores,
-                    "min_score": _fit.scores == np.array(_fit.scores).min(),
-                    "selected_score": np.arange(len(_fit.scores))
-                    == _fit.selected_score,
-                }
-            )
-            for _fit in self.model_fits
-        ]
+        return [_fit_summary(_fit, DF) for _fit in self.model_fits]
+
+
+def _fit_summary(_fit, DF):
+    scores = np.array(_fit.scores)
+    if scores.ndim == 2:
+        # joint search: one row per w_pen and one column per v_pen
+        v_pen, w_pen = np.meshgrid(_fit.initial_v_pen, _fit.initial_w_pen)
+        selected = np.full(scores.shape, False)
+        selected[tuple(_fit.selected_score)] = True
+        return DF(
+            {
+                "v_pen": v_pen.ravel(),
+                "w_pen": w_pen.ravel(),
+                "score": scores.ravel(),
+                "min_score": scores.ravel() == scores.min(),
+                "selected_score": selected.ravel(),
+            }
+        )
+    return DF(
+        {
+            "v_pen": _fit.initial_v_pen,
+            "w_pen": _fit.initial_w_pen,
+            "score": _fit.scores,
+            "min_score": _fit.scores == scores.min(),
+            "selected_score": np.arange(len(_fit.scores))
+            == _fit.selected_score,
+        }
+    )
+
+
+def _trivial_units(M, targets, block_size=1000):
+    """ Units whose (selected) features and targets are all zero, read in row
+    blocks so that memory mapped targets are not loaded at once
+    """
+    trivial = np.full(targets.shape[0], False)
+    for start in range(0, targets.shape[0], block_size):
+        rows = slice(start, start+block_size)
+        trivial[rows] = (np.asarray(M[rows]) == 0).all(axis=1) & (np.asarray(targets[rows]) == 0).all(axis=1)
+    return trivial
+
+
+def _blocked_r2(targets, targets_sc, units, block_size=1000):
+    """ :func:`sklearn.metrics.r2_score` of the (flattened) ``units`` rows,
+    read in row blocks
+    """
+    units = np.asarray(units, dtype=int)
+    blocks = [units[start:start+block_size] for start in range(0, len(units), block_size)]
+    total, count = 0.0, 0
+    for b in blocks:
+        y = np.asarray(targets[b])
+        total += y.sum()
+        count += y.size
+    if count < 2:
+        return r2_score(np.asarray(targets[units]).flatten(), np.asarray(targets_sc[units]).flatten())
+    mean = total / count
+    ss_res, ss_tot = 0.0, 0.0
+    for b in blocks:
+        y = np.asarray(targets[b])
+        ss_res += np.sum(np.square(y - np.asarray(targets_sc[b])))
+        ss_tot += np.sum(np.square(y - mean))
+    if ss_tot == 0:
+        return 1.0 if ss_res == 0 else 0.0
+    return 1 - ss_res / ss_tot
+
+
+def _compress_weights(weights, top_k=None, threshold=None, renormalize=True, block_size=1000):
+    """
+    Converts (blocks of rows of) the weights to a
+    :class:`scipy.sparse.csr_matrix`, keeping the ``top_k`` largest and/or the
+    weights at least ``threshold`` in absolute value.
+
+    :returns: The compressed weights and the absolute weight dropped from
+        each row
+    """
+    N, N0 = weights.shape
+    rows, cols, vals = [], [], []
+    dropped = np.zeros(N)
+    for start in range(0, N, block_size):
+        W = weights[start:start+block_size]
+        W = W.toarray() if scipy.sparse.issparse(W) else np.asarray(W, dtype=np.float64)
+        keep = W != 0
+        if threshold is not None:
+            keep &= np.abs(W) >= threshold
+        if top_k is not None and top_k < N0:
+            top = np.zeros(W.shape, dtype=bool)
+            largest = np.argpartition(-np.abs(W), top_k - 1, axis=1)[:, :top_k]
+            top[np.arange(W.shape[0])[:, None], largest] = True
+            keep &= top
+        kept = np.where(keep, W, 0)
+        dropped[start:start+W.shape[0]] = np.abs(W - kept).sum(axis=1)
+        if renormalize:
+            total, kept_total = W.sum(axis=1), kept.sum(axis=1)
+            scale = np.ones(W.shape[0])
+            np.divide(total, kept_total, out=scale, where=kept_total != 0)
+            kept *= scale[:, None]
+        r, c = np.nonzero(kept)
+        rows.append(r + start)
+        cols.append(c)
+        vals.append(kept[r, c])
+    compressed = scipy.sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(N, N0)
+    ) if N else scipy.sparse.csr_matrix((N, N0))
+    return compressed, dropped
 
 
 _SparseFit_string_template = """ Model type: %s"
@@ -1060,6 +1404,116 @@ def _which(x, se, f):
     raise ValueError("Unexpected value for choice parameter: %s" % f)
 
 
+def _adaptive_search(score_fn, penalties, choice="1se", n_coarse=4):
+    """
+    Search for the penalty with the best cross validation score over the
+    range of ``penalties``, rather than scoring each of them.
+
+    The minimum is bracketed by ``n_coarse`` points evenly spaced in
+    ``log(penalty)`` and then refined by golden-section search until the
+    bracket is no wider than two steps of the original grid.  With the
+    ``"1se"`` rule, the interval between the selected penalty and the next
+    larger evaluated penalty is then bisected to the same resolution.
+
+    :param score_fn: function returning the cross validation score and its
+        standard error for a single penalty (i.e. :func:`CV_score`)
+    :type score_fn: function
+
+    :param penalties: The grid of penalties, which determines the range and
+        the resolution of the search
+    :type penalties: float[]
+
+    :param choice: Method for choosing from among the evaluated penalties
+    :type choice: str or function
+
+    :param n_coarse: Number of points in the bracketing pass
+    :type n_coarse: int
+
+    :returns: the evaluated penalties (sorted) and their scores and standard
+        errors
+    :rtype: (numpy.ndarray, float[], float[])
+    """
+    log_pens = np.log(np.sort(np.asarray(penalties, dtype=float)))
+    lo, hi = log_pens[0], log_pens[-1]
+    if len(log_pens) <= n_coarse or hi == lo:
+        evaluated = [score_fn(p) for p in np.exp(log_pens)]
+        scores, scores_se = [list(x) for x in zip(*evaluated)]
+        return np.exp(log_pens), scores, scores_se
+    tol = 2 * (hi - lo) / (len(log_pens) - 1)
+
+    evaluated = {}
+
+    def _f(x):
+        if x not in evaluated:
+            evaluated[x] = score_fn(np.exp(x))
+        return evaluated[x][0]
+
+    # BRACKET THE MINIMUM
+    coarse = np.linspace(lo, hi, n_coarse)
+    i = int(np.argmin([_f(x) for x in coarse]))
+    a, x, b = coarse[max(i - 1, 0)], coarse[i], coarse[min(i + 1, n_coarse - 1)]
+
+    # GOLDEN-SECTION REFINEMENT (keeping the best point inside the bracket)
+    golden = (3 - np.sqrt(5)) / 2
+    while b - a > tol:
+        if b - x >= x - a:
+            u = x + golden * (b - x)
+            if _f(u) < _f(x):
+                a, x = x, u
+            else:
+                b = u
+        else:
+            u = x - golden * (x - a)
+            if _f(u) < _f(x):
+                b, x = x, u
+            else:
+                a = u
+
+    def _sorted():
+        xs = sorted(evaluated)
+        return xs, [evaluated[_x][0] for _x in xs], [evaluated[_x][1] for _x in xs]
+
+    # REFINE THE BOUNDARY OF THE 1SE RULE
+    if choice == "1se":
+        for _ in range(int(np.ceil(np.log2((hi - lo) / tol))) + 1):
+            xs, scores, scores_se = _sorted()
+            j = _which(scores, scores_se, choice)
+            if j + 1 >= len(xs) or xs[j + 1] - xs[j] <= tol / 2:
+                break
+            _f((xs[j] + xs[j + 1]) / 2)
+
+    xs, scores, scores_se = _sorted()
+    return np.exp(xs), scores, scores_se
+
+
+def _which_2d(x, se, f, w_pens=None, v_pens=None):
+    """
+    Return the (row, column) index of the value in a grid of scores (with one
+    row per w_pen and one column per v_pen) which meets the selection rule.
+    The penalties (by default the indexes) needn't be in ascending order.
+    """
+    x, se = np.asarray(x), np.asarray(se)
+    if callable(f):
+        indx = f(x)
+        if np.ndim(indx) == 0:
+            indx = np.unravel_index(indx, x.shape)
+        return tuple(indx)
+    best = np.unravel_index(np.argmin(x), x.shape)
+    if f == "min":
+        return best
+    if f == "1se":
+        """
+        Among the scores within one standard error of the best score, return
+        the one with the largest v_pen, breaking ties with the largest w_pen
+        """
+        rows, cols = np.where(x <= x[best] + se[best])
+        w_pens = np.arange(x.shape[0]) if w_pens is None else np.asarray(w_pens)
+        v_pens = np.arange(x.shape[1]) if v_pens is None else np.asarray(v_pens)
+        i = np.lexsort((w_pens[rows], v_pens[cols]))[-1]
+        return rows[i], cols[i]
+    raise ValueError("Unexpected value for choice parameter: %s" % f)
+
+
 # TODO: CALCULATE ERRORS AND R-SQUARED'S
 # ct_prediction_error = Y_SC_test - Ytest
 # null_model_error = Ytest - np.mean(Xtest)
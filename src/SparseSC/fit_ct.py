@@ -5,6 +5,7 @@ Implements cross-train gradient descent methods
 from numpy import ones, diag, zeros, absolute, mean, var, linalg, prod, sqrt
 import numpy as np
 from .utils.print_progress import print_progress
+from .utils.donor_pool import as_donor_pool
 from SparseSC.optimizers.cd_line_search import cdl_search
 
 
@@ -236,6 +237,10 @@ def ct_weights(
 ):
     """ 
     Fit the weights using the cross-train gradient approach
+
+    :param custom_donor_pool: The donors allowed for each treated unit, with a
+        row per treated unit (in the order of ``treated_units``) and a column
+        per control unit (see :func:`SparseSC.utils.donor_pool.as_donor_pool`)
     """
     if treated_units is None:
         if control_units is None:
@@ -266,10 +271,16 @@ def ct_weights(
     if custom_donor_pool is None:
         weights = _calc_W_ct(X[treated_units, :], X[control_units, :], V, w_pen)
     else:
+        control_units = np.asarray(control_units)
         weights = np.zeros((len(treated_units), len(control_units)))
+        custom_donor_pool = as_donor_pool(
+            custom_donor_pool, len(treated_units), len(control_units)
+        )
         for i, treated_unit in enumerate(treated_units):
-            donors = np.where(custom_donor_pool[treated_unit, :])
-            weights[i, donors] = _calc_W_ct(X[treated_unit, :], X[donors, :], V, w_pen)
+            donors = custom_donor_pool.donors(i)
+            weights[i, donors] = _calc_W_ct(
+                X[treated_unit, :], X[control_units[donors], :], V, w_pen
+            ).flatten()
 
     return weights
 
@@ -9,7 +9,9 @@ import scipy.linalg #superset of np.linalg and also optimized compiled
 from .fit import SparseSCFit
 from .utils.penalty_utils import RidgeCVSolution
 from .utils.match_space import MTLassoCV_MatchSpace_factory
-from .utils.misc import _ensure_good_donor_pool, _get_fit_units
+from .utils.misc import _get_fit_units
+from .utils.donor_pool import as_donor_pool, nearest_donor_pool
+from .utils.spectral_ridge import SpectralRidge
 from .utils.print_progress import print_memory_snapshot, log_if_necessary, print_progress
 
 #not documenting the error for when trying to two function signatures (think of better way to do that)
@@ -25,15 +27,24 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
     avoid_NxN_mats=False,
     verbose=0,
     targets_aux=None,
+    compress_weights=None,
+    donor_knn=None,
+    match_sample_frac=1,
+    random_state=None,
+    targets_sc_out=None,
+    block_size=1000,
+    match_space_memo=None,
     **kwargs #keep so that calls can switch easily between fit() and fit_fast()
 ):
     r"""
 
-    :param features: Matrix of features
-    :type features: matrix of floats
+    :param features: Matrix of features, or the path of a ``.npy`` file
+        holding it. :class:`numpy.memmap` arrays (and files) are read in row
+        blocks rather than loaded into memory (see "Out-of-core" below).
+    :type features: matrix of floats, :class:`numpy.memmap` or str
 
-    :param targets: Matrix of targets
-    :type targets: matrix of floats
+    :param targets: Matrix of targets, or the path of a ``.npy`` file holding it
+    :type targets: matrix of floats, :class:`numpy.memmap` or str
 
     :param model_type:  Type of model being
         fit. One of ``"retrospective"``, ``"prospective"``,
@@ -54,7 +65,10 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
     :param custom_donor_pool: By default all control units are allowed to be donors
         for all units. There are cases where this is not desired and so the user
         can pass in a matrix specifying a unit-specific donor pool (NxC matrix
-        of booleans).
+        of booleans, dense or :mod:`scipy.sparse`), a list with the positions
+        of the donors of each unit, or a
+        :class:`SparseSC.utils.donor_pool.DonorPool` (e.g. from
+        ``DonorPool.from_groups()`` to only allow donors in the same region).
         Common reasons for restricting the allowability:
         (a) When we would like to reduce interpolation bias by restricting the
         donor pool to those units similar along certain features.
@@ -63,7 +77,7 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
         Single Unit Treatment Value Assumption (SUTVA).
         Note: These are not used in the fitting stage (of V and penalties) just
         in final unit weight determination.
-    :type custom_donor_pool: boolean, default = ``None``
+    :type custom_donor_pool: boolean or :class:`SparseSC.utils.donor_pool.DonorPool`, default = ``None``
 
     :param match_space_maker: Function with signature
         MatchSpace_transformer, V_vector, best_v_pen, V desc = match_space_maker(X, Y, fit_model_wrapper)
@@ -81,9 +95,62 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
         2 will print memory snapshots (Optionally out to a file if the env var SparseSC_log_file is set).
     :type verbose: int, default=0
 
+    :param compress_weights: Store the unit weights compressed (see
+        :meth:`SparseSCFit.compress`). Either ``True`` or a dict of arguments
+        to it, e.g. ``{"top_k": 50}``.
+    :type compress_weights: bool or dict, default=None
+
+    :param donor_knn: Restrict the donor pool of each unit (further) to its
+        ``donor_knn`` nearest control units in the fitted ``M * sqrt(V)``
+        metric (see :func:`SparseSC.utils.donor_pool.nearest_donor_pool`).
+        With very many control units this keeps the weight solves small,
+        especially when combined with ``avoid_NxN_mats``. The weight each unit
+        places on the furthest of its neighbors, an indication of the weight
+        lost by the truncation, is reported in the fit's
+        ``donor_boundary_mass`` attribute.
+    :type donor_knn: int, default=None
+
+    :param match_sample_frac: Fraction of the fit units, sampled at random,
+        on which the match space (and ``V``) is fit. Unlike the ``sample_frac``
+        of the match space factories, only the sampled rows are read.
+    :type match_sample_frac: float, default=1
+
+    :param random_state: Seed (or generator) for the ``match_sample_frac``
+        sample, passed to :func:`numpy.random.default_rng`
+    :type random_state: int or :class:`numpy.random.Generator`, default=None
+
+    :param targets_sc_out: Where to write the synthetic control targets: an
+        array (e.g. a :class:`numpy.memmap`) of the same shape as ``targets``,
+        or the path of a ``.npy`` file to create. By default they are kept
+        in memory.
+    :type targets_sc_out: array or str, optional
+
+    :param block_size: Number of units (rows) processed at a time when
+        computing the synthetic controls out-of-core
+    :type block_size: int, default=1000
+
+    :param match_space_memo: Used with the default ``match_space_maker``, to
+        memoize its fits and warm start them from the first fit over the full
+        penalty grid (see :class:`SparseSC.utils.match_space.MatchSpaceMemo`).
+        Pass the same memo to fits of overlapping data, e.g. to
+        ``estimate_effects()``, whose cross-fit folds then only refine the
+        penalty of the full sample fit.
+    :type match_space_memo: :class:`SparseSC.utils.match_space.MatchSpaceMemo`, default=None
+
     :param kwargs: Additional parameters so that one can easily switch between fit() and fit_fast()
 
+    Out-of-core: When ``features`` or ``targets`` is a :class:`numpy.memmap`
+    (or a path), the data is not copied into memory. The match space is fit on
+    the ``match_sample_frac`` sample of the fit units, the unit weights are
+    not kept (as with ``avoid_NxN_mats``), and the synthetic controls are
+    computed in blocks of ``block_size`` rows and written to
+    ``targets_sc_out``. The peak memory is then of the order of ``block_size``
+    rows plus the (N x K) match space. Match space factories which call
+    ``fit_model_wrapper`` still use all the data.
+
     :returns: A :class:`SparseSCFit` object containing details of the fitted model.
+        With ``w_pen_inner=False``, its ``w_pen_scores`` attribute holds the
+        in-sample score for each of its ``w_pens``.
     :rtype: :class:`SparseSCFit`
 
     :raises ValueError: when ``treated_units`` is not None and not an
@@ -91,17 +158,12 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
     """
     if verbose>1:
         tracemalloc.start()
-    X = features
-    Y = targets
+    X = _as_float64(features, "X")
+    Y = _as_float64(targets, "Y")
+    out_of_core = isinstance(X, np.memmap) or isinstance(Y, np.memmap)
+    if out_of_core:
+        avoid_NxN_mats = True
     w_pens = np.logspace(start=-5, stop=5, num=40) if w_pens is None else w_pens
-    try:
-        X = np.float64(X)
-    except ValueError:
-        raise ValueError("X is not coercible to a numpy float64")
-    try:
-        Y = np.float64(Y)
-    except ValueError:
-        raise ValueError("Y is not coercible to a numpy float64")
 
     if treated_units is not None:
         control_units = [u for u in range(Y.shape[0]) if u not in treated_units]
@@ -114,17 +176,17 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
     D = np.full(N, True)
     D[control_units] = False
     
-    if custom_donor_pool is not None:
-        assert custom_donor_pool.shape == (N,N0)
-    else:
-        custom_donor_pool = np.full((N,N0), True)
-    custom_donor_pool = _ensure_good_donor_pool(custom_donor_pool, control_units)
+    custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units)
     fit_args = kwargs.get('fit_args', {})
-    match_space_maker = MTLassoCV_MatchSpace_factory(fit_args=fit_args) if match_space_maker is None else match_space_maker
+    if match_space_maker is None:
+        match_space_maker = MTLassoCV_MatchSpace_factory(fit_args=fit_args, memo=match_space_memo, warm_start=match_space_memo is not None)
 
     fit_units = _get_fit_units(model_type, control_units, treated_units, N)
-    X_v = X[fit_units, :]
-    Y_v = Y[fit_units,:]
+    match_units = fit_units
+    if match_sample_frac < 1:
+        match_units = np.sort(np.random.default_rng(random_state).choice(fit_units, int(match_sample_frac * len(fit_units)), replace=False))
+    X_v = np.asarray(X[match_units, :])
+    Y_v = np.asarray(Y[match_units,:])
     
     def _fit_fast_wrapper(MatchSpace, V):
         return _fit_fast_inner(X, MatchSpace.transform(X), Y, V, model_type, treated_units, w_pens=w_pens, custom_donor_pool=custom_donor_pool, w_pen_inner=w_pen_inner)
@@ -133,12 +195,61 @@ def fit_fast(  # pylint: disable=unused-argument, missing-raises-doc
     if isinstance(MatchSpaceDesc, tuple): #unpack if necessary
         MatchSpaceDesc, match_fit = MatchSpaceDesc
 
-    M = MatchSpace.transform(X)
+    if out_of_core:
+        M = np.vstack([MatchSpace.transform(np.asarray(X[start:start+block_size, :])) for start in range(0, N, block_size)])
+    else:
+        M = MatchSpace.transform(X)
     log_if_necessary("Completed calculation of MatchSpace/V", verbose)
+    if isinstance(targets_sc_out, str):
+        targets_sc_out = np.lib.format.open_memmap(targets_sc_out, mode="w+", dtype=np.float64, shape=Y.shape)
+    if donor_knn is not None and len(V) > 0 and M.shape[1] > 0:
+        custom_donor_pool = nearest_donor_pool(M, control_units, donor_knn, V=V, custom_donor_pool=custom_donor_pool)
+        log_if_necessary("Completed nearest neighbor donor pools", verbose)
+
+    fit_obj = _fit_fast_inner(X, M, Y, V, model_type, treated_units, best_v_pen, w_pens, custom_donor_pool, 
+                              MatchSpace, MatchSpaceDesc, w_pen_inner=w_pen_inner, avoid_NxN_mats=avoid_NxN_mats, 
+                              verbose=verbose, Y_aux=targets_aux, match_fit=match_fit, Y_sc_out=targets_sc_out, 
+                              block_size=block_size)
+    if compress_weights and fit_obj.sc_weights is not None:
+        fit_obj.compress(**(compress_weights if isinstance(compress_weights, dict) else {}))
+    return fit_obj
+
 
-    return _fit_fast_inner(X, M, Y, V, model_type, treated_units, best_v_pen, w_pens, custom_donor_pool, 
-                           MatchSpace, MatchSpaceDesc, w_pen_inner=w_pen_inner, avoid_NxN_mats=avoid_NxN_mats, 
-                           verbose=verbose, Y_aux=targets_aux, match_fit=match_fit)
+def _as_float64(a, name):
+    """ Coerces the data to float64. Paths are opened, and float64 memory maps
+    kept, as (read-only) memory maps.
+    """
+    if isinstance(a, str):
+        a = np.load(a, mmap_mode="r")
+    if isinstance(a, np.memmap) and a.dtype == np.float64:
+        return a
+    try:
+        return np.float64(a)
+    except ValueError:
+        raise ValueError("%s is not coercible to a numpy float64" % name)
+
+
+class _Rows(object):
+    """ The ``rows`` of an array (e.g. a :class:`numpy.memmap`), read on
+    indexing rather than copied up front
+    """
+
+    def __init__(self, a, rows):
+        self.a = a
+        self.rows = np.asarray(rows, dtype=int)
+        self.shape = (len(self.rows),) + a.shape[1:]
+
+    def __getitem__(self, key):
+        return np.asarray(self.a[self.rows[key]])
+
+
+def _blocked_sse(Y, Y_sc, units, block_size=1000):
+    """ sum of squared differences of the ``units`` rows, read in blocks """
+    units = np.asarray(units, dtype=int)
+    return sum(
+        np.sum(np.square(np.asarray(Y[units[start:start+block_size]]) - np.asarray(Y_sc[units[start:start+block_size]])))
+        for start in range(0, len(units), block_size)
+    )
 
 
 def _weights(V , X_treated, X_control, w_pen):
@@ -158,100 +269,243 @@ def _weights(V , X_treated, X_control, w_pen):
         raise exc
     return b
 
-def _sc_weights_trad(M, M_c, V, N, N0, custom_donor_pool, best_w_pen, verbose=0):
+def _identity_columns(n, idx):
+    """ the columns ``idx`` of the ``n x n`` identity matrix, without making it """
+    E = np.zeros((n, len(idx)))
+    E[idx, np.arange(len(idx))] = 1
+    return E
+
+def _sc_weights_trad(M, M_c, V, N, N0, custom_donor_pool, best_w_pen, verbose=0, control_units=None, block_size=1000):
     """ Traditional matrix solving. Requires making NxN0 matrices.
+
+    Units are grouped by donor pool (see
+    :meth:`SparseSC.utils.donor_pool.DonorPool.groups`) so that the system is
+    factored once per distinct pool, and the units of each group are solved
+    together (in blocks of ``block_size``). Control units, which are left out
+    of their own pool, share the factorization of the pool that includes
+    them, and their leave-one-out weights are recovered by a rank-one
+    downdate.
     """
     #Potentially could be decomposed to not build NxN0 matrix, but the RidgeSolution works fine for that.
+    custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0)
+    if control_units is not None:
+        custom_donor_pool = custom_donor_pool.exclude_self(control_units)
     sc_weights = np.full((N,N0), 0.)
     weight_log_inc = max(int(N/100), 1)
-    for i in range(N):
-        if ((i % weight_log_inc) == 0 and verbose>0):
-            print_progress(i+1, N)
-            if verbose > 1:
-                print_memory_snapshot(extra_str="Loop " + str(i))
-        allowed = custom_donor_pool[i,:]
-        sc_weights[i,allowed] = _weights(V, M[i,:], M_c[allowed,:], best_w_pen)
-    if ((N-1) % weight_log_inc) != 0 and verbose > 0:
-        print_progress(N, N)
+    n_done = 0
+    for allowed_idx, units, loo in custom_donor_pool.groups():
+        n = len(allowed_idx)
+        if n == 0 or (n == 1 and (loo >= 0).all()):
+            n_done += len(units)
+            continue
+        M_a = M_c[allowed_idx, :]
+        MV_a = M_a * (2 * V)
+        A = MV_a.dot(M_a.T) + 2 * best_w_pen * np.eye(n)  # 5
+        try:
+            factor = scipy.linalg.cho_factor(A)
+        except scipy.linalg.LinAlgError as exc:
+            print("Unique weights not possible.")
+            if best_w_pen == 0:
+                print("Try specifying a very small w_pen rather than 0.")
+            raise exc
+        for start in range(0, len(units), block_size):
+            b_units, b_loo = units[start:start+block_size], loo[start:start+block_size]
+            is_loo = b_loo >= 0
+            B = MV_a.dot(M[b_units, :].T)  # 6
+            B += np.where(is_loo, 2 * best_w_pen / max(n - 1, 1), 2 * best_w_pen / n)
+            if is_loo.any():
+                cols = np.flatnonzero(is_loo)
+                p = b_loo[cols]
+                B[p, cols] = 0
+            b = scipy.linalg.cho_solve(factor, B)
+            if is_loo.any():
+                # Solution with the unit's own row and column of A removed:
+                # b_{-p} - A^{-1}_{-p,p} b_p / A^{-1}_{p,p}
+                G_p = scipy.linalg.cho_solve(factor, _identity_columns(n, p))
+                b[:, cols] -= G_p * (b[p, cols] / G_p[p, np.arange(len(cols))])
+                b[p, cols] = 0
+            sc_weights[np.ix_(b_units, allowed_idx)] = b.T
+            if verbose > 0 and (n_done // weight_log_inc) != ((n_done + len(b_units)) // weight_log_inc):
+                print_progress(n_done + len(b_units), N)
+                if verbose > 1:
+                    print_memory_snapshot(extra_str="Unit " + str(n_done + len(b_units)))
+            n_done += len(b_units)
     return sc_weights
     
 def _sc_Y_trad(M, M_c, treated_units, control_units, V, custom_donor_pool, best_w_pen, Y_c, verbose=0, sc_Y_block_size=100):
     """ Traditional matrix solving. Assumes trivial custom_donor_pool
+
+    Control units are left out of the donor pool in blocks of
+    ``sc_Y_block_size``. The full control system is factored once, and the
+    solution for each block follows from a block downdate on the held-out
+    units (with ``G = A^-1`` and ``z = G B``, where ``B`` is zero on the
+    block ``P``: ``b_{-P} = z_{-P} - G_{-P,P} G_{P,P}^-1 z_P``), so only
+    ``N0 x sc_Y_block_size`` intermediates are made per block.
     """
     #Potentially could be decomposed to not build NxN0 matrix, but the RidgeSolution works fine for that.
     N = M.shape[0]
     N0 = M_c.shape[0]
     N1 = N-N0
     Y_sc = np.full((N, Y_c.shape[1]), 0.)
+    MV_c = M_c * (2 * V)
+    A = MV_c.dot(M_c.T) + 2 * best_w_pen * np.eye(N0)  # 5
+    try:
+        factor = scipy.linalg.cho_factor(A)
+    except scipy.linalg.LinAlgError as exc:
+        print("Unique weights not possible.")
+        if best_w_pen == 0:
+            print("Try specifying a very small w_pen rather than 0.")
+        raise exc
     # Go through the treateds
     for i in range(0, N1, sc_Y_block_size):
-        size = min(N1-i, sc_Y_block_size)
-        sample_mask = treated_units[i:i+size]
-        sc_weights = _weights(V, M[sample_mask,:], M_c, best_w_pen)
-        Y_sc[sample_mask,:] = sc_weights.T.dot(Y_c)
+        sample_mask = treated_units[i:i+sc_Y_block_size]
+        B = MV_c.dot(M[sample_mask,:].T) + 2 * best_w_pen / N0  # 6
+        Y_sc[sample_mask,:] = scipy.linalg.cho_solve(factor, B).T.dot(Y_c)
     sc_Y_block_size = max(min(sc_Y_block_size, N0//10), 1) #resize in case too big
     for i in range(0, N0, sc_Y_block_size):
-        if i==0:
-            M_c_i = M_c[sc_Y_block_size:, :]
-            Y_c_i = Y_c[sc_Y_block_size:, :]
-        elif i<N0-sc_Y_block_size:
-            M_c_i = np.concatenate((M_c[:i, :], M_c[(i+sc_Y_block_size):, :]))
-            Y_c_i = np.concatenate((Y_c[:i, :], Y_c[(i+sc_Y_block_size):, :]))
-        else:
-            M_c_i = M_c[:i, :]
-            Y_c_i = Y_c[:i, :]
-        size = min(N0-i, sc_Y_block_size)
-        sample_mask = control_units[i:i+size]
-        sc_weights = _weights(V, M[sample_mask,:], M_c_i, best_w_pen)
-        Y_sc[sample_mask,:] = sc_weights.T.dot(Y_c_i)
+        P = np.arange(i, min(N0, i+sc_Y_block_size))
+        if len(P) == N0:
+            continue
+        sample_mask = control_units[i:i+len(P)]
+        B = MV_c.dot(M[sample_mask,:].T) + 2 * best_w_pen / (N0 - len(P))  # 6
+        B[P, :] = 0
+        z = scipy.linalg.cho_solve(factor, B)
+        G_P = scipy.linalg.cho_solve(factor, _identity_columns(N0, P))
+        b = z - G_P.dot(np.linalg.solve(G_P[P, :], z[P, :]))
+        b[P, :] = 0
+        Y_sc[sample_mask,:] = b.T.dot(Y_c)
+        if verbose > 0:
+            print_progress(i + len(P), N0)
     return Y_sc
 
-def _RidgeSolution(M, control_units, V, w_pen, custom_donor_pool, ret_weights=True, Y_c=None, verbose=0):
+def _RidgeSolution(M, control_units, V, w_pen, custom_donor_pool, ret_weights=True, Y_c=None, verbose=0, block_size=1000, ridge=None,
+                   ret_boundary_mass=False, Y_sc_out=None):
     """ Newer ridge solution. Does not require making NxN0 matrices.
+
+    The ridge regressions of all the units share one eigendecomposition of the
+    scaled control match space (see
+    :class:`SparseSC.utils.spectral_ridge.SpectralRidge`) and are solved in
+    blocks of ``block_size`` units, so that with ``ret_weights=False`` only
+    ``block_size x N0`` intermediates are made. Units whose donor pool is not
+    all the (other) controls are solved on their own.
+
+    With ``ret_boundary_mass``, the weight of each unit at the boundary of its
+    donor pool (see :meth:`SparseSC.utils.donor_pool.DonorPool.boundary_mass`)
+    is also returned.
+
+    Pass the ``SpectralRidge`` of ``M[control_units,:]`` and ``V`` as ``ridge`` to
+    reuse its decomposition (e.g. across values of ``w_pen``).
+
+    ``Y_c`` is only read in blocks of rows, so it may be a :class:`_Rows` of a
+    memory mapped array, and the synthetic outcomes are written into
+    ``Y_sc_out`` when it is given.
     """
-    from sklearn.linear_model import Ridge
-    #Could return the weights too
     M_c = M[control_units,:]
     N = M.shape[0]
     N_c = M_c.shape[0]
-    weight_log_inc = max(int(N/100), 1)
+    if ridge is None:
+        ridge = SpectralRidge(M_c, V)
+    H_inv = ridge.inverse(w_pen)
     if ret_weights:
         weights = np.full((N,N_c), 0.)
     if Y_c is not None:
-        Y_sc = np.full((N, Y_c.shape[1]), 0.)
-    for i in range(N):
-        if ((i % weight_log_inc) == 0 and verbose > 0):
-            print_progress(i+1, N)
-            if verbose > 1:
-                print_memory_snapshot(extra_str="Loop " + str(i))
-        if i in control_units:
-            c_i = control_units.index(i)
-            M_c_i = np.delete(M_c, c_i, axis=0)
-            features_i = (M_c_i*np.sqrt(V)).T #K* x (N0-1) 
-            targets_i = ((M_c[c_i,:]-M_c_i.mean(axis=0))*np.sqrt(V)).T #K*1
-            offset = 1/(N_c-1)
-        else:
-            features_i = (M_c*np.sqrt(V)).T #K* x (N0-1) 
-            targets_i = ((M[i,:]-M_c.mean(axis=0))*np.sqrt(V)).T #K*x1
-            offset = 1/N_c
+        Y_sc = np.full((N, Y_c.shape[1]), 0.) if Y_sc_out is None else Y_sc_out
+        SY_c = np.zeros((ridge.S.shape[1], Y_c.shape[1]))
+        Y_c_sum = np.zeros(Y_c.shape[1])
+        for start in range(0, N_c, block_size):
+            Y_c_b = np.asarray(Y_c[start:start+block_size])
+            SY_c += ridge.S[start:start+block_size].T.dot(Y_c_b)
+            Y_c_sum += Y_c_b.sum(axis=0)
+
+    custom_donor_pool = as_donor_pool(custom_donor_pool, N, N_c).exclude_self(control_units)
+    c_index = custom_donor_pool.self_donor
+    trivial = custom_donor_pool.is_full()
+    if ret_boundary_mass:
+        boundary_mass = np.full(N, 0.)
+    is_control = c_index >= 0
+
+    weight_log_inc = max(int(N/100), 1)
+    n_done = 0
+    for units, loo in (
+        (np.flatnonzero(trivial & ~is_control), False),
+        (np.flatnonzero(trivial & is_control), True),
+    ):
+        for start in range(0, len(units), block_size):
+            b_units = units[start:start+block_size]
+            if loo:
+                c = c_index[b_units]
+                U = ridge.loo_coefs(c, H_inv)
+                offset = 1/(N_c-1)
+            else:
+                U = ridge.coefs(M[b_units,:], H_inv)
+                offset = 1/N_c
+            if ret_weights:
+                weights_b = U.dot(ridge.S.T) + offset
+                if loo:
+                    weights_b[np.arange(len(c)), c] = 0
+                weights[b_units,:] = weights_b
+            if Y_c is not None:
+                if loo:
+                    # drop the unit's own (ridge and offset) weight
+                    own = (U * ridge.S[c,:]).sum(axis=1)[:,None] + offset
+                    Y_sc[b_units,:] = U.dot(SY_c) + offset*Y_c_sum - own*Y_c[c]
+                else:
+                    Y_sc[b_units,:] = U.dot(SY_c) + offset*Y_c_sum
+            if verbose > 0 and (n_done // weight_log_inc) != ((n_done + len(b_units)) // weight_log_inc):
+                print_progress(n_done + len(b_units), N)
+                if verbose > 1:
+                    print_memory_snapshot(extra_str="Unit " + str(n_done + len(b_units)))
+            n_done += len(b_units)
+
+    for i in np.flatnonzero(~trivial):
+        allowed = custom_donor_pool.donors(i)
+        if len(allowed) == 0:
+            continue
+        S_a = ridge.S[allowed,:]
+        targets_i = M[i,:]*ridge.sqrt_V - S_a.mean(axis=0)
+        u_i = scipy.linalg.solve(S_a.T.dot(S_a) + w_pen*np.eye(S_a.shape[1]), targets_i, assume_a="pos")
         weights_i = np.full((1,N_c), 0.)
-        allowed = custom_donor_pool[i,:]
-        ridgefit_i = Ridge(alpha=w_pen, fit_intercept=False, solver='cholesky').fit(features_i, targets_i) #'svd' is more stable but 'choleskly' is closed-form
-        weights_i[0,allowed] = ridgefit_i.coef_ + offset
+        weights_i[0,allowed] = S_a.dot(u_i) + 1/len(allowed)
         if ret_weights:
             weights[i, :] = weights_i
         if Y_c is not None:
-            Y_sc[i,:] = weights_i.dot(Y_c)
+            Y_sc[i,:] = weights_i[0,allowed].dot(Y_c[allowed])
+        if ret_boundary_mass and custom_donor_pool.boundary is not None:
+            boundary_mass[i] = np.abs(weights_i[0, custom_donor_pool.boundary[i].indices]).sum()
+        n_done += 1
 
-    if ((N-1) % weight_log_inc) != 0 and verbose > 0:
+    if verbose > 0:
         print_progress(N, N)
     ret = ()
     if ret_weights:
         ret = (*ret, weights)
     if Y_c is not None:
         ret = (*ret, Y_sc)
+    if ret_boundary_mass:
+        ret = (*ret, boundary_mass if custom_donor_pool.boundary is not None else None)
     return ret
 
+def _w_pen_path(M, Y, control_units, fit_units, V, w_pens, custom_donor_pool, verbose=0):
+    """ In-sample score (sum of squared errors of the fit units) of the
+    synthetic controls for each of the ``w_pens``. The candidates share one
+    eigendecomposition of the scaled control match space, so each costs
+    O(N K (K + T)) rather than a full solve of :func:`_sc_weights_trad`.
+    """
+    ridge = SpectralRidge(M[control_units,:], V)
+    Y_c = _Rows(Y, control_units)
+    # one buffer for every candidate; units with no allowed donors are not
+    # written, so it is cleared between them
+    Y_sc = np.empty((M.shape[0], Y.shape[1]))
+    scores = np.full(len(w_pens), np.nan)
+    for i, w_pen in enumerate(w_pens):
+        Y_sc.fill(0.)
+        _RidgeSolution(M, control_units, V, w_pen, custom_donor_pool, ret_weights=False, 
+                       Y_c=Y_c, ridge=ridge, Y_sc_out=Y_sc)
+        scores[i] = _blocked_sse(Y, Y_sc, fit_units)
+        if verbose > 0:
+            print_progress(i+1, len(w_pens))
+    return scores
+
 def _fit_fast_inner(
     X, 
     M,
@@ -268,7 +522,9 @@ def _fit_fast_inner(
     avoid_NxN_mats=False,
     verbose=0,
     Y_aux=None,
-    match_fit=None
+    match_fit=None,
+    Y_sc_out=None,
+    block_size=1000
 ):
     #returns in-sample score
     if treated_units is not None:
@@ -280,16 +536,12 @@ def _fit_fast_inner(
     N = N0 + N1
     fit_units = _get_fit_units(model_type, control_units, treated_units, N)
     
-    if custom_donor_pool is not None:
-        assert custom_donor_pool.shape == (N,N0)
-    else:
-        custom_donor_pool = np.full((N,N0), True)
-    custom_donor_pool = _ensure_good_donor_pool(custom_donor_pool, control_units)
+    custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units)
     
+    w_pen_scores = None
     if len(V) == 0 or M.shape[1]==0:
         best_v_pen, best_w_pen, M = None, None, None
     else:
-        M_c = M[control_units,:]
         separate_calcs = True if avoid_NxN_mats else None
         if w_pen_inner:
             if model_type=="retrospective":
@@ -301,20 +553,17 @@ def _fit_fast_inner(
             else: #model_type=="full"
                 best_w_pen = RidgeCVSolution(M, control_units, True, None, V, w_pens, separate=separate_calcs)
         else:
-            best_w_pen = None
-            best_w_pen_score = np.Inf
-            for w_pen in w_pens:
-                sc_weights = _sc_weights_trad(M, M_c, V, N, N0, custom_donor_pool, w_pen)
-                Y_sc = sc_weights.dot(Y[control_units, :])
-                mscore = np.sum(np.square(Y[fit_units,:] - Y_sc[fit_units,:]))
-                if mscore<best_w_pen_score:
-                    best_w_pen = w_pen
-                    best_w_pen_score = mscore
+            w_pen_scores = _w_pen_path(M, Y, control_units, fit_units, V, w_pens, custom_donor_pool)
+            best_w_pen = w_pens[np.argmin(w_pen_scores)]
     log_if_necessary("Completed calculation of best_w_pen", verbose)
             
-    return _fit_fast_match(X, M, Y, V, model_type, treated_units, best_v_pen, best_w_pen, custom_donor_pool, 
-                           match_space_trans, match_space_desc, w_pen_inner=w_pen_inner, avoid_NxN_mats=avoid_NxN_mats, 
-                           verbose=verbose, Y_aux=Y_aux, match_fit=match_fit)
+    fit_obj = _fit_fast_match(X, M, Y, V, model_type, treated_units, best_v_pen, best_w_pen, custom_donor_pool, 
+                              match_space_trans, match_space_desc, w_pen_inner=w_pen_inner, avoid_NxN_mats=avoid_NxN_mats, 
+                              verbose=verbose, Y_aux=Y_aux, match_fit=match_fit, Y_sc_out=Y_sc_out, block_size=block_size)
+    if w_pen_scores is not None:
+        fit_obj.w_pens = w_pens
+        fit_obj.w_pen_scores = w_pen_scores
+    return fit_obj
 
 def _fit_fast_match(
     X, 
@@ -333,7 +582,9 @@ def _fit_fast_match(
     verbose=0,
     Y_aux=None,
     match_fit=None,
-    sc_Y_block_size=None
+    sc_Y_block_size=None,
+    Y_sc_out=None,
+    block_size=1000
 ):
     if treated_units is not None:
         control_units = [u for u in range(Y.shape[0]) if u not in treated_units]
@@ -343,13 +594,10 @@ def _fit_fast_match(
         N0, N1 = Y.shape[0], 0
     N = N0 + N1
     fit_units = _get_fit_units(model_type, control_units, treated_units, N)
-    if custom_donor_pool is not None:
-        assert custom_donor_pool.shape == (N,N0)
-    else:
-        custom_donor_pool = np.full((N,N0), True)
-    custom_donor_pool = _ensure_good_donor_pool(custom_donor_pool, control_units)
+    custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units)
 
     Y_aux_sc = None
+    boundary_mass = None
 
     if len(V) == 0 or M.shape[1]==0:
         sc_weights = None if avoid_NxN_mats else np.full((N,N0), 0.)
@@ -360,8 +608,8 @@ def _fit_fast_match(
             Y_aux_c = Y_aux[control_units,:]
         for i in range(N):
             weights_i = np.full((1,N0), 0.)
-            allowed = custom_donor_pool[i,:]
-            weights_i[0,allowed] = 1/np.sum(allowed)
+            allowed = custom_donor_pool.donors(i)
+            weights_i[0,allowed] = 1/len(allowed)
             if not avoid_NxN_mats:
                 sc_weights[i,:] = weights_i
             Y_sc[i,:] = weights_i.dot(Y_c)
@@ -370,9 +618,10 @@ def _fit_fast_match(
         log_if_necessary("Completed calculation of sc_weights", verbose)
     else:
         M_c = M[control_units,:]
-        Y_c = Y[control_units, :]
         if not avoid_NxN_mats:
-            sc_weights = _sc_weights_trad(M, M_c, V, N, N0, custom_donor_pool, best_w_pen, verbose=verbose)
+            Y_c = Y[control_units, :]
+            sc_weights = _sc_weights_trad(M, M_c, V, N, N0, custom_donor_pool, best_w_pen, verbose=verbose, control_units=control_units)
+            boundary_mass = custom_donor_pool.boundary_mass(sc_weights)
             log_if_necessary("Completed calculation of sc_weights", verbose)
             Y_sc = sc_weights.dot(Y_c)
             if Y_aux is not None:
@@ -380,13 +629,14 @@ def _fit_fast_match(
         else:
             sc_weights = None
             if sc_Y_block_size is None:
-                Y_sc = _RidgeSolution(M, control_units, V, best_w_pen, custom_donor_pool, Y_c=Y_c, ret_weights=False, 
-                                    verbose=verbose)[0]
+                Y_sc, boundary_mass = _RidgeSolution(M, control_units, V, best_w_pen, custom_donor_pool, Y_c=_Rows(Y, control_units), 
+                                                     ret_weights=False, verbose=verbose, ret_boundary_mass=True, 
+                                                     Y_sc_out=Y_sc_out, block_size=block_size)
                 if Y_aux is not None:
                     Y_aux_sc = _RidgeSolution(M, control_units, V, best_w_pen, custom_donor_pool, Y_c=Y_aux[control_units, :], ret_weights=False, 
                                         verbose=verbose)[0]
             else:
-                Y_sc = _sc_Y_trad(M, M_c, treated_units, control_units, V, custom_donor_pool, best_w_pen, Y_c=Y_c, sc_Y_block_size=sc_Y_block_size,
+                Y_sc = _sc_Y_trad(M, M_c, treated_units, control_units, V, custom_donor_pool, best_w_pen, Y_c=Y[control_units, :], sc_Y_block_size=sc_Y_block_size,
                                     verbose=verbose)
                 if Y_aux is not None:
                     Y_aux_sc = _sc_Y_trad(M, M_c, treated_units, control_units, V, custom_donor_pool, best_w_pen, Y_c=Y_aux[control_units, :], sc_Y_block_size=sc_Y_block_size,
@@ -395,7 +645,7 @@ def _fit_fast_match(
 
 
     log_if_necessary("Completed calculation of synthetic controls", verbose)
-    mscore = np.sum(np.square(Y[fit_units,:] - Y_sc[fit_units,:]))
+    mscore = _blocked_sse(Y, Y_sc, fit_units, block_size)
 
     fit_obj = SparseSCFit(
         features=X,
@@ -417,5 +667,8 @@ def _fit_fast_match(
         fit_obj.Y_aux_sc = Y_aux_sc
     if match_fit is not None:
         fit_obj.match_fit = match_fit
+    if boundary_mass is not None:
+        fit_obj.donor_boundary_mass = boundary_mass
+        log_if_necessary("Max. weight at the donor pool boundary: %0.3g" % boundary_mass.max(), verbose)
 
     return fit_obj
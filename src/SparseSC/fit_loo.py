@@ -9,6 +9,7 @@ import itertools
 # only used by the step-down method (currently not implemented):
 # from SparseSC.utils.sub_matrix_inverse import subinv_k, all_subinverses
 from .utils.print_progress import print_progress
+from .utils.donor_pool import as_donor_pool
 from SparseSC.optimizers.cd_line_search import cdl_search
 
 
@@ -408,17 +409,21 @@ def loo_weights(
 
                 weights[out_controls[i], i] = b.flatten()
         else:
+            custom_donor_pool = as_donor_pool(
+                custom_donor_pool, X.shape[0], N0
+            ).exclude_self(control_units)
             for i, trt_unit in enumerate(treated_units):
-                donors = np.where(custom_donor_pool[trt_unit, :])
-                A = X[donors, :].dot(2 * V).dot(X[donors, :].T) + 2 * w_pen * diag(
-                    ones(X[donors, :].shape[0])
+                donors = custom_donor_pool.donors(trt_unit)
+                X_donors = X[control_units[donors], :]
+                A = X_donors.dot(2 * V).dot(X_donors.T) + 2 * w_pen * diag(
+                    ones(X_donors.shape[0])
                 )  # 5
                 B = (
-                    X[trt_unit, :].dot(2 * V).dot(X[donors, :].T).T
-                    + 2 * w_pen / X[donors, :].shape[0]
+                    X[trt_unit, :].dot(2 * V).dot(X_donors.T).T
+                    + 2 * w_pen / X_donors.shape[0]
                 )  # 6
                 try:
-                    weights[donors, i] = linalg.solve(A, B)
+                    weights[donors, i] = linalg.solve(A, B).flatten()
                 except linalg.LinAlgError as exc:
                     print("Unique weights not possible.")
                     if w_pen == 0:
@@ -9,6 +9,7 @@ from ...fit import _which, SparseSCFit
 from ...weights import weights
 from ...tensor import tensor
 from .constants import _BATCH_CV_FILE_NAME, _BATCH_FIT_FILE_NAME
+from ..donor_pool import as_donor_pool
 
 
 def aggregate_batch_results(batchDir, batch_client_config=None, choice=None):
@@ -131,8 +132,9 @@ def aggregate_batch_results(batchDir, batch_client_config=None, choice=None):
             custom_donor_pool_t = None
             custom_donor_pool_c = None
         else:
-            custom_donor_pool_t = custom_donor_pool[treated_units, :]
-            custom_donor_pool_c = custom_donor_pool[control_units, :]
+            custom_donor_pool = as_donor_pool(custom_donor_pool, X.shape[0], len(control_units))
+            custom_donor_pool_t = custom_donor_pool.subset(treated_units)
+            custom_donor_pool_c = custom_donor_pool.subset(control_units)
         sc_weights[treated_units, :] = weights(
             Xtrain,
             Xtest,
@@ -0,0 +1,413 @@
+"""
+Donor pools: which of the control units may be used as donors for (i.e. may
+receive weight in the synthetic control of) each unit.
+
+A dense ``N x N0`` boolean mask is the simplest representation, but it is
+wasteful when every donor is allowed, and prohibitively large for big panels
+with small (e.g. regional) pools.  :class:`DonorPool` also stores pools as
+"every donor allowed" (nothing stored), a :class:`scipy.sparse.csr_matrix`,
+or group labels of the units and donors, and lets the weight engines iterate
+over the pools without materializing the mask.
+"""
+import numpy as np
+import scipy.sparse
+
+
+class DonorPool(object):
+    """
+    The donor pool of each of ``n_units`` units among ``n_donors`` donors,
+    where the donors are indexed by their position in the list of control
+    units.  Use :func:`as_donor_pool` (or the ``from_*`` constructors) rather
+    than calling this directly.
+
+    :param n_units: Number of units (rows)
+    :type n_units: int
+
+    :param n_donors: Number of donors (columns)
+    :type n_donors: int
+
+    :param allowed: Sparse matrix of allowed donors, or ``None`` when the
+        pools are given by the group labels or every donor is allowed
+    :type allowed: :class:`scipy.sparse.csr_matrix`, optional
+
+    :param unit_groups: Group label of each unit. A unit may only use the
+        donors with the same label in ``donor_groups``.
+    :type unit_groups: array, optional
+
+    :param donor_groups: Group label of each donor
+    :type donor_groups: array, optional
+
+    :param self_donor: For each unit, its own position among the donors (or
+        -1). A unit is never a donor for itself.
+    :type self_donor: int[], optional
+
+    :param boundary: Sparse matrix of the allowed donors which are at the
+        boundary of each (truncated) pool, e.g. the furthest of the nearest
+        neighbors kept by :func:`nearest_donor_pool`
+    :type boundary: :class:`scipy.sparse.csr_matrix`, optional
+    """
+
+    def __init__(
+        self,
+        n_units,
+        n_donors,
+        allowed=None,
+        unit_groups=None,
+        donor_groups=None,
+        self_donor=None,
+        boundary=None,
+    ):
+        if (unit_groups is None) != (donor_groups is None):
+            raise ValueError("`unit_groups` and `donor_groups` must both be given or None")
+        self.n_units = n_units
+        self.n_donors = n_donors
+        self.allowed = None
+        if allowed is not None:
+            self.allowed = scipy.sparse.csr_matrix(allowed, dtype=bool, copy=True)
+            self.allowed.eliminate_zeros()
+            self.allowed.sort_indices()
+        self.unit_groups = None if unit_groups is None else np.asarray(unit_groups)
+        self.donor_groups = None if donor_groups is None else np.asarray(donor_groups)
+        self.self_donor = (
+            np.full(n_units, -1) if self_donor is None else np.asarray(self_donor)
+        )
+        self.boundary = None if boundary is None else scipy.sparse.csr_matrix(boundary, dtype=bool)
+        if self.allowed is not None and self.allowed.shape != self.shape:
+            raise ValueError(
+                "donor pool has shape %s, expected %s" % (self.allowed.shape, self.shape)
+            )
+        if self.unit_groups is not None:
+            if len(self.unit_groups) != n_units or len(self.donor_groups) != n_donors:
+                raise ValueError(
+                    "expected %s unit and %s donor group labels, got %s and %s"
+                    % (n_units, n_donors, len(self.unit_groups), len(self.donor_groups))
+                )
+            self._group_donors = {
+                g: np.flatnonzero(self.donor_groups == g) for g in np.unique(self.donor_groups)
+            }
+
+    @classmethod
+    def from_mask(cls, mask):
+        """ Donor pool from a dense (N x N0) boolean mask """
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 2:
+            raise ValueError("custom_donor_pool must be a 2-dimensional mask")
+        return cls(mask.shape[0], mask.shape[1], allowed=scipy.sparse.csr_matrix(mask))
+
+    @classmethod
+    def from_indices(cls, donor_indices, n_donors):
+        """ Donor pool from a list with the (positions of the) donors of each unit """
+        lengths = [len(d) for d in donor_indices]
+        indices = (
+            np.concatenate([np.asarray(d, dtype=int) for d in donor_indices])
+            if donor_indices
+            else np.empty(0, dtype=int)
+        )
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        allowed = scipy.sparse.csr_matrix(
+            (np.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(len(donor_indices), n_donors),
+        )
+        allowed.sum_duplicates()
+        return cls(len(donor_indices), n_donors, allowed=allowed)
+
+    @classmethod
+    def from_groups(cls, unit_groups, donor_groups):
+        """ Donor pool allowing each unit only the donors in the same group
+        (e.g. the same region)
+        """
+        return cls(len(unit_groups), len(donor_groups), unit_groups=unit_groups, donor_groups=donor_groups)
+
+    @property
+    def shape(self):
+        """ ``(n_units, n_donors)`` """
+        return (self.n_units, self.n_donors)
+
+    def exclude_self(self, control_units):
+        """
+        :returns: a copy of the pool in which control units are not donors for
+            themselves
+        :rtype: :class:`DonorPool`
+        """
+        self_donor = self.self_donor.copy()
+        self_donor[np.asarray(control_units, dtype=int)] = np.arange(len(control_units))
+        return self._copy(self_donor=self_donor)
+
+    def subset(self, units):
+        """
+        :returns: the pools of ``units`` (a list of rows)
+        :rtype: :class:`DonorPool`
+        """
+        units = np.asarray(units, dtype=int)
+        return DonorPool(
+            len(units),
+            self.n_donors,
+            allowed=None if self.allowed is None else self.allowed[units, :],
+            unit_groups=None if self.unit_groups is None else self.unit_groups[units],
+            donor_groups=self.donor_groups,
+            self_donor=self.self_donor[units],
+            boundary=None if self.boundary is None else self.boundary[units, :],
+        )
+
+    def donors(self, i):
+        """
+        :returns: the sorted positions of the donors of unit ``i``
+        :rtype: int[]
+        """
+        if self.allowed is not None:
+            row = self.allowed.indices[self.allowed.indptr[i]:self.allowed.indptr[i + 1]].astype(int)
+        elif self.unit_groups is not None:
+            row = self._group_donors.get(self.unit_groups[i], np.empty(0, dtype=int))
+        else:
+            row = np.arange(self.n_donors)
+        if self.self_donor[i] >= 0:
+            row = row[row != self.self_donor[i]]
+        return row
+
+    def mask(self, i):
+        """
+        :returns: boolean mask of the donors of unit ``i``
+        """
+        out = np.full(self.n_donors, False)
+        out[self.donors(i)] = True
+        return out
+
+    def toarray(self):
+        """
+        :returns: the dense (n_units x n_donors) boolean mask
+        """
+        out = np.full(self.shape, False)
+        for i in range(self.n_units):
+            out[i, self.donors(i)] = True
+        return out
+
+    def is_full(self):
+        """
+        :returns: for each unit, whether every donor (other than itself) is
+            allowed
+        :rtype: bool[]
+        """
+        if self.allowed is None and self.unit_groups is None:
+            return np.full(self.n_units, True)
+        n_other = self.n_donors - (self.self_donor >= 0)
+        return self.sizes() == n_other
+
+    def sizes(self):
+        """
+        :returns: the number of donors of each unit
+        :rtype: int[]
+        """
+        has_self = self.self_donor >= 0
+        if self.allowed is not None:
+            sizes = np.diff(self.allowed.indptr)
+            self_allowed = np.zeros(self.n_units, dtype=bool)
+            self_allowed[has_self] = np.asarray(
+                self.allowed[np.flatnonzero(has_self), self.self_donor[has_self]]
+            ).reshape(-1)
+            return sizes - self_allowed
+        if self.unit_groups is not None:
+            counts = {g: len(d) for g, d in self._group_donors.items()}
+            sizes = np.array([counts.get(g, 0) for g in self.unit_groups], dtype=int)
+            self_in_group = np.zeros(self.n_units, dtype=bool)
+            self_in_group[has_self] = (
+                self.donor_groups[self.self_donor[has_self]] == self.unit_groups[has_self]
+            )
+            return sizes - self_in_group
+        return np.full(self.n_units, self.n_donors) - has_self
+
+    def groups(self):
+        """
+        Groups the units which share a donor pool, up to leaving themselves
+        out of it (i.e. control units in the same pool are in the same group).
+
+        :returns: list of ``(donors, units, loo)`` tuples, where ``donors`` is
+            the pool shared by ``units`` and ``loo`` holds, for each unit, its
+            own position in ``donors`` (or -1). The pool of each unit is
+            ``donors`` without its ``loo`` element.
+        """
+        if self.allowed is None and self.unit_groups is None:
+            return [(np.arange(self.n_donors), np.arange(self.n_units), self.self_donor.copy())]
+        keys = {}
+        bases = []
+        for i in range(self.n_units):
+            base = self.donors(i)
+            if self.self_donor[i] >= 0:
+                base = np.union1d(base, [self.self_donor[i]])
+            key = base.tobytes()
+            if key not in keys:
+                keys[key] = len(bases)
+                bases.append((base, []))
+            bases[keys[key]][1].append(i)
+        groups = []
+        for base, units in bases:
+            units = np.array(units, dtype=int)
+            has_self = self.self_donor[units] >= 0
+            loo_u = np.full(len(units), -1)
+            loo_u[has_self] = np.searchsorted(base, self.self_donor[units][has_self])
+            groups.append((base, units, loo_u))
+        return groups
+
+    def boundary_mass(self, weights):
+        """
+        The absolute weight each unit places on the donors at the boundary of
+        its pool.  When the pool was truncated to the nearest neighbors, this
+        is an indication of the weight lost by the truncation: little weight
+        at the boundary means little would have been placed beyond it.
+
+        :param weights: The (N x N0) unit weights, dense or :mod:`scipy.sparse`
+
+        :returns: the boundary weight of each unit, or ``None`` when the pool
+            has no boundary
+        :rtype: float[]
+        """
+        if self.boundary is None:
+            return None
+        return np.asarray(self.boundary.multiply(abs(weights)).sum(axis=1)).reshape(-1)
+
+    def _copy(self, **changes):
+        params = dict(
+            allowed=self.allowed,
+            unit_groups=self.unit_groups,
+            donor_groups=self.donor_groups,
+            self_donor=self.self_donor,
+            boundary=self.boundary,
+        )
+        params.update(changes)
+        return DonorPool(self.n_units, self.n_donors, **params)
+
+    def __repr__(self):
+        if self.allowed is not None:
+            kind = "sparse, %s allowed" % self.allowed.nnz
+        elif self.unit_groups is not None:
+            kind = "%s groups" % len(self._group_donors)
+        else:
+            kind = "all allowed"
+        return "DonorPool(%s units, %s donors, %s)" % (self.n_units, self.n_donors, kind)
+
+
+def as_donor_pool(custom_donor_pool, n_units, n_donors):
+    """
+    Coerce a ``custom_donor_pool`` argument into a :class:`DonorPool`.
+
+    :param custom_donor_pool: ``None`` (every donor allowed for every unit), a
+        :class:`DonorPool`, an (N x N0) boolean mask (dense or
+        :mod:`scipy.sparse`), or a list with the (integer) positions of the
+        donors of each unit
+    :param n_units: Expected number of units (N)
+    :param n_donors: Expected number of donors (N0)
+
+    :rtype: :class:`DonorPool`
+
+    :raises ValueError: when the pool does not have the expected shape
+    """
+    if custom_donor_pool is None:
+        return DonorPool(n_units, n_donors)
+    if isinstance(custom_donor_pool, DonorPool):
+        pool = custom_donor_pool
+    elif scipy.sparse.issparse(custom_donor_pool):
+        pool = DonorPool(custom_donor_pool.shape[0], custom_donor_pool.shape[1], allowed=custom_donor_pool)
+    elif isinstance(custom_donor_pool, (list, tuple)) and all(
+        len(d) == 0 or np.asarray(d).dtype.kind in "iu" for d in custom_donor_pool
+    ):
+        pool = DonorPool.from_indices(custom_donor_pool, n_donors)
+    else:
+        pool = DonorPool.from_mask(custom_donor_pool)
+    if pool.shape != (n_units, n_donors):
+        raise ValueError(
+            "custom_donor_pool has shape %s, expected %s" % (pool.shape, (n_units, n_donors))
+        )
+    return pool
+
+
+def nearest_donor_pool(
+    M,
+    control_units,
+    k,
+    V=None,
+    custom_donor_pool=None,
+    boundary_frac=0.1,
+    algorithm="auto",
+    leaf_size=40,
+    n_jobs=None,
+):
+    """
+    Restricts the donor pool of each unit to its ``k`` nearest control units
+    in the ``M * sqrt(V)`` metric.  With a penalized fit, almost all of the
+    weight is placed on the nearest donors, so this trades a small
+    approximation for weight solves that no longer grow with the number of
+    control units.  The neighbors are found with a KD-tree or ball-tree
+    (:class:`sklearn.neighbors.NearestNeighbors`) over the controls of each
+    distinct pool in ``custom_donor_pool``.
+
+    The furthest ``boundary_frac`` of the neighbors of each truncated pool
+    are recorded as its boundary (see :meth:`DonorPool.boundary_mass`).
+
+    :param M: Match space of all the units (N x K)
+    :param control_units: The (row) indexes of the control units
+    :param k: Number of donors to keep for each unit
+    :type k: int
+
+    :param V: The (diagonal) match space weights. Defaults to all ones.
+    :param custom_donor_pool: Donor pools to restrict further (see
+        :func:`as_donor_pool`)
+
+    :param boundary_frac: Fraction (at least one) of the ``k`` donors at the
+        boundary of each pool
+    :type boundary_frac: float
+
+    :param algorithm: Passed to :class:`sklearn.neighbors.NearestNeighbors`
+    :param leaf_size: Passed to :class:`sklearn.neighbors.NearestNeighbors`
+    :param n_jobs: Passed to :class:`sklearn.neighbors.NearestNeighbors`
+
+    :rtype: :class:`DonorPool`
+
+    :raises ValueError: when ``k`` is not positive
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    if k < 1:
+        raise ValueError("k must be positive")
+    M = np.asarray(M, dtype=np.float64)
+    if V is not None:
+        V = np.asarray(V, dtype=np.float64)
+        M = M * np.sqrt(np.diag(V) if V.ndim == 2 else V).reshape(-1)
+    control_units = np.asarray(control_units, dtype=int)
+    N, N0 = M.shape[0], len(control_units)
+    M_c = M[control_units, :]
+    base = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units)
+    n_boundary = max(1, int(np.ceil(boundary_frac * k)))
+
+    rows, cols, b_rows, b_cols = [], [], [], []
+    for donors, units, loo in base.groups():
+        if len(donors) == 0:
+            continue
+        n_neighbors = min(k + 1, len(donors))  # one extra, in case it is the unit itself
+        nn = NearestNeighbors(
+            n_neighbors=n_neighbors, algorithm=algorithm, leaf_size=leaf_size, n_jobs=n_jobs
+        ).fit(M_c[donors, :])
+        neighbors = nn.kneighbors(M[units, :], return_distance=False)
+        not_self = neighbors != np.where(loo >= 0, loo, -1)[:, None]
+        rank = np.cumsum(not_self, axis=1)
+        keep = not_self & (rank <= k)
+        r, c = np.nonzero(keep)
+        rows.append(units[r])
+        cols.append(donors[neighbors[r, c]])
+        # only the pools which were actually truncated have a boundary
+        truncated = (len(donors) - (loo >= 0)) > k
+        at_boundary = keep & truncated[:, None] & (rank > k - n_boundary)
+        r, c = np.nonzero(at_boundary)
+        b_rows.append(units[r])
+        b_cols.append(donors[neighbors[r, c]])
+
+    def _to_csr(r, c):
+        r = np.concatenate(r) if r else np.empty(0, dtype=int)
+        c = np.concatenate(c) if c else np.empty(0, dtype=int)
+        return scipy.sparse.csr_matrix((np.ones(len(r), dtype=bool), (r, c)), shape=(N, N0))
+
+    return DonorPool(
+        N,
+        N0,
+        allowed=_to_csr(rows, cols),
+        self_donor=base.self_donor,
+        boundary=_to_csr(b_rows, b_cols),
+    )
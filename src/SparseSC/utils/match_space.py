@@ -2,15 +2,20 @@
 
 """
 # To do:
-# - Hve the factories return partial objects rather than anonymous functions. That way they can be pickled and parallelized in get_c_predictions_honest
+# - Hve the (remaining) factories return partial objects rather than anonymous functions. That way they can be pickled and parallelized in get_c_predictions_honest
 # - Implement Post-lasso versions. Could do MT OLS as fully separate then aggregate coefs like with Lasso.
 #   (Though some coefficients aren't well estimated we don't want to just take t-stats as we still want to be fit-based.
 #   Ideally we'd have something like marginal R2, but the initial method is probably fine for most uses. (We could standardize input features).)
+from collections import OrderedDict
+from functools import partial
+import hashlib
 import numpy as np
 from sklearn.linear_model import MultiTaskLassoCV, MultiTaskLasso, LassoCV
+from sklearn.model_selection import check_cv
 from sklearn.preprocessing import StandardScaler
 
 from .misc import capture_all
+from .result_cache import _hash_update
 
 
 def keras_reproducible(seed=1234, verbose=0, TF_CPP_MIN_LOG_LEVEL="3"):
@@ -121,7 +126,71 @@ def _block_summ_cols(Y, Y_col_block_size):
         print("Can only average target across columns blocks if blocks fit evenly")
     return Y
 
-def MTLassoCV_MatchSpace_factory(v_pens=None, n_v_cv=5, sample_frac=1, Y_col_block_size=None, se_factor=None, normalize=True, fit_args={}):
+class MatchSpaceMemo(object):
+    """
+    An opt-in, in-memory memo for :func:`MTLassoCV_MatchSpace_factory`, to be
+    shared by the fits of overlapping data (e.g. the treatment periods and
+    cross-fit folds of :func:`SparseSC.estimate_effects.estimate_effects`).
+
+    It holds the match spaces fit so far, keyed by a fingerprint of the data
+    and parameters, and the penalty path of the last fit over the full
+    penalty grid, from which later fits are warm started.
+
+    :param max_entries: Maximum number of match spaces kept (least recently
+        used first out). Use 0 to only keep the warm start path.
+    :type max_entries: int, default = 16
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        #: ``(alphas, alpha, coef)`` of the last fit over the full penalty grid
+        self.path = None
+        self._entries = OrderedDict()
+
+    def key(self, *arrays, **params):
+        """
+        :returns: A fingerprint of the data and parameters, or ``None`` if
+            they can't be hashed reproducibly
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        try:
+            _hash_update(h, [np.asarray(a) for a in arrays])
+            _hash_update(h, params)
+        except TypeError:
+            return None
+        return h.hexdigest()
+
+    def get(self, key):
+        """ :returns: the memoized value, or ``None`` """
+        if key is None or key not in self._entries:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+
+    def put(self, key, value):
+        """ memoize a value, evicting the least recently used ones if full """
+        if key is None or self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __str__(self):
+        return "MatchSpaceMemo(entries=%s, hits=%s, misses=%s)" % (
+            len(self._entries),
+            self.hits,
+            self.misses,
+        )
+
+
+def MTLassoCV_MatchSpace_factory(v_pens=None, n_v_cv=5, sample_frac=1, Y_col_block_size=None, se_factor=None, normalize=True, fit_args={},
+                                 memo=None, warm_start=False, refine_width=5):
     """
     Return a MatchSpace function that will fit a MultiTaskLassoCV for Y ~ X
 
@@ -130,20 +199,37 @@ def MTLassoCV_MatchSpace_factory(v_pens=None, n_v_cv=5, sample_frac=1, Y_col_blo
     :param sample_frac: Fraction of the data to sample
     :param se_factor: Allows taking a different penalty than the min mse. Similar to the lambda.1se rule,
         if not None, it will take the max lambda that has mse < min_mse + se_factor*(MSE standard error).
-    :returns: MatchSpace fn, V vector, best_v_pen, V
+    :param memo: A :class:`MatchSpaceMemo` (or ``True`` for a new one) in
+        which the fits are memoized by a fingerprint of the data
+    :param warm_start: After a first fit over the full penalty grid, only
+        refine the penalty over the ``refine_width`` grid points either side
+        of its selected penalty, starting the coordinate descent from its
+        coefficients. Falls back to the full grid when the selected penalty
+        is at the edge of the refined grid.
+    :param refine_width: Number of grid points either side of the previously
+        selected penalty used with ``warm_start``
+    :returns: MatchSpace fn, V vector, best_v_pen, V.  The function is a
+        :func:`functools.partial`, so it can be pickled (e.g. for ``n_multi``).
     """
-
-    def _MTLassoCV_MatchSpace_wrapper(X, Y, **kwargs):
-        return _MTLassoCV_MatchSpace(
-            X, Y, v_pens=v_pens, n_v_cv=n_v_cv, sample_frac=sample_frac, Y_col_block_size=Y_col_block_size, se_factor=se_factor, normalize=normalize, fit_args=fit_args, **kwargs
-        )
-
-    return _MTLassoCV_MatchSpace_wrapper
+    if memo is True or (memo is None and warm_start):
+        memo = MatchSpaceMemo(max_entries=16 if memo is True else 0)
+    return partial(
+        _MTLassoCV_MatchSpace, v_pens=v_pens, n_v_cv=n_v_cv, sample_frac=sample_frac, Y_col_block_size=Y_col_block_size, 
+        se_factor=se_factor, normalize=normalize, fit_args=fit_args, memo=memo, warm_start=warm_start, refine_width=refine_width
+    )
 
 
 def _MTLassoCV_MatchSpace(
-    X, Y, v_pens=None, n_v_cv=5, sample_frac=1, Y_col_block_size=None, se_factor=None, normalize=True, fit_args={}, **kwargs
+    X, Y, v_pens=None, n_v_cv=5, sample_frac=1, Y_col_block_size=None, se_factor=None, normalize=True, fit_args={}, 
+    memo=None, warm_start=False, refine_width=5, **kwargs
 ):  # pylint: disable=missing-param-doc, unused-argument
+    key = None
+    if memo is not None:
+        key = memo.key(X, Y, v_pens=v_pens, n_v_cv=n_v_cv, sample_frac=sample_frac, Y_col_block_size=Y_col_block_size, 
+                       se_factor=se_factor, normalize=normalize, fit_args=fit_args)
+        cached = memo.get(key)
+        if cached is not None:
+            return cached
     # A fake MT would do Lasso on y_mean = Y.mean(axis=1)
     if sample_frac < 1:
         N = X.shape[0]
@@ -157,19 +243,71 @@ def _MTLassoCV_MatchSpace(
         X_norm = scaler.fit_transform(X)
     else:
         X_norm = X
-    varselectorfit = MultiTaskLassoCV(cv=n_v_cv, alphas=v_pens, **fit_args).fit(
-        X_norm, Y
-    )
+    varselectorfit = None
+    if warm_start and memo is not None and memo.path is not None:
+        varselectorfit = _warm_MTLassoCV(X_norm, Y, memo.path, n_v_cv, refine_width, fit_args)
+    if varselectorfit is None:
+        varselectorfit = MultiTaskLassoCV(cv=n_v_cv, alphas=v_pens, **fit_args).fit(
+            X_norm, Y
+        )
+        if warm_start and memo is not None:
+            memo.path = (varselectorfit.alphas_, varselectorfit.alpha_, varselectorfit.coef_)
     best_v_pen = varselectorfit.alpha_
     if se_factor is not None:
         best_v_pen = _neg_se_rule(varselectorfit, factor=se_factor)
-        varselectorfit = MultiTaskLasso(alpha=best_v_pen).fit(X_norm, Y)
+        coef = varselectorfit.coef_
+        varselectorfit = MultiTaskLasso(alpha=best_v_pen, warm_start=True)
+        varselectorfit.coef_ = coef.copy()
+        varselectorfit.fit(X_norm, Y)
     V = np.sqrt(
         np.sum(np.square(varselectorfit.coef_), axis=0)
     )  # n_tasks x n_features -> n_feature
     m_sel = V != 0
     transformer = SelMatchSpace(m_sel)
-    return transformer, V[m_sel], best_v_pen, (V, varselectorfit)
+    ret = (transformer, V[m_sel], best_v_pen, (V, varselectorfit))
+    if memo is not None:
+        memo.put(key, ret)
+    return ret
+
+
+def _warm_MTLassoCV(X, Y, path, n_v_cv, refine_width, fit_args):
+    """
+    Cross-validates a MultiTaskLasso over the part of a previous penalty path
+    around its selected penalty, warm starting each fold's coordinate descent
+    from the previous coefficients.
+
+    :returns: the fit, with the ``alpha_``, ``alphas_`` and ``mse_path_``
+        attributes of a :class:`sklearn.linear_model.MultiTaskLassoCV`, or
+        ``None`` when the previous path doesn't apply (different shapes) or
+        the selected penalty is at an edge of the refined grid
+    """
+    alphas, alpha, coef = path
+    if coef.shape != (Y.shape[1], X.shape[1]):
+        return None
+    alphas = np.sort(alphas)[::-1]
+    i = int(np.argmin(np.abs(alphas - alpha)))
+    lo, hi = max(0, i - refine_width), min(len(alphas), i + refine_width + 1)
+    alphas = alphas[lo:hi]
+    lasso_args = {k: v for k, v in fit_args.items() if k in ("fit_intercept", "max_iter", "tol", "random_state", "selection")}
+
+    def _warm_lasso(alpha):
+        lasso = MultiTaskLasso(alpha=alpha, warm_start=True, **lasso_args)
+        lasso.coef_ = np.array(coef)
+        return lasso
+
+    splits = list(check_cv(n_v_cv).split(X, Y))
+    mse_path = np.empty((len(alphas), len(splits)))
+    for f, (train, test) in enumerate(splits):
+        lasso = _warm_lasso(alphas[0])
+        for a, alpha_a in enumerate(alphas):
+            lasso.set_params(alpha=alpha_a).fit(X[train], Y[train])
+            mse_path[a, f] = np.mean(np.square(Y[test] - lasso.predict(X[test])))
+    best = int(np.argmin(mse_path.mean(axis=1)))
+    if (best == 0 and lo > 0) or (best == len(alphas) - 1 and hi < len(path[0])):
+        return None
+    fit = _warm_lasso(alphas[best]).fit(X, Y)
+    fit.alpha_, fit.alphas_, fit.mse_path_ = alphas[best], alphas, mse_path
+    return fit
 
 def MTLasso_MatchSpace_factory(v_pen, sample_frac=1, Y_col_block_size=None, se_factor=None, normalize=True):
     """
@@ -6,6 +6,9 @@ from warnings import warn
 
 from .warnings import SparseSCWarning
 
+#: Number of control effects gathered at a time when generating placebos
+_PLACEBO_CHUNK_ELEMENTS = 2 ** 20
+
 def simulation_eval(effects, CI_lowers, CI_uppers, true_effect=0):
     """ Returns typical stats for sims of estimation
     :param effects: vector of effects
@@ -193,6 +196,10 @@ def _gen_placebo_stats_from_diffs(
     level=0.95,
     vec_index = None,
     sym_CI=True,
+    chunk_size=None,
+    exact=False,
+    seed=None,
+    unique=False,
 ):
     """Generates placebo distribution to compare effects against. 
     For a single treated unit, this is just the control effects.
@@ -201,20 +208,35 @@ def _gen_placebo_stats_from_diffs(
     Generates 2-sided p-values
 
     :param effect_vecs:
-    :param control_effect_vecs:
+    :param control_effect_vecs: The control effects, or a list of
+        ``(block, repeats)`` pairs for blocks of control effects that are
+        repeated (e.g. once per treated unit), which are then not copied
     :param max_n_pl: Set to 0 if you want all
     :param ret_pl: Return placebo distribution
     :param ret_CI: Return confidence intervals
     :param level:
     :param vec_index:
     :param sym_CI: Return symmetric CI
+    :param chunk_size: Number of placebos computed at a time (by default,
+        enough to gather about a million control effects)
+    :param exact: Compute the p-values of the per-period, average and RMS
+        effects over all the combinations of controls, whatever
+        ``max_n_pl``, with :func:`_exact_subset_mean_p` rather than from
+        the (sampled) placebos. The placebos are then only generated for
+        ``ret_pl`` and ``ret_CI``, or for the p-values that are too costly
+        (e.g. for many treated units), which are still from the placebos.
+    :param seed: Seed (int, :class:`numpy.random.SeedSequence` or
+        :class:`numpy.random.Generator`) for the random placebos, used when
+        there are more than ``max_n_pl`` combinations of controls
+    :param unique: Sample the random placebos without replacement
 
     :returns: PlaceboResults, the Placebo test results
     """
     if vec_index is not None:
         import pandas as pd
     N1 = effect_vecs.shape[0]
-    N0 = control_effect_vecs.shape[0]
+    control_effect_vecs, control_rows = _distinct_rows(control_effect_vecs)
+    N0 = control_rows.shape[0] if control_rows is not None else control_effect_vecs.shape[0]
     T1 = effect_vecs.shape[1]
 
     keep_pl = ret_pl or ret_CI
@@ -226,29 +248,45 @@ def _gen_placebo_stats_from_diffs(
     ##Get the avg joint effects
     avg_joint_effects = np.mean(effect_vecs, axis=1)
     control_avg_joint_effects = np.mean(control_effect_vecs, axis=1)
+    # the distinct control effects and their multiplicities, for the exact p-values
+    distinct_rms_joint_effects = control_rms_joint_effects
+    distinct_avg_joint_effects = control_avg_joint_effects
+    row_counts = None
+    if control_rows is not None:
+        row_counts = np.bincount(control_rows, minlength=control_effect_vecs.shape[0])
+        control_rms_joint_effects = control_rms_joint_effects[control_rows]
+        control_avg_joint_effects = control_avg_joint_effects[control_rows]
 
     # Compute the outcomes for treatment
     effect_vec = np.mean(effect_vecs, axis=0)
     rms_joint_effect = np.mean(rms_joint_effects)
     avg_joint_effect = np.mean(avg_joint_effects)
 
-    def _ncr(n, r):
-        # https://stackoverflow.com/questions/4941753/is-there-a-math-ncr-function-in-python
-        import operator as op
-        import functools
-
-        r = min(r, n - r)
-        numer = functools.reduce(op.mul, range(n, n - r, -1), 1)  # from py2 xrange()
-        denom = functools.reduce(op.mul, range(1, r + 1), 1)  # from py2 xrange()
-        return numer // denom
-
     n_pl = _ncr(N0, N1)
+    if chunk_size is None:
+        # bound the (chunk_size x N1 x T1) gathered control effects
+        chunk_size = max(1, _PLACEBO_CHUNK_ELEMENTS // max(N1 * T1, 1))
     if max_n_pl > 0 and n_pl > max_n_pl:  # randomize
-        comb_iter = _random_combinations(max_n_pl, N0, N1)
+        comb_chunks = _random_combination_chunks(max_n_pl, N0, N1, chunk_size, seed, unique)
         comb_len = max_n_pl
     else:
-        comb_iter = itertools.combinations(range(N0), N1)
+        comb_chunks = _combination_chunks(N0, N1, chunk_size)
         comb_len = n_pl
+        exact = False  # the placebos are all the combinations already
+
+    if exact:
+        # None where it's too costly, falling back to the placebos
+        exact_vec_p = [
+            _exact_subset_mean_p(control_effect_vecs[:, t], N1, abs(effect_vec[t]), n_pl, counts=row_counts)
+            for t in range(T1)
+        ]
+        exact_avg_joint_p = _exact_subset_mean_p(distinct_avg_joint_effects, N1, abs(avg_joint_effect), n_pl,
+                                                 counts=row_counts)
+        exact_rms_joint_p = _exact_subset_mean_p(distinct_rms_joint_effects, N1, rms_joint_effect, n_pl,
+                                                 two_sided=False, counts=row_counts)
+        exact_ps = exact_vec_p + [exact_avg_joint_p, exact_rms_joint_p]
+        if not keep_pl and all(p is not None for p in exact_ps):
+            comb_chunks = []
 
     if keep_pl:
         placebo_effect_vecs = np.empty((comb_len, T1))
@@ -262,24 +300,33 @@ def _gen_placebo_stats_from_diffs(
     rms_joint_p = 0
     avg_joint_p = 0
 
-    for idx, comb in enumerate(comb_iter):
-        placebo_effect_vec = np.mean(control_effect_vecs[comb, :], 0)
-        placebo_rms_joint_effect = np.mean(control_rms_joint_effects.take(comb))
-        placebo_avg_joint_effect = np.mean(control_avg_joint_effects.take(comb))
-
-        # p1s += (effect_vec_sgn*placebo_effect_vec >= effect_vec_sgn*effect_vec)
-        # p1s_std += (effect_vec_sgn*placebo_std_effect_vec >= effect_vec_sgn*std_effect_vec)
-        vec_p += abs(placebo_effect_vec) >= abs(effect_vec)
-        rms_joint_p += placebo_rms_joint_effect >= rms_joint_effect
-        avg_joint_p += abs(placebo_avg_joint_effect) >= abs(avg_joint_effect)
+    start = 0
+    for combs in comb_chunks:
+        # combs is a (n_chunk x N1) matrix of control indexes
+        stop = start + combs.shape[0]
+        combs_rows = control_rows[combs] if control_rows is not None else combs
+        placebo_effect_vec = np.mean(control_effect_vecs[combs_rows, :], axis=1)
+        placebo_rms_joint_effect = np.mean(control_rms_joint_effects[combs], axis=1)
+        placebo_avg_joint_effect = np.mean(control_avg_joint_effects[combs], axis=1)
+
+        vec_p += np.sum(abs(placebo_effect_vec) >= abs(effect_vec), axis=0)
+        rms_joint_p += np.sum(placebo_rms_joint_effect >= rms_joint_effect)
+        avg_joint_p += np.sum(abs(placebo_avg_joint_effect) >= abs(avg_joint_effect))
         if keep_pl:
-            placebo_effect_vecs[idx, :] = placebo_effect_vec
-            placebo_avg_joint_effects[idx] = placebo_avg_joint_effect
-            placebo_rms_joint_effects[idx] = placebo_rms_joint_effect
+            placebo_effect_vecs[start:stop, :] = placebo_effect_vec
+            placebo_avg_joint_effects[start:stop] = placebo_avg_joint_effect
+            placebo_rms_joint_effects[start:stop] = placebo_rms_joint_effect
+        start = stop
 
     vec_p = _calculate_p_value(vec_p, comb_len)
     rms_joint_p = _calculate_p_value(rms_joint_p, comb_len)
     avg_joint_p = _calculate_p_value(avg_joint_p, comb_len)
+    if exact:
+        vec_p = np.array([p if p is not None else p_pl for p, p_pl in zip(exact_vec_p, vec_p)])
+        if exact_avg_joint_p is not None:
+            avg_joint_p = exact_avg_joint_p
+        if exact_rms_joint_p is not None:
+            rms_joint_p = exact_rms_joint_p
 
     if ret_CI:
         # CI - All hypothetical true effects (beta0) that would not be reject
@@ -294,40 +341,15 @@ def _gen_placebo_stats_from_diffs(
         alpha_ind = max((1, round(alpha / p2min))) - 1
         alpha = alpha_ind * p2min
 
-        def _gen_CI(placebo_effects, alpha_ind, effect, null_is_zero=True, sym_CI=True):
-            #sym_CI makes symmetric CIs by looking as the absolute values of placebo_effect (like Fishcer 2-sided p-values)
-            npl = placebo_effects.shape[0]
-            if sym_CI:
-                sorted_abs_eff = np.sort(np.abs(placebo_effects))
-                outside_avg_effect = sorted_abs_eff[(npl - 1) - 2*alpha_ind]
-                return (effect - outside_avg_effect, effect + outside_avg_effect)
-            else:
-                sorted_eff = np.sort(placebo_effects)
-                low_avg_effect = sorted_eff[alpha_ind]
-                high_avg_effect = sorted_eff[(npl - 1) - alpha_ind]
-                if (
-                    null_is_zero
-                    and np.sign(low_avg_effect) == np.sign(high_avg_effect)
-                    and low_avg_effect != 0
-                    and high_avg_effect != 0
-                ):
-                    warn(
-                        "CI doesn't contain 0. You might not have enough placebo effects.",
-                        SparseSCWarning
-                    )
-                return (effect - high_avg_effect, effect - low_avg_effect)
-
-        CI_vec = np.empty((2, T1))
-        for t in range(T1):
-            CI_vec[:, t] = _gen_CI(placebo_effect_vecs[:, t], alpha_ind, effect_vec[t], sym_CI=sym_CI)
+        CI_vec = _placebo_CI(placebo_effect_vecs, alpha_ind, effect_vec, sym_CI=sym_CI)
         if vec_index is not None:
-            CI_vec = CI_int(pd.Series(CI_vec[0, :], index=vec_index), pd.Series(CI_vec[1, :], index=vec_index), level)
+            CI_vec = CI_int(pd.Series(CI_vec[0], index=vec_index), pd.Series(CI_vec[1], index=vec_index), level)
         else:
-            CI_vec = CI_int(CI_vec[0, :], CI_vec[1, :], level)
+            CI_vec = CI_int(CI_vec[0], CI_vec[1], level)
 
-        CI_avg = _gen_CI(placebo_avg_joint_effects, alpha_ind, avg_joint_effect, sym_CI=sym_CI)
+        CI_avg = _placebo_CI(placebo_avg_joint_effects, alpha_ind, avg_joint_effect, sym_CI=sym_CI)
         CI_avg = CI_int(CI_avg[0], CI_avg[1], level)
-        CI_rms = _gen_CI(
+        CI_rms = _placebo_CI(
             placebo_rms_joint_effects, alpha_ind, rms_joint_effect, null_is_zero=False, sym_CI=sym_CI
         )
         CI_rms = CI_int(CI_rms[0], CI_rms[1], level)
@@ -351,17 +373,303 @@ def _gen_placebo_stats_from_diffs(
     return ret_struct
 
 
-def _random_combinations(num, n, c):
+def _placebo_CI(placebo_effects, alpha_ind, effect, null_is_zero=True, sym_CI=True, chunk_elements=None):
+    """
+    Confidence interval(s) from the placebo distribution(s), flipped around
+    the effect(s).
+
+    Only the order statistics at the bounds are needed, so rather than
+    sorting, the placebos are partitioned around them (``np.partition``) for
+    all the periods at once, a block of columns at a time.
+
+    :param placebo_effects: n_pl placebo effects, or an (n_pl x T1) matrix
+        of them (one column per period)
+    :param alpha_ind: Index of the lower bound (in the sorted placebos)
+    :param effect: The effect (or T1 vector of effects)
+    :param null_is_zero: Warn if a (asymmetric) CI doesn't contain 0
+    :param sym_CI: Make symmetric CIs by looking at the absolute values of
+        the placebo effects (like Fisher 2-sided p-values)
+    :param chunk_elements: Maximum number of placebos partitioned at a time
+        (by default, about a million)
+
+    :returns: (CI lower bound(s), CI upper bound(s))
+    """
+    placebo_effects = np.asarray(placebo_effects)
+    vec = placebo_effects.ndim == 2
+    if not vec:
+        placebo_effects = placebo_effects[:, None]
+    npl, T1 = placebo_effects.shape
+    if chunk_elements is None:
+        chunk_elements = _PLACEBO_CHUNK_ELEMENTS
+    chunk_cols = max(1, chunk_elements // max(npl, 1))
+    if sym_CI:
+        kth = [(npl - 1) - 2 * alpha_ind]
+    else:
+        kth = [alpha_ind, (npl - 1) - alpha_ind]
+    bounds = np.empty((len(kth), T1))
+    for start in range(0, T1, chunk_cols):
+        block = placebo_effects[:, start:(start + chunk_cols)]
+        if sym_CI:
+            block = np.abs(block)  # a copy, which can be partitioned in place
+        else:
+            block = block.copy()
+        block.partition(kth, axis=0)
+        bounds[:, start:(start + chunk_cols)] = block[kth, :]
+    effect = np.asarray(effect)
+    if sym_CI:
+        outside_effect = bounds[0] if vec else bounds[0, 0]
+        return (effect - outside_effect, effect + outside_effect)
+    low_effect, high_effect = (bounds[0], bounds[1]) if vec else (bounds[0, 0], bounds[1, 0])
+    if null_is_zero and np.any(
+        (np.sign(low_effect) == np.sign(high_effect)) & (low_effect != 0) & (high_effect != 0)
+    ):
+        warn(
+            "CI doesn't contain 0. You might not have enough placebo effects.",
+            SparseSCWarning
+        )
+    return (effect - high_effect, effect - low_effect)
+
+
+def _distinct_rows(control_effect_vecs):
+    """
+    :returns: the distinct rows of the control effects and, when they are
+        given as ``(block, repeats)`` pairs, the index of the distinct row for
+        each of the (repeated) rows (otherwise ``None``)
+    """
+    if not isinstance(control_effect_vecs, list):
+        return control_effect_vecs, None
+    blocks, rows, start = [], [], 0
+    for block, repeats in control_effect_vecs:
+        block = np.asarray(block)
+        blocks.append(block)
+        rows.append(np.tile(np.arange(start, start + block.shape[0]), repeats))
+        start += block.shape[0]
+    return np.vstack(blocks), np.concatenate(rows).astype(int)
+
+
+def _combination_chunks(n, c, chunk_size):
+    """
+    Yields:
+       ndarray: (up to) ``chunk_size x c`` matrices of all the combinations of
+       ``c`` ints from ``range(n)``, in lexicographic order
     """
-    https://stackoverflow.com/a/55307388/1519199
+    comb_iter = itertools.combinations(range(n), c)
+    while True:
+        chunk = np.fromiter(
+            itertools.chain.from_iterable(itertools.islice(comb_iter, chunk_size)), dtype=int
+        )
+        if c == 0 or chunk.size == 0:
+            if c == 0:  # a single, empty, combination
+                yield np.empty((1, 0), dtype=int)
+            return
+        yield chunk.reshape(-1, c)
+
 
+def _random_combination_chunks(num, n, c, chunk_size, seed=None, unique=False):
+    """
     Yields:
-       Sequence[int]: a tuple ``c`` ints from ``range(n)``
+       ndarray: (up to) ``chunk_size x c`` matrices of random combinations
+       (drawn with replacement between rows, unless ``unique``, but not
+       within them) of ``c`` ints from ``range(n)``, ``num`` in total
+    """
+    rng = _placebo_rng(seed)
+    if unique:
+        n_comb = _ncr(n, c)
+        if num > n_comb:
+            raise ValueError("Can't draw %s unique combinations out of %s" % (num, n_comb))
+        if 2 * num > n_comb:
+            # most of them are needed, so pick from the full enumeration
+            keep = np.zeros(n_comb, dtype=bool)
+            keep[rng.choice(n_comb, num, replace=False)] = True
+            start = 0
+            for combs in _combination_chunks(n, c, chunk_size):
+                stop = start + combs.shape[0]
+                yield combs[keep[start:stop]]
+                start = stop
+            return
+        seen = set()
+    done = 0
+    while done < num:
+        rows = min(chunk_size, num - done)
+        combs = _draw_combinations(rng, rows, n, c)
+        if unique:
+            # redraw the rows already drawn (in any order)
+            pending = np.arange(rows)
+            while pending.size:
+                dup = []
+                for i, row in zip(pending, np.sort(combs[pending], axis=1)):
+                    key = row.tobytes()
+                    if key in seen:
+                        dup.append(i)
+                    else:
+                        seen.add(key)
+                pending = np.array(dup, dtype=int)
+                combs[pending] = _draw_combinations(rng, pending.size, n, c)
+        done += rows
+        yield combs
+
+
+def _draw_combinations(rng, rows, n, c):
+    """ ``rows x c`` matrix of random combinations of ``c`` ints from ``range(n)`` """
+    if c * c <= n:
+        # duplicates within a row are rare, so redraw the rows that have any
+        combs = rng.integers(n, size=(rows, c))
+        while True:
+            sorted_combs = np.sort(combs, axis=1)
+            dup = (sorted_combs[:, 1:] == sorted_combs[:, :-1]).any(axis=1)
+            if not dup.any():
+                return combs
+            combs[dup] = rng.integers(n, size=(dup.sum(), c))
+    # the c smallest of n uniform keys, for a bounded number of rows at a time
+    max_rows = max(1, _PLACEBO_CHUNK_ELEMENTS // n)
+    return np.vstack([
+        np.argpartition(rng.random((min(max_rows, rows - start), n)), c - 1, axis=1)[:, :c]
+        for start in range(0, rows, max_rows)
+    ] or [np.empty((0, c), dtype=int)])
+
+
+def _placebo_rng(seed):
+    """
+    :returns: a :class:`numpy.random.Generator` for the seed (an int,
+        :class:`numpy.random.SeedSequence` or a Generator, which is returned
+        as is). With no seed, it is seeded from the global ``numpy.random``
+        state so that ``np.random.seed()`` still makes the placebos reproducible.
+    """
+    if seed is None:
+        seed = np.random.randint(2 ** 31 - 1)
+    return np.random.default_rng(seed)
+
+
+def _spawn_placebo_seeds(seed, n):
+    """
+    :returns: ``n`` independent :class:`numpy.random.SeedSequence` streams
+        derived from ``seed``, e.g. one for each (parallel) set of placebos
     """
-    i = 0
-    while i < num:
-        i += 1
-        yield np.random.choice(n, c, replace=False)
+    if isinstance(seed, np.random.Generator):
+        seed = seed.integers(2 ** 63, size=4)
+    elif seed is None:
+        seed = np.random.randint(2 ** 31 - 1)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+
+def _ncr(n, r):
+    # https://stackoverflow.com/questions/4941753/is-there-a-math-ncr-function-in-python
+    import operator as op
+    import functools
+
+    r = min(r, n - r)
+    numer = functools.reduce(op.mul, range(n, n - r, -1), 1)  # from py2 xrange()
+    denom = functools.reduce(op.mul, range(1, r + 1), 1)  # from py2 xrange()
+    return numer // denom
+
+
+def _exact_subset_mean_p(x, k, threshold, n_pl, two_sided=True, atol=1e-4, rtol=0.01, max_bins=2 ** 12,
+                         counts=None, max_enum=10 ** 5, max_work=2 ** 25):
+    """
+    p-value of ``threshold`` against the means of all the ``k``-subsets of
+    ``x`` (each value repeated ``counts`` times, if given), i.e.
+    ``_calculate_p_value()`` of the number of subsets whose mean is at least
+    ``threshold`` (in absolute value if ``two_sided``), without sampling
+    the ``n_pl`` subsets.
+
+    Subsets of one or two values are counted exactly (by sorting), and up to
+    ``max_enum`` subsets are counted exactly by enumerating them.  Otherwise,
+    the values are rounded to a grid of ``bins`` steps and the distribution
+    of the sum of a uniformly random ``k``-subset is recovered from its
+    characteristic function.  At each frequency, that is the ``k``-th
+    elementary symmetric polynomial of the (unit) phases of the values,
+    normalized by ``choose(n, k)``, which follows from their power sums by
+    Newton's identities.  The power sums are all read off one FFT of the
+    histogram of the grid values, so each grid costs ``O(k^3 bins)`` time
+    whatever the number of (repeated) values.  The rounding error of a subset
+    sum is at most ``k`` times that of a value, which brackets the tail
+    probability.  The grid is refined until the bracket is within
+    ``max(atol, rtol * p)`` and the upper end is returned, so the p-value is
+    conservative (and only exact when the values lie on the grid).
+
+    :returns: the p-value, or None when the bracket can't be narrowed to the
+        tolerance within ``max_bins`` steps and ``k^3 bins <= max_work`` (e.g.
+        for large ``k``), for the caller to fall back to sampled placebos
+    """
+    x = np.asarray(x, dtype=np.float64)
+    counts = np.ones(len(x), dtype=int) if counts is None else np.asarray(counts)
+    x, counts = x[counts > 0], counts[counts > 0]
+    n = int(counts.sum())
+    target = k * threshold
+    # float slack, so that ties count as "at least as large"
+    slack = 1e-9 * k * max(np.max(np.abs(x)), abs(threshold), 1e-300)
+
+    def _tail(sums, err):
+        if two_sided:
+            return (sums + err >= target) | (sums - err <= -target)
+        return sums + err >= target
+
+    if k == 1:
+        return _calculate_p_value(np.sum(counts[_tail(x, slack)]), n_pl)
+    if k == 2:
+        # pairs i<j with x_i + x_j in the tail(s), counted from both ends
+        x_sorted = np.sort(np.repeat(x, counts))
+        n_at_least = np.sum(n - np.searchsorted(x_sorted, target - slack - x_sorted))
+        n_at_least -= np.sum(2 * x_sorted + slack >= target)  # paired with itself
+        if two_sided:
+            if target <= 0:
+                return _calculate_p_value(n_pl, n_pl)
+            n_at_least += np.sum(np.searchsorted(x_sorted, slack - target - x_sorted, side="right"))
+            n_at_least -= np.sum(2 * x_sorted - slack <= -target)
+        return _calculate_p_value(n_at_least / 2, n_pl)
+    if n_pl <= max_enum:
+        x_rep = np.repeat(x, counts)
+        n_at_least = 0
+        for combs in _combination_chunks(n, k, max(1, _PLACEBO_CHUNK_ELEMENTS // k)):
+            n_at_least += np.sum(_tail(x_rep[combs].sum(axis=1), slack))
+        return _calculate_p_value(n_at_least, n_pl)
+    if k ** 3 * 64 > max_work:
+        return None
+
+    # Newton's identities for f_j = e_j / choose(n, j), with power sums n q_i:
+    # f_j = sum_i (-1)^(i-1) n choose(n, j-i) / (j choose(n, j)) f_(j-i) q_i
+    from scipy.special import gammaln
+
+    j, i = np.arange(1, k + 1)[:, None], np.arange(1, k + 1)[None, :]
+    log_ncr = lambda r: gammaln(n + 1) - gammaln(r + 1) - gammaln(n - r + 1)
+    with np.errstate(invalid="ignore"):
+        newton = np.where(
+            i <= j,
+            (-1.0) ** (i - 1) * np.exp(np.log(n) + log_ncr(np.maximum(j - i, 0)) - np.log(j) - log_ncr(j)),
+            0,
+        )
+
+    x_min, width = x.min(), x.max() - x.min()
+    bins = 64
+    while True:
+        h = width / bins if width > 0 else 1.0
+        v = np.rint((x - x_min) / h).astype(int)
+        err = k * np.max(np.abs(x - (x_min + h * v))) + slack
+        L = k * bins + 1  # the subset sums (in steps) are 0..k*bins
+        hist_fft = np.fft.fft(np.bincount(v, weights=counts, minlength=bins + 1), L) / n
+        freqs = np.arange(L)
+        # q_i at each frequency b is the histogram's FFT at i*b
+        q = hist_fft[(np.arange(1, k + 1)[:, None] * freqs[None, :]) % L]
+        f = np.empty((k + 1, L), dtype=complex)
+        f[0] = 1
+        for jj in range(1, k + 1):
+            f[jj] = np.einsum("i,ib,ib->b", newton[jj - 1, :jj], f[jj - 1::-1], q[:jj])
+        P = np.fft.ifft(f[k]).real
+        sums = k * x_min + h * np.arange(L)
+        p_high = P[_tail(sums, err)].sum()
+        p_low = P[_tail(sums, -err)].sum()
+        if p_high - p_low <= max(atol, rtol * p_high):
+            break
+        if 2 * bins > max_bins or k ** 3 * 2 * bins > max_work:
+            return None
+        bins *= 2
+    p = min(max(p_high, 0.0), 1.0)
+    n_pl = float(n_pl) if n_pl < 1e300 else np.inf
+    if not np.isfinite(n_pl):
+        return p
+    return (p * n_pl + 1) / (n_pl + 1)
 
 
 def _calculate_p_value(npl_at_least_as_large, npl, incl_actual_in_set=True):
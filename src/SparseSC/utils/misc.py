@@ -1,6 +1,7 @@
 # Allow capturing output
 # Modified (to not capture stderr too) from https://stackoverflow.com/questions/5136611/
 import contextlib
+import functools
 import sys
 
 from .print_progress import it_progressbar, it_progressmsg
@@ -30,31 +31,207 @@ def capture_all():
         sys.stdout, sys.stderr = STDOUT, STDERR
 
 
-def par_map(part_fn, it, F, loop_verbose, n_multi=0, header="LOOP"):  
-    if n_multi>0:
-        from multiprocessing import Pool
+def par_map(part_fn, it, F, loop_verbose, n_multi=0, header="LOOP", chunksize=None, pool=None, share_min_bytes=2 ** 16):
+    """
+    ``list(map(part_fn, it))``, optionally over a pool of processes.
 
-        with Pool(n_multi) as p:
-            #p.map evals the it so can't use it_progressbar(it)
-            if loop_verbose==1:
-                rets = []
-                print(header + ":")
-                for ret in it_progressbar(p.imap(part_fn, it), count=F):
-                    rets.append(ret)
-            elif loop_verbose==2:
-                rets = []
-                for ret in it_progressmsg(p.imap(part_fn, it), prefix=header, count=F):
-                    rets.append(ret)
-            else:
-                rets = p.map(part_fn, it)
-    else:
+    When ``part_fn`` is a :func:`functools.partial`, its array keyword
+    arguments of at least ``share_min_bytes`` (e.g. the features and targets)
+    are published to the workers once, in shared memory (see
+    :class:`SharedArrays`), and the tasks only carry the items of ``it``
+    rather than a pickled copy of the data.
+
+    :param n_multi: Number of processes (0=run in this process)
+    :param chunksize: Number of items sent to a worker at a time. Defaults
+        to splitting the items into about 4 chunks per process.
+    :param pool: A (persistent) :class:`multiprocessing.pool.Pool` to use
+        rather than starting one with ``n_multi`` processes. Its workers
+        attach the shared arrays on their first task of each call.
+    """
+    if pool is None and n_multi <= 0:
         if loop_verbose==1:
             print(header + ":")
             it = it_progressbar(it, count=F)
         elif loop_verbose==2:
             it = it_progressmsg(it, prefix=header, count=F)
-        rets = list(map(part_fn, it))
-    return rets
+        return list(map(part_fn, it))
+
+    from multiprocessing import Pool
+
+    if chunksize is None:
+        n_procs = pool._processes if pool is not None else n_multi  # pylint: disable=protected-access
+        chunksize = max(1, -(-F // (4 * n_procs)))
+    part_fn, arrays = _split_shared_arrays(part_fn, share_min_bytes)
+    with SharedArrays(arrays) as shared:
+        if pool is not None:
+            specs = shared.initargs[0]
+            tasks = pool.imap(_par_map_pool_task, ((part_fn, specs, item) for item in it), chunksize)
+            return _collect(tasks, F, loop_verbose, header)
+        with Pool(n_multi, initializer=_init_par_map, initargs=(part_fn,) + shared.initargs) as p:
+            #p.map evals the it so can't use it_progressbar(it)
+            return _collect(p.imap(_par_map_task, it, chunksize), F, loop_verbose, header)
+
+
+def _collect(rets_it, F, loop_verbose, header):
+    if loop_verbose==1:
+        print(header + ":")
+        rets_it = it_progressbar(rets_it, count=F)
+    elif loop_verbose==2:
+        rets_it = it_progressmsg(rets_it, prefix=header, count=F)
+    return list(rets_it)
+
+
+def _split_shared_arrays(part_fn, share_min_bytes):
+    """ split the large array keyword arguments out of a partial """
+    import numpy as np
+
+    if not isinstance(part_fn, functools.partial):
+        return part_fn, {}
+    arrays = {
+        k: v for k, v in part_fn.keywords.items() if isinstance(v, np.ndarray) and v.nbytes >= share_min_bytes
+    }
+    if not arrays:
+        return part_fn, {}
+    keywords = {k: v for k, v in part_fn.keywords.items() if k not in arrays}
+    return functools.partial(part_fn.func, *part_fn.args, **keywords), arrays
+
+
+#: The task function of the par_map() workers
+_PAR_MAP_FN = None
+
+
+def _init_par_map(part_fn, specs):
+    """ par_map() pool initializer: rebuild the task function around the shared arrays """
+    global _PAR_MAP_FN  # pylint: disable=global-statement
+    _attach_shared_arrays(specs)
+    _PAR_MAP_FN = functools.partial(part_fn, **{k: _SHARED_ARRAYS[k] for k in specs})
+
+
+def _par_map_task(item):
+    return _PAR_MAP_FN(item)
+
+
+def _par_map_pool_task(args):
+    """ par_map() task for a persistent pool, which maps in the shared arrays once per call """
+    part_fn, specs, item = args
+    blocks = tuple(sorted((k, v[0]) for k, v in specs.items() if isinstance(v, tuple)))
+    if _SHARED_SPECS.get("blocks") != blocks or len(blocks) < len(specs):
+        _attach_shared_arrays(specs)
+        _SHARED_SPECS["blocks"] = blocks
+    return part_fn(item, **{k: _SHARED_ARRAYS[k] for k in specs})
+
+
+def default_n_multi(n_tasks, part_fn=None):
+    """
+    Number of processes for :func:`par_map` to spread ``n_tasks`` over: one
+    per available core (up to ``n_tasks``), or 0 (run in this process) with
+    a single core, a single task, in a daemonic process (e.g. a
+    ``multiprocessing.Pool`` worker, which can't have children), or if
+    ``part_fn`` can't be pickled (e.g. it closes over a lambda).
+    """
+    import os
+    import pickle
+    import multiprocessing
+
+    if multiprocessing.current_process().daemon:
+        return 0
+    try:
+        n_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cores = os.cpu_count() or 1
+    if n_cores <= 1 or n_tasks <= 1:
+        return 0
+    if part_fn is not None:
+        # the large arrays are shared rather than pickled (see par_map())
+        light_fn, _ = _split_shared_arrays(part_fn, 2 ** 16)
+        try:
+            pickle.dumps(light_fn)
+        except Exception:  # pylint: disable=broad-except
+            return 0
+    return min(n_cores, n_tasks)
+
+
+#: Arrays published to the worker processes by :class:`SharedArrays`
+_SHARED_ARRAYS = {}
+_SHARED_BLOCKS = []
+_SHARED_SPECS = {}
+
+
+class SharedArrays(object):
+    """
+    Publishes a dict of (large) arrays to worker processes once, rather than
+    pickling them with every task.  The arrays are copied into
+    :mod:`multiprocessing.shared_memory` blocks (or, before Python 3.8,
+    pickled once per worker).  Pass :attr:`initializer` and :attr:`initargs`
+    to the pool, and read the arrays in the workers with :func:`shared_arrays`.  Used as a context manager, the
+    shared memory is released on exit.
+
+    :param arrays: Arrays by name (``None`` values are passed through)
+    :type arrays: dict
+    """
+
+    def __init__(self, arrays):
+        import numpy as np
+
+        self._blocks = []
+        #: The pool's ``initializer``
+        self.initializer = _attach_shared_arrays
+        specs = {}
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            shared_memory = None
+        for name, arr in arrays.items():
+            if arr is None or shared_memory is None:
+                specs[name] = arr
+                continue
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+            self._blocks.append(block)
+            specs[name] = (block.name, arr.shape, arr.dtype.str)
+        #: The pool's ``initargs``, a picklable description of the arrays
+        self.initargs = (specs,)
+
+    def close(self):
+        """ release the shared memory """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _attach_shared_arrays(specs):
+    """ pool initializer: map the arrays published by :class:`SharedArrays` """
+    import numpy as np
+
+    _SHARED_ARRAYS.clear()
+    del _SHARED_BLOCKS[:]
+    for name, spec in specs.items():
+        if isinstance(spec, tuple):
+            from multiprocessing import shared_memory
+
+            block = shared_memory.SharedMemory(name=spec[0])
+            arr = np.ndarray(spec[1], dtype=np.dtype(spec[2]), buffer=block.buf)
+            arr.flags.writeable = False
+            _SHARED_ARRAYS[name] = arr
+            _SHARED_BLOCKS.append(block)  # keep the mapping alive
+        else:
+            _SHARED_ARRAYS[name] = spec
+
+
+def shared_arrays():
+    """
+    :returns: the arrays published to this worker by :class:`SharedArrays`
+    :rtype: dict
+    """
+    return _SHARED_ARRAYS
 
 
 class PreDemeanScaler:
@@ -86,15 +263,6 @@ class PreDemeanScaler:
         return (Y.T + self.means).T
 
 
-def _ensure_good_donor_pool(custom_donor_pool, control_units):
-    N0 = custom_donor_pool.shape[1]
-    custom_donor_pool_c = custom_donor_pool[control_units, :]
-    for i in range(N0):
-        custom_donor_pool_c[i, i] = False
-    custom_donor_pool[control_units, :] = custom_donor_pool_c
-    return custom_donor_pool
-
-
 def _get_fit_units(model_type, control_units, treated_units, N):
     if model_type == "retrospective":
         return control_units
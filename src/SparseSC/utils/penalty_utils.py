@@ -5,6 +5,7 @@ Utility methods for penalty parameters
 from SparseSC.fit_loo import loo_v_matrix
 from SparseSC.fit_ct import ct_v_matrix
 from SparseSC.fit_fold import fold_v_matrix
+from SparseSC.utils.planner import plan_gradient
 
 # from SparseSC.optimizers.cd_line_search import cdl_search
 import numpy as np
@@ -29,7 +30,7 @@ def get_max_w_pen(X,Y,v_pen,**kwargs):
     """
     return get_max_v_pen(X,Y,w_pen=1,**kwargs) / v_pen
 
-def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
+def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, memory_budget=None, **kwargs):
     """ 
     Calculates maximum value of v_pen for which the elements of tensor
     matrix (V) are not all zero conditional on the provided w_pen.  If w_pen is
@@ -38,6 +39,11 @@ def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
     Provides a unified wrapper to the various \*_v_matrix functions, passing the
     parameter ``return_max_v_pen = True`` in order to obtain the gradient
     instead of he matrix
+
+    When ``grad_splits`` is not provided and the leave-one-out gradient is
+    estimated to exceed ``memory_budget`` (bytes, defaults to the available
+    physical memory), gradient folds are used instead. See
+    :func:`SparseSC.utils.planner.plan_gradient`.
     """
 
     # PARAMETER QC
@@ -89,6 +95,15 @@ def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
         control_units = np.arange(X.shape[0])
         treated_units = np.arange(X.shape[0], X.shape[0] + X_treat.shape[0])
 
+        # fail before allocating the partial derivatives
+        plan_gradient(
+            X.shape[0],
+            X.shape[1],
+            N1=X_treat.shape[0],
+            treated_holdout=True,
+            memory_budget=memory_budget,
+        )
+
         try:
             _v_pen = iter(w_pen)
         except TypeError:
@@ -122,6 +137,14 @@ def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
 
     else:
 
+        if kwargs.get("grad_splits", None) is None:
+            # fall back to gradient folds when the leave-one-out gradient
+            # won't fit in memory
+            kwargs.pop("grad_splits", None)
+            plan = plan_gradient(X.shape[0], X.shape[1], memory_budget=memory_budget)
+            if plan.strategy == "fold":
+                kwargs["grad_splits"] = plan.grad_splits
+
         try:
             _v_pen = iter(w_pen)
         except TypeError:
@@ -136,20 +159,14 @@ def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
                     **kwargs
                 )
             # w_pen is a single value
-            try:
-                return loo_v_matrix(
-                    X=X,
-                    Y=Y,
-                    w_pen=w_pen,
-                    return_max_v_pen=True,
-                    gradient_message=_GRADIENT_MESSAGE,
-                    **kwargs
-                )
-            except MemoryError:
-                raise RuntimeError(
-                    "MemoryError encountered.  Try setting `grad_splits` "
-                    "parameter to reduce memory requirements."
-                )  
+            return loo_v_matrix(
+                X=X,
+                Y=Y,
+                w_pen=w_pen,
+                return_max_v_pen=True,
+                gradient_message=_GRADIENT_MESSAGE,
+                **kwargs
+            )
         else:
             if "grad_splits" in kwargs:
 
@@ -167,69 +184,65 @@ def get_max_v_pen(X, Y, w_pen=None, X_treat=None, Y_treat=None, **kwargs):
                 ]
 
             # w_pen is an iterable of values
-            try:
-                return [
-                    loo_v_matrix(
-                        X=X,
-                        Y=Y,
-                        w_pen=_w_pen,
-                        return_max_v_pen=True,
-                        gradient_message=_GRADIENT_MESSAGE,
-                        **kwargs
-                    )
-                    for _w_pen in w_pen
-                ]
-            except MemoryError:
-                raise RuntimeError(
-                    "MemoryError encountered.  Try setting `grad_splits` "
-                    "parameter to reduce memory requirements."
-                )  
-
-
-def RidgeCVSolution(M, control_units, controls_as_goals, extra_goals, V, w_pens=None, separate=None):
-    import scipy.linalg #superset of np.linalg and also optimized compiled
-    from sklearn.linear_model import RidgeCV
-    #Could return the weights too
-    if separate is None:
-        separate = (M.shape[1] > 2) #problems if 1, might be unstable with 2.
+            return [
+                loo_v_matrix(
+                    X=X,
+                    Y=Y,
+                    w_pen=_w_pen,
+                    return_max_v_pen=True,
+                    gradient_message=_GRADIENT_MESSAGE,
+                    **kwargs
+                )
+                for _w_pen in w_pen
+            ]
+
+
+def RidgeCVSolution(M, control_units, controls_as_goals, extra_goals, V, w_pens=None, separate=None, ret_mse=False, block_size=1000):
+    """
+    Chooses the unit weights penalty (``w_pen``) by leave-one-out
+    cross-validation of the ridge regressions of each goal unit's (scaled)
+    match space on the control units (see
+    :class:`SparseSC.utils.spectral_ridge.SpectralRidge`).
+
+    The errors for the whole path of ``w_pens`` are calculated in closed form
+    from one eigendecomposition of the scaled control Gram matrix (and its
+    rank-one downdates for the control units), so neither per-goal ``RidgeCV``
+    fits nor block diagonal designs are needed.
+
+    :param M: Match space (N x K)
+    :param control_units: Indexes of the control units
+    :param controls_as_goals: Whether the control units are goals (each
+        regressed on the other controls)
+    :param extra_goals: Indexes of other goal units, or ``None``
+    :param V: The (diagonal) match space weights
+    :param w_pens: Candidate penalties. Defaults to 40 values from 1e-5 to 1e5
+    :param separate: Unused. Kept for compatibility: the joint (generalized)
+        and separate cross-validations choose the same penalty, as the joint
+        design is block diagonal.
+    :param ret_mse: Also return the (goals x w_pens) matrix of MSEs
+    :param block_size: Number of goals evaluated at a time
+
+    :returns: The chosen ``w_pen``, and when ``ret_mse`` the matrix of MSEs
+    """
+    # pylint: disable=unused-argument
+    from SparseSC.utils.spectral_ridge import SpectralRidge
+
     if w_pens is None:
         w_pens = np.logspace(start=-5, stop=5, num=40)
-    M_c = M[control_units,:]
-    features = np.empty((0,0))
-    targets = np.empty((0,))
-    n_targets = len(control_units) if controls_as_goals else 0
-    if extra_goals is not None:
-        n_targets = n_targets + len(extra_goals)
-    mse = np.empty((n_targets, len(w_pens)))
+    M = np.asarray(M)
+    ridge = SpectralRidge(M[control_units,:], V)
+    mse = []
     if controls_as_goals:
-        for i in range(len(control_units)):
-            M_c_i = np.delete(M_c, i, axis=0)
-            features_i = (M_c_i*np.sqrt(V)).T #K* x (N0-1) 
-            targets_i = ((M_c[i,:]-M_c_i.mean(axis=0))*np.sqrt(V)).T #K*1
-
-            if not separate:
-                features = scipy.linalg.block_diag(features, features_i) #pylint: disable=no-member
-                targets = np.hstack((targets, targets_i))
-            else:
-                ridgecvfit_i = RidgeCV(alphas=w_pens, fit_intercept=False, store_cv_values=True).fit(features_i, targets_i)
-                mse[i,:] = ridgecvfit_i.cv_values_.mean(axis=0) #as n_samples x n_alphas
+        for start in range(0, len(control_units), block_size):
+            c = np.arange(start, min(start + block_size, len(control_units)))
+            mse.append(ridge.loo_cv_mse(c, w_pens))
     if extra_goals is not None:
-        i_offset = len(control_units) if controls_as_goals else 0
-        for i, extra_goal in enumerate(extra_goals):
-            features_i = (M_c*np.sqrt(V)).T #K* x (N0-1) 
-            targets_i = ((M[extra_goal,:]-M_c.mean(axis=0))*np.sqrt(V)).T #K*x1
-
-            if not separate:
-                features = scipy.linalg.block_diag(features, features_i) #pylint: disable=no-member
-                targets = np.hstack((targets, targets_i))
-            else:
-                ridgecvfit_i = RidgeCV(alphas=w_pens, fit_intercept=False, store_cv_values=True).fit(features_i, targets_i)
-                mse[i+i_offset,:] = ridgecvfit_i.cv_values_.mean(axis=0) #as n_samples x n_alphas
-
-    if not separate:
-        ridgecvfit = RidgeCV(alphas=w_pens, fit_intercept=False).fit(features, targets) #Use the generalized cross-validation
-        best_w_pen = ridgecvfit.alpha_
-    else:
-        best_w_pen = w_pens[mse.mean(axis=0).argmin()]
-    #print("joint: " + str(joint_best_w_pen) + ". separate: " + str(sep_best_w_pen))
+        extra_goals = np.asarray(extra_goals)
+        for start in range(0, len(extra_goals), block_size):
+            mse.append(ridge.cv_mse(M[extra_goals[start:start + block_size],:], w_pens))
+    mse = np.vstack(mse) if mse else np.empty((0, len(w_pens)))
+
+    best_w_pen = w_pens[mse.mean(axis=0).argmin()]
+    if ret_mse:
+        return best_w_pen, mse
     return best_w_pen
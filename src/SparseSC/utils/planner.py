@@ -0,0 +1,268 @@
+"""
+Pre-flight cost estimates for the covariate weight (V) gradient strategies.
+
+The leave-one-out, k-fold and control/treated gradients differ by orders of
+magnitude in the memory needed for their partial derivatives (``dA_dV_ki``
+and ``dB_dV_ki``) and in the cost of the linear solves in each gradient step.
+The planner estimates both before anything is allocated and picks a strategy
+that fits within a memory budget, rather than failing part way through the
+allocation with a ``MemoryError``.
+"""
+import numpy as np
+
+#: Candidate numbers of gradient folds, tried from most to least accurate
+#: when the requested strategy does not fit in memory.
+_FALLBACK_GRAD_SPLITS = (20, 10, 5, 3, 2)
+
+
+class GradientPlan(object):
+    """
+    The gradient strategy chosen by :func:`plan_gradient`, along with the
+    estimated peak memory (bytes) and floating point operations (per gradient
+    evaluation) of each of the strategies that were considered.
+    """
+
+    def __init__(self, strategy, grad_splits, requested, estimates, memory_budget):
+        #: One of ``"loo"``, ``"fold"`` or ``"ct"``
+        self.strategy = strategy
+        #: The ``grad_splits`` argument to be used with the chosen strategy
+        self.grad_splits = grad_splits
+        #: The strategy implied by the user supplied parameters
+        self.requested = requested
+        #: dict mapping a strategy label to a ``(memory, flops)`` tuple
+        self.estimates = estimates
+        #: Memory budget in bytes (``None`` for unlimited)
+        self.memory_budget = memory_budget
+
+    @property
+    def label(self):
+        """ label of the chosen strategy, as used in :attr:`estimates` """
+        return _label(self.strategy, self.grad_splits)
+
+    @property
+    def memory(self):
+        """ estimated peak memory (bytes) of the chosen strategy """
+        return self.estimates[self.label][0]
+
+    @property
+    def flops(self):
+        """ estimated floating point operations per gradient evaluation """
+        return self.estimates[self.label][1]
+
+    @property
+    def changed(self):
+        """ ``True`` when the planner overrode the requested strategy """
+        return self.label != self.requested
+
+    def __str__(self):
+        return _GradientPlan_string_template % (
+            self.label,
+            self.requested,
+            _format_bytes(self.memory_budget),
+            "\n".join(
+                "  %-10s memory: %10s, flops: %0.3g" % (k, _format_bytes(m), f)
+                for k, (m, f) in self.estimates.items()
+            ),
+        )
+
+
+_GradientPlan_string_template = """Gradient strategy: %s (requested: %s)
+Memory budget: %s
+Estimates:
+%s
+"""
+
+
+def estimate_gradient_cost(strategy, N0, N1, K, grad_splits=None, itemsize=8):
+    """
+    Estimates the peak memory and the floating point operations per gradient
+    evaluation for one of the V-matrix gradient strategies.
+
+    :param strategy: One of ``"loo"`` (:func:`SparseSC.fit_loo.loo_v_matrix`),
+        ``"fold"`` (:func:`SparseSC.fit_fold.fold_v_matrix`) or ``"ct"``
+        (:func:`SparseSC.fit_ct.ct_v_matrix`)
+    :type strategy: str
+
+    :param N0: Number of control units (for ``"loo"`` and ``"fold"``, the
+        number of units in the training set)
+    :type N0: int
+
+    :param N1: Number of treated units (only used by ``"ct"``)
+    :type N1: int
+
+    :param K: Number of features
+    :type K: int
+
+    :param grad_splits: Number of gradient folds (only used by ``"fold"``)
+    :type grad_splits: int
+
+    :param itemsize: Bytes per element (8 for :class:`numpy.float64`)
+    :type itemsize: int
+
+    :returns: tuple of the estimated peak memory in bytes and the estimated
+        floating point operations per gradient evaluation
+    :rtype: (float, float)
+
+    :raises ValueError: when ``strategy`` is not one of the allowed values
+    """
+    N0, N1, K = float(N0), float(N1), float(K)
+    if strategy == "loo":
+        # one (N0-1)x(N0-1) matrix per unit and feature
+        n = N0 - 1
+        elements = K * N0 * (n * n + n) + N0 * N0 + 3 * N0 * N0
+        flops = K * N0 * (2.0 / 3 * n ** 3 + 2 * n ** 2)
+    elif strategy == "fold":
+        # one in-fold control matrix per fold and feature
+        F = float(grad_splits)
+        t = N0 / F
+        m = N0 - t
+        elements = K * F * (m * m + m * t) + N0 * N0 + 3 * N0 * N0
+        flops = K * F * (2.0 / 3 * m ** 3 + 2 * m * m * t)
+    elif strategy == "ct":
+        elements = K * (N0 * N0 + N0 * N1) + N0 * N0 + 3 * N0 * N1
+        flops = K * (2.0 / 3 * N0 ** 3 + 4 * N0 * N0 * N1)
+    else:
+        raise ValueError("Unexpected gradient strategy '%s'" % strategy)
+    return elements * itemsize, flops
+
+
+def plan_gradient(
+    N0,
+    K,
+    N1=None,
+    grad_splits=None,
+    treated_holdout=False,
+    memory_budget=None,
+    itemsize=8,
+):
+    """
+    Chooses a gradient strategy for fitting the V-matrix which fits within a
+    memory budget.
+
+    The strategy implied by the parameters (``"ct"`` when
+    ``treated_holdout``, otherwise ``"loo"`` when ``grad_splits`` is ``None``
+    and ``"fold"`` if not) is kept when it fits in the budget.  Otherwise the
+    leave-one-out and k-fold gradients fall back to the largest number of
+    gradient folds that fits.
+
+    :param N0: Number of control units (or units in the training set)
+    :type N0: int
+
+    :param K: Number of features
+    :type K: int
+
+    :param N1: Number of treated units. Only used when ``treated_holdout``.
+    :type N1: int, optional
+
+    :param grad_splits: The requested gradient folds; an integer, or a
+        list of train and test units in each fold.
+    :type grad_splits: int or int[][], optional
+
+    :param treated_holdout: ``True`` when the gradient is calculated on the
+        treated units (i.e. ``model_type = "prospective-restricted"``)
+    :type treated_holdout: boolean
+
+    :param memory_budget: Memory budget in bytes.  Defaults to the available
+        memory (``MemAvailable`` in ``/proc/meminfo``) where that can be
+        determined, and otherwise no budget. Use ``numpy.inf`` to disable the
+        budget.
+    :type memory_budget: float, optional
+
+    :param itemsize: Bytes per element (8 for :class:`numpy.float64`)
+    :type itemsize: int
+
+    :returns: The chosen strategy and the estimates it was based on
+    :rtype: :class:`GradientPlan`
+
+    :raises RuntimeError: when no strategy fits within the memory budget
+    """
+    if memory_budget is None:
+        memory_budget = _available_memory()
+
+    estimates = {}
+
+    def _fits(strategy, splits):
+        label = _label(strategy, splits)
+        estimates[label] = estimate_gradient_cost(
+            strategy, N0, N1 or 0, K, _n_splits(splits), itemsize
+        )
+        return memory_budget is None or estimates[label][0] <= memory_budget
+
+    if treated_holdout:
+        requested = _label("ct", None)
+        if _fits("ct", None):
+            return GradientPlan("ct", None, requested, estimates, memory_budget)
+        raise RuntimeError(_no_plan_message(estimates, memory_budget))
+
+    strategy = "loo" if grad_splits is None else "fold"
+    requested = _label(strategy, grad_splits)
+    if _fits(strategy, grad_splits):
+        return GradientPlan(strategy, grad_splits, requested, estimates, memory_budget)
+
+    try:
+        iter(grad_splits)
+    except TypeError:
+        pass
+    else:
+        # user supplied folds are kept as is.
+        raise RuntimeError(_no_plan_message(estimates, memory_budget))
+
+    for splits in _FALLBACK_GRAD_SPLITS:
+        if splits >= N0 or (grad_splits is not None and splits >= grad_splits):
+            continue
+        if _fits("fold", splits):
+            return GradientPlan("fold", splits, requested, estimates, memory_budget)
+
+    raise RuntimeError(_no_plan_message(estimates, memory_budget))
+
+
+def _label(strategy, grad_splits):
+    if strategy == "fold":
+        return "fold(%s)" % _n_splits(grad_splits)
+    return strategy
+
+
+def _n_splits(grad_splits):
+    if grad_splits is None:
+        return None
+    try:
+        return len(grad_splits)
+    except TypeError:
+        return int(grad_splits)
+
+
+def _available_memory():
+    """
+    available memory in bytes (``MemAvailable``, which unlike the free pages
+    includes the reclaimable caches), or ``None`` (no budget) when it can't
+    be determined
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    value, unit = line.split()[1:3]
+                    return float(value) * (1024 if unit.lower() == "kb" else 1)
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _format_bytes(n):
+    if n is None or not np.isfinite(n):
+        return "unlimited"
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return "%0.1f %s" % (n, unit)
+        n /= 1024.0
+
+
+def _no_plan_message(estimates, memory_budget):
+    return (
+        "No gradient strategy fits within the memory budget of %s (%s). "
+        "Consider fewer features, a larger `memory_budget`, or `fit_fast()`."
+        % (
+            _format_bytes(memory_budget),
+            ", ".join("%s: %s" % (k, _format_bytes(m)) for k, (m, _) in estimates.items()),
+        )
+    )
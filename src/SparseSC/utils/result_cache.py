@@ -0,0 +1,235 @@
+"""
+An opt-in, on-disk, content-addressed cache for the results of
+:func:`SparseSC.cross_validation.score_train_test`.
+
+Entries are keyed by a hash of the array contents and the (result relevant)
+parameters, salted with the library version so that results computed by an
+older version of the library are never returned, and stored as compact
+``.npz`` files.  The size of the cache directory is capped, and the least
+recently used entries are evicted when the cap is exceeded.
+"""
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+#: Bump this when the contents or the meaning of the cached values change.
+_CACHE_FORMAT = 1
+
+#: Parameters to score_train_test() which do not affect its results.
+_IGNORED_PARAMS = ("FoldNumber", "progress", "verbose", "print_path", "quiet")
+
+
+class ScoreCache(object):
+    """
+    A directory of cached ``(v_mat, w_pen, score)`` results.
+
+    :param directory: The directory in which the entries are stored. Created
+        if it does not already exist.
+    :type directory: str
+
+    :param max_bytes: Maximum total size of the cached entries.  The least
+        recently used entries are evicted when it is exceeded.
+    :type max_bytes: int, default = 1GB
+
+    :param salt: Salt added to each key.  Defaults to the library version, so
+        that upgrading the library invalidates the existing entries.
+    :type salt: str, optional
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30, salt=None):
+        if salt is None:
+            from SparseSC import __version__
+
+            salt = "SparseSC-%s-%s" % (__version__, _CACHE_FORMAT)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, **params):
+        """
+        Hash the array contents and parameters into a key.
+
+        :returns: A hex digest, or ``None`` if any of the parameters can't be
+            hashed reproducibly (e.g. a generator), in which case the call
+            should not be cached.
+        :rtype: str
+        """
+        h = hashlib.sha256(self.salt.encode("utf-8"))
+        try:
+            _hash_update(
+                h,
+                {k: v for k, v in params.items() if k not in _IGNORED_PARAMS},
+            )
+        except TypeError:
+            return None
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        :returns: The cached ``(v_mat, w_pen, score)``, or ``None`` on a miss
+        :rtype: tuple
+        """
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                value = (entry["v_mat"], entry["w_pen"][()], entry["score"][()])
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)  # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, v_mat, w_pen, score):
+        """
+        Store an entry and evict the least recently used entries if the
+        cache has grown beyond ``max_bytes``
+        """
+        if key is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                np.savez(
+                    fp,
+                    v_mat=np.asarray(v_mat),
+                    w_pen=np.asarray(w_pen, dtype=np.float64),
+                    score=np.asarray(score, dtype=np.float64),
+                )
+            # atomic, so that concurrent workers never see partial entries
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def counts(self):
+        """
+        :returns: the number of hits, misses and evictions
+        :rtype: tuple
+        """
+        return self.hits, self.misses, self.evictions
+
+    def add_counts(self, counts):
+        """ add the :meth:`counts` of (a copy of) the cache used elsewhere,
+        e.g. in a worker process """
+        hits, misses, evictions = counts
+        self.hits += hits
+        self.misses += misses
+        self.evictions += evictions
+
+    def stats(self):
+        """
+        :returns: the number of hits, misses, evictions, entries and bytes.
+            Hits, misses and evictions in worker processes (e.g.
+            ``CV_score(parallel=True)``) are included once they're added
+            with :meth:`add_counts`.
+        :rtype: dict
+        """
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+    def clear(self):
+        """ remove all entries """
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:  # evicted by another process
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def __str__(self):
+        return "ScoreCache(%r, hits=%s, misses=%s, evictions=%s)" % (
+            self.directory,
+            self.hits,
+            self.misses,
+            self.evictions,
+        )
+
+
+def _as_result_cache(result_cache):
+    """ coerce a directory name into a :class:`ScoreCache` """
+    if result_cache is None or isinstance(result_cache, ScoreCache):
+        return result_cache
+    return ScoreCache(result_cache)
+
+
+def _hash_update(h, obj):
+    """ Feed a (nested) parameter into the hash, raising a TypeError when it
+    can't be hashed reproducibly
+    """
+    if isinstance(obj, (bool, np.bool_)):
+        h.update(("bool:%r;" % bool(obj)).encode("utf-8"))
+    elif isinstance(obj, (int, np.integer)):
+        # numpy and Python scalars alike (e.g. a w_pen read back from the cache)
+        h.update(("int:%r;" % int(obj)).encode("utf-8"))
+    elif isinstance(obj, (float, np.floating)):
+        h.update(("float:%r;" % float(obj)).encode("utf-8"))
+    elif obj is None or isinstance(obj, (str, np.number)):
+        h.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+    elif isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        h.update(("ndarray:%s:%s;" % (arr.dtype.str, arr.shape)).encode("utf-8"))
+        h.update(arr.tobytes())
+    elif isinstance(obj, dict):
+        h.update(b"dict{")
+        for k in sorted(obj):
+            _hash_update(h, k)
+            _hash_update(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple, range)):
+        h.update(b"seq[")
+        for item in obj:
+            _hash_update(h, item)
+        h.update(b"]")
+    elif callable(obj) and "<" not in getattr(obj, "__qualname__", "<"):
+        # lambdas and closures can't be told apart by name
+        h.update(("fn:%s.%s;" % (obj.__module__, obj.__qualname__)).encode("utf-8"))
+    else:
+        raise TypeError("Can't hash parameter of type %s" % type(obj).__name__)
@@ -0,0 +1,135 @@
+"""
+Ridge regressions of the (scaled) match space of each unit onto that of the
+control units, as used for the synthetic control weights in
+:func:`SparseSC.fit_fast.fit_fast`.
+
+With ``S = M_c * sqrt(V)`` (one row per control unit), the weights of a unit
+``x`` are ``S u + 1/N0`` where ``u = (S'S + w_pen I)^-1 (x * sqrt(V) - mean(S))``
+(the dual of the ridge regression of the unit onto the controls).  The
+regressions for all the units share one eigendecomposition of the ``K x K``
+matrix ``S'S``, and those of the control units, which leave the unit itself
+out of the donor pool, follow from a rank-one (Sherman-Morrison) downdate.
+"""
+import numpy as np
+
+
+class SpectralRidge(object):
+    """
+    The eigendecomposition of the scaled control match space, from which the
+    ridge regressions for any unit and any ``w_pen`` can be computed cheaply.
+
+    :param M_c: Match space of the control units (N0 x K)
+    :type M_c: :class:`numpy.ndarray`
+
+    :param V: The (diagonal) match space weights
+    :type V: :class:`numpy.ndarray`
+    """
+
+    def __init__(self, M_c, V):
+        V = np.asarray(V, dtype=np.float64)
+        if V.ndim == 2:  # a diagonal matrix
+            V = np.diag(V)
+        self.sqrt_V = np.sqrt(V).reshape(-1)
+        #: Scaled match space of the controls, ``M_c * sqrt(V)``
+        self.S = np.asarray(M_c, dtype=np.float64) * self.sqrt_V
+        #: Number of control units
+        self.n = self.S.shape[0]
+        self.s_sum = self.S.sum(axis=0)
+        self.gram = self.S.T.dot(self.S)
+        lam, self.Q = np.linalg.eigh(self.gram)
+        #: Eigenvalues of ``S'S`` (clipped at zero)
+        self.lam = np.maximum(lam, 0)
+
+    def inverse(self, w_pen):
+        """
+        :returns: ``(S'S + w_pen I)^-1``
+        :rtype: :class:`numpy.ndarray`
+        """
+        return (self.Q / (self.lam + w_pen)).dot(self.Q.T)
+
+    def targets(self, M_x):
+        """
+        :returns: the targets of the regressions of the units in ``M_x`` on
+            all of the controls
+        """
+        return np.asarray(M_x, dtype=np.float64) * self.sqrt_V - self.s_sum / self.n
+
+    def loo_targets(self, c):
+        """
+        :returns: the targets of the regressions of control units ``c``
+            on the other controls
+        """
+        S_c = self.S[c, :]
+        return S_c - (self.s_sum - S_c) / (self.n - 1)
+
+    def coefs(self, M_x, H_inv):
+        """
+        Dual coefficients for units which may use all the controls as donors;
+        their weights are ``S u + 1/N0``.
+
+        :param M_x: Match space of the units (m x K)
+        :param H_inv: ``inverse(w_pen)``
+
+        :returns: m x K matrix of coefficients ``u``
+        """
+        return self.targets(M_x).dot(H_inv)
+
+    def loo_coefs(self, c, H_inv):
+        """
+        Dual coefficients for control units, leaving each of them out of its
+        own donor pool; their weights are ``S u + 1/(N0-1)`` except for the
+        unit itself, whose weight is zero.
+
+        :param c: Indexes (within the controls) of the control units
+        :type c: int[]
+        :param H_inv: ``inverse(w_pen)``
+
+        :returns: len(c) x K matrix of coefficients ``u``
+        """
+        S_c = self.S[c, :]
+        T = self.loo_targets(c)
+        P = S_c.dot(H_inv)
+        h = (P * S_c).sum(axis=1)
+        # (H - s s')^-1 t = H^-1 t + H^-1 s (s' H^-1 t) / (1 - s' H^-1 s)
+        return T.dot(H_inv) + P * ((P * T).sum(axis=1) / (1 - h))[:, None]
+
+    def cv_mse(self, M_x, w_pens):
+        """
+        Leave-one-out (over the features) mean squared error of the
+        regressions of the units in ``M_x`` on all of the controls, as
+        ``RidgeCV(fit_intercept=False, store_cv_values=True)`` would report.
+
+        :returns: len(M_x) x len(w_pens) matrix of MSEs
+        """
+        return _loo_mse(self.lam[None, :], self.Q[None, :, :], self.targets(M_x), w_pens)
+
+    def loo_cv_mse(self, c, w_pens):
+        """
+        As :meth:`cv_mse`, for control units ``c`` each regressed on the other
+        controls.  The Gram matrix of each is a rank-one downdate of the
+        shared one, and the (K x K) downdated matrices are decomposed together.
+
+        :returns: len(c) x len(w_pens) matrix of MSEs
+        """
+        S_c = self.S[c, :]
+        lam, Q = np.linalg.eigh(self.gram[None, :, :] - S_c[:, :, None] * S_c[:, None, :])
+        return _loo_mse(np.maximum(lam, 0), Q, self.loo_targets(c), w_pens)
+
+
+def _loo_mse(lam, Q, T, w_pens):
+    """
+    Closed-form leave-one-out MSE of ridge regressions with (stacks of)
+    eigendecompositions ``lam``, ``Q`` of their Gram matrices and targets
+    ``T`` (one row per regression), for each penalty in ``w_pens``.
+
+    The hat matrix is ``Q diag(lam/(lam+w)) Q'``, so the residuals are
+    ``Q diag(w/(lam+w)) Q' t`` and the leave-one-out errors are the
+    residuals divided by one less the diagonal of the hat matrix.
+    """
+    w_pens = np.asarray(w_pens, dtype=np.float64)[None, :, None]
+    lam = lam[:, None, :]
+    Q_t = np.swapaxes(Q, 1, 2)
+    z = np.matmul(T[:, None, :], Q)  # Q't, m x 1 x K
+    resid = np.matmul(z * (w_pens / (lam + w_pens)), Q_t)  # m x a x K
+    hat_diag = np.matmul(lam / (lam + w_pens), np.square(Q_t))  # m x a x K
+    return np.mean(np.square(resid / (1 - hat_diag)), axis=2)
@@ -9,6 +9,10 @@ import numpy as np
 
 def weights(X, X_treat=None, grad_splits=None, custom_donor_pool=None, **kwargs):
     """ Calculate synthetic control weights
+
+    :param custom_donor_pool: The donors allowed for each unit, with a column
+        per row of ``X`` and a row per row of ``X_treat`` (or of ``X`` when
+        ``X_treat`` is ``None``)
     """
 
     # PARAMETER QC
@@ -71,6 +71,298 @@ class TestEstimationForErrors(unittest.TestCase):
             for frame_type in ["ndarray", "NDFrame", "timeindex"]:
                 TestEstimationForErrors.run_test(self, model_type, frame_type)
 
+    def test_cross_fit_warm_start(self):
+        from SparseSC.estimate_effects import get_c_predictions_honest
+
+        X, Y = np.hstack((self.X, self.Y[:, :7])), self.Y[:, 7:]
+        full_fit = SC.fit_fast(X, Y, treated_units=self.treated_units)
+        needed = np.full(50, False)
+        needed[:3] = True
+        Y_sc, fits = get_c_predictions_honest(X[2:], Y[2:], self.Y[2:], cf_folds=5, warm_start=full_fit,
+                                              needed=needed, verbose=0)
+        self.assertEqual(len(fits), 5)
+        for fit_k, test in fits:
+            if needed[test].any():
+                self.assertIn(fit_k.fitted_w_pen, (None, full_fit.fitted_w_pen))
+                self.assertTrue(np.isfinite(Y_sc[test]).all())
+            else:
+                self.assertIsNone(fit_k)
+                self.assertTrue(np.isnan(Y_sc[test]).all())
+
+    def test_placebo_units(self):
+        # the cross-fit folds without placebo units aren't fit
+        placebo_units = np.full(self.Y.shape[0], False)
+        placebo_units[:12] = True
+        est = SC.estimate_effects(self.Y, self.unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                  pl_seed=3, cf_folds=10, placebo_units=placebo_units, ret_CI=True)
+        for treatment_period in (7, 8):
+            self.assertEqual(est._period_diffs[treatment_period]["pre_c"][0][0].shape[0], 10)
+            skipped = [weights is None for weights, _, _ in est.fits[treatment_period].cf_weights]
+            self.assertTrue(any(skipped))
+            self.assertFalse(all(skipped))
+        self.assertTrue(np.isfinite(est.pl_res_post.effect_vec.placebos).all())
+        self.assertTrue(0 < est.p_value <= 1)
+        self.assertTrue(np.isfinite(est.ind_CI[8].ci_low).all())
+
+    def test_parallel_periods(self):
+        Y = self.Y
+        serial = SC.estimate_effects(Y, self.unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                     pl_seed=3, ret_CI=True, cf_folds=2)
+        parallel = SC.estimate_effects(Y, self.unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                       pl_seed=3, ret_CI=True, cf_folds=2, n_multi_periods=2)
+        self.assertEqual(list(serial.fits), [7, 8])
+        self.assertEqual(list(parallel.fits), [7, 8])
+        np.testing.assert_allclose(parallel.pl_res_post.effect_vec.placebos, serial.pl_res_post.effect_vec.placebos)
+        self.assertEqual(parallel.pl_res_post.avg_joint_effect.p, serial.pl_res_post.avg_joint_effect.p)
+        np.testing.assert_allclose(parallel.ind_CI[8].ci_low, serial.ind_CI[8].ci_low)
+
+    def test_lazy_placebo_stats(self):
+        Y = pd.DataFrame(self.Y)
+        lazy = SC.estimate_effects(Y, self.unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                   pl_seed=3, cf_folds=2)
+        self.assertEqual(lazy._pl_res_cache, {})
+        self.assertIsNone(lazy.ind_CI)
+        self.assertIsNone(lazy.CI.ci)
+        self.assertIs(lazy.pl_res_post, lazy.pl_res_post)  # cached
+
+        eager = SC.estimate_effects(Y, self.unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                    pl_seed=3, cf_folds=2, ret_CI=True, level=0.9)
+        self.assertEqual(lazy.p_value, eager.p_value)
+        ci_90 = lazy.get_CI(0.9)
+        self.assertEqual(ci_90.ci.ci_low, eager.CI.ci.ci_low)
+        ci_50 = lazy.get_CI(0.5)
+        self.assertEqual(ci_50.ci.level, 0.5)
+        self.assertLessEqual(ci_90.ci.ci_low, ci_50.ci.ci_low)
+        ind_ci = lazy.get_ind_CI(0.9)
+        self.assertEqual(list(ind_ci), [7, 8])
+        self.assertEqual(len(ind_ci[8].ci_low), Y.shape[1])
+        pd.testing.assert_series_equal(ind_ci[8].ci_high, eager.ind_CI[8].ci_high)
+
+    def test_extend(self):
+        # extending the evaluation window reuses the fits, so matches estimating it up front
+        args = dict(covariates=self.X, max_n_pl=50, pl_seed=3, cf_folds=2, model_type="prospective", T0=4, T1=2,
+                    ret_pl=True)
+        full = SC.estimate_effects(self.Y, self.unit_treatment_periods, T2=7, **args)
+        extended = SC.estimate_effects(self.Y[:, :13], self.unit_treatment_periods, T2=5, **args)
+        p_before = extended.p_value
+        extended.extend(self.Y[:, 13:14])
+        extended.extend(self.Y[:, 14:])
+        self.assertEqual(extended.T_extended, 2)
+        self.assertEqual(extended.Y.shape, self.Y.shape)
+        for kind in ("pre", "post", "post_scaled", "post_fit"):
+            np.testing.assert_allclose(extended.get_pl_res(kind).effect_vec.effect, full.get_pl_res(kind).effect_vec.effect)
+            np.testing.assert_allclose(extended.get_pl_res(kind).effect_vec.placebos,
+                                       full.get_pl_res(kind).effect_vec.placebos)
+        self.assertEqual(extended.p_value, full.p_value)
+        self.assertNotEqual(extended.p_value, p_before)
+        self.assertEqual(len(extended.get_ind_CI()[8].ci_low), self.Y.shape[1])
+        with self.assertRaises(ValueError):
+            extended.extend(self.Y[:10, :1])
+        # only the test rows of the cross-fit weights are kept, not the fold fits
+        for weights, donors, test in extended.fits[8].cf_weights:
+            self.assertEqual(weights.shape, (len(test), len(donors)))
+
+    def test_extend_staggered(self):
+        # a control treated later can't stay a control once the window reaches it
+        unit_treatment_periods = self.unit_treatment_periods.copy()
+        unit_treatment_periods[2] = 14
+        est = SC.estimate_effects(self.Y[:, :12], unit_treatment_periods, covariates=self.X, max_n_pl=50,
+                                  pl_seed=3, cf_folds=2, T1=4)
+        self.assertEqual(list(est.fits), [7, 8])
+        est.extend(self.Y[:, 12:13])
+        p_value = est.p_value
+        with self.assertRaises(ValueError):
+            est.extend(self.Y[:, 13:14])
+        # nothing was changed
+        self.assertEqual(est.T_extended, 1)
+        self.assertEqual(est.Y.shape[1], 13)
+        self.assertEqual(est.p_value, p_value)
+
+def _row_sum(i, data, offset=0):
+    # a par_map() task over a (shared) array
+    return data[i].sum() + offset
+
+
+def _estimate_with_cores(n_cores):
+    # as if there were n_cores, e.g. in a Pool worker
+    import os
+    from unittest import mock
+    from SparseSC.utils.misc import default_n_multi
+
+    with mock.patch.object(os, "sched_getaffinity", lambda pid: set(range(n_cores)), create=True):
+        np.random.seed(101101001)
+        Y = np.random.rand(30, 10)
+        unit_treatment_periods = np.full(30, np.nan)
+        unit_treatment_periods[0] = 7
+        est = SC.estimate_effects(Y, unit_treatment_periods, cf_folds=2, max_n_pl=20, n_multi=None)
+        return default_n_multi(4), est.p_value
+
+
+class TestParMap(unittest.TestCase):
+    def test_default_n_multi_in_daemon(self):
+        from multiprocessing import Pool
+        from unittest import mock
+        import os
+        from SparseSC.utils.misc import default_n_multi
+
+        with mock.patch.object(os, "sched_getaffinity", lambda pid: set(range(4)), create=True):
+            self.assertEqual(default_n_multi(4), 4)
+        with Pool(1) as pool:  # daemonic workers can't start their own pools
+            n_multi, p_value = pool.map(_estimate_with_cores, [4])[0]
+        self.assertEqual(n_multi, 0)
+        self.assertTrue(0 < p_value <= 1)
+
+    def test_shared_arrays(self):
+        from functools import partial
+        from multiprocessing import Pool
+        from SparseSC.utils.misc import par_map, _split_shared_arrays
+
+        data = np.random.rand(100, 200)
+        part_fn = partial(_row_sum, data=data, offset=1)
+        light_fn, arrays = _split_shared_arrays(part_fn, 2 ** 16)
+        self.assertEqual(list(arrays), ["data"])
+        self.assertNotIn("data", light_fn.keywords)
+        expected = data.sum(axis=1) + 1
+        np.testing.assert_allclose(par_map(part_fn, range(100), 100, 0, n_multi=2, chunksize=7), expected)
+        with Pool(2) as pool:
+            for _ in range(2):  # the pool's workers attach each call's arrays
+                np.testing.assert_allclose(par_map(part_fn, range(100), 100, 0, pool=pool), expected)
+            data2 = data * 2
+            np.testing.assert_allclose(par_map(partial(_row_sum, data=data2), range(100), 100, 0, pool=pool),
+                                       data2.sum(axis=1))
+
+
+class TestPlaceboStats(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.control_effects = np.random.randn(12, 4)
+        self.effects = np.random.randn(3, 4) + 0.5
+
+    def test_exhaustive(self):
+        import itertools
+        from SparseSC.utils.metrics_utils import _gen_placebo_stats_from_diffs
+
+        res = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 0, True, False, chunk_size=7)
+        combs = list(itertools.combinations(range(12), 3))
+        placebos = np.array([self.control_effects[list(c), :].mean(axis=0) for c in combs])
+        self.assertEqual(res.N_placebo, len(combs))
+        np.testing.assert_allclose(res.effect_vec.placebos, placebos)
+        at_least = (np.abs(placebos) >= np.abs(self.effects.mean(axis=0))).sum(axis=0)
+        np.testing.assert_allclose(res.effect_vec.p, (at_least + 1) / (len(combs) + 1))
+        rms = np.sqrt(np.mean(np.square(self.control_effects), axis=1))
+        rms_pl = np.array([rms[list(c)].mean() for c in combs])
+        np.testing.assert_allclose(res.rms_joint_effect.placebos, rms_pl)
+
+    def test_random(self):
+        from SparseSC.utils.metrics_utils import _random_combination_chunks, _gen_placebo_stats_from_diffs
+
+        for n, c in ((100, 3), (12, 8)):
+            chunks = list(_random_combination_chunks(50, n, c, 16))
+            self.assertEqual([len(chunk) for chunk in chunks], [16, 16, 16, 2])
+            combs = np.vstack(chunks)
+            self.assertTrue(((combs >= 0) & (combs < n)).all())
+            self.assertTrue(all(len(set(row)) == c for row in combs))
+        res = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 100, False, True)
+        self.assertEqual(res.N_placebo, 100)
+        self.assertTrue(0 < res.avg_joint_effect.p <= 1)
+
+    def test_seed(self):
+        from SparseSC.utils.metrics_utils import (
+            _random_combination_chunks, _gen_placebo_stats_from_diffs, _spawn_placebo_seeds)
+
+        res1 = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 100, True, seed=5)
+        res2 = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 100, True, seed=5)
+        np.testing.assert_array_equal(res1.effect_vec.placebos, res2.effect_vec.placebos)
+        streams = [np.vstack(list(_random_combination_chunks(50, 100, 3, 16, seed))) for seed in _spawn_placebo_seeds(5, 2)]
+        self.assertFalse((streams[0] == streams[1]).all())
+        # unique, including when most of the combinations are needed
+        for n, c, num in ((100, 3, 1000), (12, 3, 200), (12, 8, 400)):
+            combs = np.vstack(list(_random_combination_chunks(num, n, c, 64, 1, unique=True)))
+            self.assertEqual(len(set(tuple(sorted(row)) for row in combs)), num)
+        # the uniform keys of large draws are made a bounded number of rows at a time
+        from unittest import mock
+        from SparseSC.utils import metrics_utils
+
+        combs = metrics_utils._draw_combinations(np.random.default_rng(2), 50, 12, 8)
+        with mock.patch.object(metrics_utils, "_PLACEBO_CHUNK_ELEMENTS", 100):
+            np.testing.assert_array_equal(metrics_utils._draw_combinations(np.random.default_rng(2), 50, 12, 8), combs)
+
+    def test_repeated_blocks(self):
+        from SparseSC.utils.metrics_utils import _gen_placebo_stats_from_diffs
+
+        blocks = [(self.control_effects[:5], 2), (self.control_effects[5:], 1)]
+        stacked = np.vstack([self.control_effects[:5], self.control_effects[:5], self.control_effects[5:]])
+        for max_n_pl in (0, 50):
+            res = _gen_placebo_stats_from_diffs(blocks, self.effects, max_n_pl, True, True, seed=1)
+            res_stacked = _gen_placebo_stats_from_diffs(stacked, self.effects, max_n_pl, True, True, seed=1)
+            self.assertEqual(res.N_placebo, res_stacked.N_placebo)
+            np.testing.assert_array_equal(res.effect_vec.placebos, res_stacked.effect_vec.placebos)
+            np.testing.assert_array_equal(res.effect_vec.p, res_stacked.effect_vec.p)
+            self.assertEqual(res.rms_joint_effect.p, res_stacked.rms_joint_effect.p)
+
+    def test_exact(self):
+        from SparseSC.utils.metrics_utils import _gen_placebo_stats_from_diffs
+
+        # values on a grid are counted exactly
+        control_effects = np.round(self.control_effects * 4) / 4
+        effects = np.round(self.effects * 4) / 4
+        for N1 in (1, 2, 3):
+            full = _gen_placebo_stats_from_diffs(control_effects, effects[:N1], 0)
+            exact = _gen_placebo_stats_from_diffs(control_effects, effects[:N1], 10, exact=True)
+            np.testing.assert_allclose(exact.effect_vec.p, full.effect_vec.p)
+            self.assertAlmostEqual(exact.avg_joint_effect.p, full.avg_joint_effect.p)
+            self.assertAlmostEqual(exact.rms_joint_effect.p, full.rms_joint_effect.p)
+        # otherwise conservative, within the tolerance
+        full = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 0)
+        exact = _gen_placebo_stats_from_diffs(self.control_effects, self.effects, 10, True, exact=True)
+        self.assertEqual(exact.N_placebo, 10)
+        self.assertEqual(exact.effect_vec.placebos.shape, (10, 4))
+        for full_p, exact_p in ((full.effect_vec.p, exact.effect_vec.p),
+                                (full.avg_joint_effect.p, exact.avg_joint_effect.p),
+                                (full.rms_joint_effect.p, exact.rms_joint_effect.p)):
+            self.assertTrue(np.all(exact_p >= full_p - 1e-12))
+            np.testing.assert_allclose(exact_p, full_p, atol=0.01)
+        # repeated values are grouped rather than expanded
+        from SparseSC.utils.metrics_utils import _exact_subset_mean_p, _ncr
+
+        counts = np.array([3, 1, 2] * 4)
+        x = control_effects[:, 0]
+        for k in (2, 3, 5):
+            n_pl = _ncr(counts.sum(), k)
+            self.assertAlmostEqual(_exact_subset_mean_p(np.repeat(x, counts), k, 0.3, n_pl),
+                                   _exact_subset_mean_p(x, k, 0.3, n_pl, counts=counts))
+            # the grid (rather than enumerating) is conservative, within the tolerance
+            enumerated = _exact_subset_mean_p(self.control_effects[:, 0], k, 0.3, _ncr(12, k))
+            grid = _exact_subset_mean_p(self.control_effects[:, 0], k, 0.3, _ncr(12, k), max_enum=0)
+            self.assertGreaterEqual(grid, enumerated - 1e-12)
+            self.assertLessEqual(grid, enumerated + 0.01)
+        # too costly a grid falls back to the placebos
+        self.assertIsNone(_exact_subset_mean_p(x, 5, 0.3, _ncr(12, 5), max_enum=0, max_work=5 ** 3 * 32))
+        many = np.random.randn(200, 2)
+        sampled = _gen_placebo_stats_from_diffs(many, many[:90], 50, seed=1)
+        fallback = _gen_placebo_stats_from_diffs(many, many[:90], 50, exact=True, seed=1)
+        np.testing.assert_array_equal(fallback.effect_vec.p, sampled.effect_vec.p)
+
+    def test_CI(self):
+        from SparseSC.utils.metrics_utils import _placebo_CI
+
+        placebos = np.random.randn(101, 7)
+        effect = np.random.randn(7)
+        alpha_ind = 2
+        sorted_abs = np.sort(np.abs(placebos), axis=0)
+        sorted_pl = np.sort(placebos, axis=0)
+        for chunk_elements in (None, 250):  # 2 columns at a time
+            low, high = _placebo_CI(placebos, alpha_ind, effect, chunk_elements=chunk_elements)
+            np.testing.assert_array_equal(low, effect - sorted_abs[100 - 2 * alpha_ind])
+            np.testing.assert_array_equal(high, effect + sorted_abs[100 - 2 * alpha_ind])
+            low, high = _placebo_CI(placebos, alpha_ind, effect, null_is_zero=False, sym_CI=False,
+                                    chunk_elements=chunk_elements)
+            np.testing.assert_array_equal(low, effect - sorted_pl[100 - alpha_ind])
+            np.testing.assert_array_equal(high, effect - sorted_pl[alpha_ind])
+        low, high = _placebo_CI(placebos[:, 0], alpha_ind, effect[0])
+        self.assertEqual(high, effect[0] + sorted_abs[100 - 2 * alpha_ind, 0])
+
+
 class TestDGPs(unittest.TestCase):
     """
     testing fixture
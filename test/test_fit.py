@@ -165,6 +165,676 @@ class TestFitFastForErrors(unittest.TestCase):
         TestFitFastForErrors.run_test(self, model_type, avoid_NxN_mats=True) #default is avoid_NxN_mats=False
         TestFitFastForErrors.run_test(self, model_type, avoid_NxN_mats=True, sc_Y_block_size=2) #default is avoid_NxN_mats=False
 
+class TestFitFastWeights(unittest.TestCase):
+    def test_batched_weights(self):
+        from SparseSC.fit_fast import _sc_weights_trad, _weights
+        from SparseSC.utils.donor_pool import as_donor_pool
+
+        np.random.seed(101101001)
+        N, N0, K, w_pen = 30, 20, 4, 0.3
+        control_units = list(range(5, 25))
+        M = np.random.randn(N, K)
+        V = np.random.rand(K)
+        custom_donor_pool = np.random.rand(N, N0) > 0.1
+        custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units).toarray()
+
+        expected = np.zeros((N, N0))
+        for i in range(N):
+            allowed = custom_donor_pool[i, :]
+            expected[i, allowed] = _weights(V, M[i, :], M[control_units, :][allowed, :], w_pen)
+
+        for _control_units in (None, control_units):
+            sc_weights = _sc_weights_trad(
+                M, M[control_units, :], V, N, N0, custom_donor_pool, w_pen,
+                control_units=_control_units, block_size=7,
+            )
+            np.testing.assert_allclose(sc_weights, expected, atol=1e-10)
+
+    def test_ridge_solution(self):
+        from sklearn.linear_model import Ridge
+        from SparseSC.fit_fast import _RidgeSolution
+        from SparseSC.utils.donor_pool import as_donor_pool
+
+        np.random.seed(101101001)
+        N, N0, K, w_pen = 30, 20, 4, 0.3
+        control_units = list(range(5, 25))
+        M = np.random.randn(N, K)
+        V = np.random.rand(K)
+        Y_c = np.random.randn(N0, 3)
+        custom_donor_pool = as_donor_pool(None, N, N0).exclude_self(control_units).toarray()
+        custom_donor_pool[0, :3] = False
+
+        expected = np.zeros((N, N0))
+        for i in range(N):
+            allowed = custom_donor_pool[i, :]
+            M_a = M[control_units, :][allowed, :]
+            ridge = Ridge(alpha=w_pen, fit_intercept=False).fit(
+                (M_a * np.sqrt(V)).T, (M[i, :] - M_a.mean(axis=0)) * np.sqrt(V)
+            )
+            expected[i, allowed] = ridge.coef_ + 1 / allowed.sum()
+
+        sc_weights, Y_sc = _RidgeSolution(
+            M, control_units, V, w_pen, custom_donor_pool, Y_c=Y_c, block_size=7
+        )
+        np.testing.assert_allclose(sc_weights, expected, atol=1e-10)
+        np.testing.assert_allclose(Y_sc, expected.dot(Y_c), atol=1e-10)
+        (Y_sc_only,) = _RidgeSolution(
+            M, control_units, V, w_pen, custom_donor_pool, Y_c=Y_c, ret_weights=False
+        )
+        np.testing.assert_allclose(Y_sc_only, Y_sc, atol=1e-10)
+
+    def test_w_pen_path(self):
+        from SparseSC.fit_fast import _sc_weights_trad, _w_pen_path
+        from SparseSC.utils.donor_pool import as_donor_pool
+
+        np.random.seed(101101001)
+        N, N0, K = 30, 20, 4
+        control_units = list(range(5, 25))
+        M = np.random.randn(N, K)
+        V = np.random.rand(K)
+        Y = np.random.randn(N, 3)
+        w_pens = np.logspace(-2, 2, 5)
+        custom_donor_pool = np.random.rand(N, N0) > 0.1
+        custom_donor_pool = as_donor_pool(custom_donor_pool, N, N0).exclude_self(control_units).toarray()
+
+        scores = _w_pen_path(M, Y, control_units, range(N), V, w_pens, custom_donor_pool)
+        expected = [
+            np.sum(np.square(Y - _sc_weights_trad(
+                M, M[control_units, :], V, N, N0, custom_donor_pool, w_pen, control_units=control_units
+            ).dot(Y[control_units, :])))
+            for w_pen in w_pens
+        ]
+        np.testing.assert_allclose(scores, expected, rtol=1e-8)
+
+        # the targets are read in blocks, so a memmap is not copied up front
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp:
+            Y_disk = np.memmap(os.path.join(tmp, "Y.dat"), dtype=Y.dtype, mode="w+", shape=Y.shape)
+            Y_disk[:] = Y
+            np.testing.assert_allclose(
+                _w_pen_path(M, Y_disk, control_units, range(N), V, w_pens, custom_donor_pool), scores
+            )
+            del Y_disk
+
+        # the candidates share one decomposition
+        import sys
+        from unittest import mock
+
+        fit_fast_module = sys.modules["SparseSC.fit_fast"]  # SparseSC.fit_fast is the function
+        with mock.patch.object(fit_fast_module, "SpectralRidge", wraps=fit_fast_module.SpectralRidge) as ridge:
+            _w_pen_path(M, Y, control_units, range(N), V, w_pens, custom_donor_pool)
+        self.assertEqual(ridge.call_count, 1)
+
+    def test_ridge_cv_solution(self):
+        from sklearn.linear_model import RidgeCV
+        from SparseSC.utils.penalty_utils import RidgeCVSolution
+
+        np.random.seed(101101001)
+        N, K = 30, 4
+        control_units, treated_units = list(range(5, 30)), list(range(5))
+        M = np.random.randn(N, K)
+        V = np.random.rand(K)
+        w_pens = np.logspace(-3, 3, 7)
+        w_pen, mse = RidgeCVSolution(
+            M, control_units, True, treated_units, V, w_pens, ret_mse=True, block_size=7
+        )
+        self.assertEqual(mse.shape, (30, 7))
+        self.assertEqual(w_pen, w_pens[mse.mean(axis=0).argmin()])
+
+        M_c = M[control_units, :]
+        goals = [  # a control unit, then a treated unit
+            (np.delete(M_c, 2, axis=0), M_c[2, :], mse[2, :]),
+            (M_c, M[1, :], mse[len(control_units) + 1, :]),
+        ]
+        for M_a, goal, goal_mse in goals:
+            ridgecv = RidgeCV(alphas=w_pens, fit_intercept=False, store_cv_values=True).fit(
+                (M_a * np.sqrt(V)).T, (goal - M_a.mean(axis=0)) * np.sqrt(V)
+            )
+            np.testing.assert_allclose(goal_mse, ridgecv.cv_values_.mean(axis=0), rtol=1e-6)
+
+    def test_sc_Y_block_downdate(self):
+        from SparseSC.fit_fast import _sc_Y_trad, _weights
+
+        np.random.seed(101101001)
+        N1, N0, K, B = 4, 53, 3, 5
+        M = np.random.randn(N1 + N0, K)
+        V = np.random.rand(K)
+        Y = np.random.randn(N1 + N0, 2)
+        treated_units, control_units = list(range(N1)), list(range(N1, N1 + N0))
+        M_c, Y_c = M[control_units, :], Y[control_units, :]
+        Y_sc = _sc_Y_trad(M, M_c, treated_units, control_units, V, None, 0.1, Y_c, sc_Y_block_size=B)
+
+        expected = np.empty(Y.shape)
+        expected[treated_units, :] = _weights(V, M[treated_units, :], M_c, 0.1).T.dot(Y_c)
+        for i in range(0, N0, B):
+            keep = np.r_[0:i, i + B:N0]
+            block = control_units[i:i + B]
+            expected[block, :] = _weights(V, M[block, :], M_c[keep, :], 0.1).T.dot(Y_c[keep, :])
+        np.testing.assert_allclose(Y_sc, expected, rtol=1e-8, atol=1e-10)
+
+    def test_out_of_core(self):
+        import os
+        import shutil
+        import tempfile
+
+        np.random.seed(101101001)
+        N, T = 60, 5
+        X = np.random.randn(N, 4)
+        Y = X.dot(np.ones((4, T))) + 0.1 * np.random.randn(N, T)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        np.save(os.path.join(directory, "X.npy"), X)
+        np.save(os.path.join(directory, "Y.npy"), Y)
+        out = os.path.join(directory, "Y_sc.npy")
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            np.random.seed(1)
+            fit_mem = fit_fast(X, Y, treated_units=list(range(5)), avoid_NxN_mats=True)
+            np.random.seed(1)
+            fit_disk = fit_fast(
+                os.path.join(directory, "X.npy"),
+                os.path.join(directory, "Y.npy"),
+                treated_units=list(range(5)),
+                targets_sc_out=out,
+                block_size=7,
+            )
+        self.assertIsInstance(fit_disk.targets, np.memmap)
+        self.assertIsNone(fit_disk.sc_weights)
+        np.testing.assert_allclose(np.load(out), fit_mem.predict(), atol=1e-12)
+        self.assertAlmostEqual(fit_disk.score, fit_mem.score)
+        self.assertAlmostEqual(fit_disk.score_R2, fit_mem.score_R2)
+
+        # the match space sample is drawn from random_state, not the global seed
+        fits = []
+        for seed in (1, 2):
+            np.random.seed(seed)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                fits.append(
+                    fit_fast(X, Y, treated_units=list(range(5)), match_sample_frac=0.5, random_state=7)
+                )
+        np.testing.assert_array_equal(fits[0].V, fits[1].V)
+        np.testing.assert_array_equal(fits[0].predict(), fits[1].predict())
+
+
+class TestDonorPool(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.N, self.N0 = 30, 25
+        self.control_units = list(range(5, 30))
+        self.region = np.random.randint(0, 3, self.N)
+        self.mask = self.region[:, None] == self.region[self.control_units][None, :]
+
+    def test_representations(self):
+        import scipy.sparse
+        from SparseSC.utils.donor_pool import DonorPool, as_donor_pool
+
+        expected = self.mask.copy()
+        expected[self.control_units, np.arange(self.N0)] = False  # not their own donors
+        pools = [
+            self.mask,
+            scipy.sparse.csr_matrix(self.mask),
+            [np.flatnonzero(row) for row in self.mask],
+            DonorPool.from_groups(self.region, self.region[self.control_units]),
+        ]
+        for pool in pools:
+            pool = as_donor_pool(pool, self.N, self.N0).exclude_self(self.control_units)
+            np.testing.assert_array_equal(pool.toarray(), expected)
+            np.testing.assert_array_equal(pool.sizes(), expected.sum(axis=1))
+            self.assertEqual(sum(len(units) for _, units, _ in pool.groups()), self.N)
+            self.assertLessEqual(len(pool.groups()), 3)
+        self.assertTrue(as_donor_pool(None, self.N, self.N0).is_full().all())
+        with self.assertRaises(ValueError):
+            as_donor_pool(self.mask, self.N + 1, self.N0)
+
+    def test_fit_fast(self):
+        from SparseSC.utils.donor_pool import DonorPool
+
+        X = np.random.randn(self.N, 3)
+        Y = X.dot(np.ones((3, 4))) + 0.1 * np.random.randn(self.N, 4)
+        pool = DonorPool.from_groups(self.region, self.region[self.control_units])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_mask = fit_fast(X, Y, treated_units=list(range(5)), custom_donor_pool=self.mask)
+            fit_pool = fit_fast(X, Y, treated_units=list(range(5)), custom_donor_pool=pool)
+        np.testing.assert_allclose(fit_pool.sc_weights, fit_mask.sc_weights)
+        self.assertTrue((fit_pool.sc_weights[~self.mask] == 0).all())
+
+    def test_ct_weights(self):
+        from SparseSC.fit_ct import ct_weights
+        from SparseSC.weights import weights
+
+        # as many treated as control units: the pool has a row per treated unit
+        X = np.random.randn(10, 3)
+        V = np.diag([1.0, 2.0, 0.5])
+        treated_units, control_units = np.arange(5, 10), np.arange(5)
+        pool = np.random.rand(5, 5) < 0.6
+        pool[:, 0] = True
+        weights_ct = ct_weights(X, V, 0.1, treated_units, control_units, custom_donor_pool=pool)
+        for i, treated_unit in enumerate(treated_units):
+            alone = ct_weights(
+                X[np.r_[control_units[pool[i]], treated_unit], :], V, 0.1, treated_units=[pool[i].sum()]
+            )
+            np.testing.assert_allclose(weights_ct[i, pool[i]], alone.flatten())
+        self.assertTrue((weights_ct[~pool] == 0).all())
+        np.testing.assert_allclose(
+            weights(X[control_units], X[treated_units], V=V, w_pen=0.1, custom_donor_pool=pool), weights_ct
+        )
+
+    def test_nearest(self):
+        from SparseSC.utils.donor_pool import nearest_donor_pool
+
+        M = np.random.randn(self.N, 3)
+        V = np.array([1.0, 2.0, 0.5])
+        pool = nearest_donor_pool(M, self.control_units, 4, V=V, custom_donor_pool=self.mask)
+        np.testing.assert_array_equal(pool.sizes(), np.minimum(4, self.mask.sum(axis=1) - (np.arange(self.N) >= 5)))
+        S = M * np.sqrt(V)
+        for i in range(self.N):
+            donors = pool.donors(i)
+            self.assertTrue(self.mask[i, donors].all())
+            candidates = np.flatnonzero(self.mask[i])
+            candidates = candidates[np.asarray(self.control_units)[candidates] != i]
+            dist = np.square(S[self.control_units][candidates] - S[i]).sum(axis=1)
+            np.testing.assert_array_equal(np.sort(donors), np.sort(candidates[np.argsort(dist)[:4]]))
+
+        X = np.random.randn(self.N, 3)
+        Y = X.dot(np.ones((3, 4))) + 0.1 * np.random.randn(self.N, 4)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_full = fit_fast(X, Y, treated_units=list(range(5)))
+            fit_all = fit_fast(X, Y, treated_units=list(range(5)), donor_knn=self.N0)
+            fit_knn = fit_fast(X, Y, treated_units=list(range(5)), donor_knn=4)
+        np.testing.assert_allclose(fit_all.sc_weights, fit_full.sc_weights)
+        self.assertEqual(fit_all.donor_boundary_mass.max(), 0)
+        self.assertEqual((fit_knn.sc_weights != 0).sum(axis=1).max(), 4)
+        self.assertTrue((fit_knn.donor_boundary_mass > 0).all())
+
+
+class TestCompressedWeights(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.N, self.N0 = 30, 25
+        self.X = np.random.randn(self.N, 3)
+        self.Y = self.X.dot(np.ones((3, 4))) + 0.1 * np.random.randn(self.N, 4)
+        self.Y[-1, :] = 0  # a trivial donor
+        self.X[-1, :] = 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.fit = fit_fast(self.X, self.Y, treated_units=list(range(5)))
+
+    def test_lossless(self):
+        import copy
+        import scipy.sparse
+
+        compressed = copy.deepcopy(self.fit).compress()
+        self.assertTrue(scipy.sparse.isspmatrix_csr(compressed.sc_weights))
+        np.testing.assert_allclose(compressed.sc_weights.toarray(), self.fit.sc_weights)
+        for include_trivial_donors in (True, False):
+            np.testing.assert_allclose(
+                compressed.predict(include_trivial_donors=include_trivial_donors),
+                self.fit.predict(include_trivial_donors=include_trivial_donors),
+            )
+            np.testing.assert_allclose(
+                compressed.get_weights(include_trivial_donors).toarray(),
+                self.fit.get_weights(include_trivial_donors),
+            )
+        self.assertEqual(compressed.compression_error["max_dropped_weight"], 0)
+
+    def test_predict_without_trivial_donors(self):
+        self.assertTrue(self.fit.trivial_units.any())
+        expected = self.fit.get_weights(False).dot(self.Y[self.fit.control_units])
+        np.testing.assert_allclose(self.fit.predict(include_trivial_donors=False), expected)
+
+    def test_top_k(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit = fit_fast(
+                self.X, self.Y, treated_units=list(range(5)), compress_weights={"top_k": 5}
+            )
+        weights = fit.sc_weights
+        self.assertLessEqual(np.diff(weights.indptr).max(), 5)
+        np.testing.assert_allclose(
+            np.asarray(weights.sum(axis=1)).ravel(), self.fit.sc_weights.sum(axis=1)
+        )
+        self.assertEqual(
+            set(fit.compression_error),
+            {"max_dropped_weight", "mean_dropped_weight", "predictions_rmse"},
+        )
+        self.assertGreater(fit.compression_error["max_dropped_weight"], 0)
+        self.assertEqual(fit.predict().shape, self.Y.shape)
+
+
+class TestMatchSpaceMemo(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        N, K, T = 100, 20, 3
+        self.X = np.random.randn(N, K)
+        coefs = np.zeros((K, T))
+        coefs[:4, :] = np.random.randn(4, T)
+        self.Y = self.X.dot(coefs) + np.random.randn(N, T)
+
+    def test_memo(self):
+        import pickle
+        from SparseSC.utils.match_space import MatchSpaceMemo
+
+        memo = MatchSpaceMemo()
+        factory = SparseSC.MTLassoCV_MatchSpace_factory(memo=memo)
+        pickle.dumps(factory)
+        first = factory(self.X, self.Y)
+        second = factory(self.X, self.Y)
+        self.assertIs(first, second)
+        self.assertEqual((memo.hits, memo.misses), (1, 1))
+        factory(self.X[1:], self.Y[1:])
+        self.assertEqual(memo.misses, 2)
+
+    def test_warm_start(self):
+        from SparseSC.utils.match_space import MatchSpaceMemo
+
+        memo = MatchSpaceMemo(max_entries=0)
+        factory = SparseSC.MTLassoCV_MatchSpace_factory(memo=memo, warm_start=True, refine_width=3)
+        _, _, full_v_pen, _ = factory(self.X, self.Y)
+        alphas = memo.path[0]
+        _, V, v_pen, (_, lasso) = factory(self.X[10:], self.Y[10:])
+        self.assertIs(memo.path[0], alphas)  # refined, not refit on the full grid
+        self.assertLessEqual(len(lasso.alphas_), 7)
+        self.assertIn(v_pen, alphas)
+        self.assertTrue(len(V) > 0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_obj = fit_fast(self.X, self.Y, match_space_memo=memo)
+        self.assertEqual(fit_obj.fitted_v_pen, full_v_pen)
+
+
+    def test_warm_start_splitter(self):
+        from sklearn.model_selection import KFold
+        from SparseSC.utils.match_space import MatchSpaceMemo
+
+        memo = MatchSpaceMemo(max_entries=0)
+        factory = SparseSC.MTLassoCV_MatchSpace_factory(
+            n_v_cv=KFold(4, shuffle=True, random_state=1), memo=memo, warm_start=True, refine_width=3
+        )
+        factory(self.X, self.Y)
+        alphas = memo.path[0]
+        _, _, _, (_, lasso) = factory(self.X[10:], self.Y[10:])
+        self.assertIs(memo.path[0], alphas)
+        self.assertEqual(lasso.mse_path_.shape, (len(lasso.alphas_), 4))
+
+class TestGradientPlan(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.X = np.random.rand(40, 4)
+        self.Y = np.random.rand(40, 3)
+
+    def test_plan(self):
+        from SparseSC.utils.planner import plan_gradient, estimate_gradient_cost
+
+        loo_mem, _ = estimate_gradient_cost("loo", 1000, 0, 10)
+        fold_mem, _ = estimate_gradient_cost("fold", 1000, 0, 10, grad_splits=5)
+        self.assertGreater(loo_mem, fold_mem)
+
+        plan = plan_gradient(1000, 10, memory_budget=np.inf)
+        self.assertEqual(plan.strategy, "loo")
+        self.assertFalse(plan.changed)
+
+        plan = plan_gradient(1000, 10, memory_budget=(loo_mem + fold_mem) / 2)
+        self.assertEqual(plan.strategy, "fold")
+        self.assertTrue(plan.changed)
+        self.assertLessEqual(plan.memory, plan.memory_budget)
+
+        with self.assertRaises(RuntimeError):
+            plan_gradient(1000, 10, memory_budget=1)
+        with self.assertRaises(RuntimeError):
+            plan_gradient(1000, 10, N1=10, treated_holdout=True, memory_budget=1)
+
+    def test_available_memory(self):
+        from unittest import mock
+        from SparseSC.utils.planner import _available_memory, plan_gradient
+
+        meminfo = "MemTotal:        8000000 kB\nMemFree:          100000 kB\nMemAvailable:    5000000 kB\n"
+        with mock.patch("builtins.open", mock.mock_open(read_data=meminfo)):
+            self.assertEqual(_available_memory(), 5000000 * 1024.0)
+        # no budget when it can't be determined
+        with mock.patch("builtins.open", side_effect=OSError):
+            self.assertIsNone(_available_memory())
+            plan = plan_gradient(10 ** 6, 10)
+        self.assertEqual(plan.strategy, "loo")
+
+    def test_fit_records_plan(self):
+        budget = SparseSC.utils.planner.estimate_gradient_cost("fold", 40, 0, 4, 5)[0]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_res = fit(
+                self.X, self.Y, model_type="full", gradient_folds=None,
+                memory_budget=budget, stopping_rule=1, cv_folds=3,
+                progress=False, verbose=0, print_path=False,
+            )
+        self.assertEqual(fit_res.gradient_plan.requested, "loo")
+        self.assertEqual(fit_res.gradient_plan.strategy, "fold")
+
+    def test_fit_warns_once(self):
+        from SparseSC.fit import SparseSCParameterWarning
+
+        budget = SparseSC.utils.planner.estimate_gradient_cost("fold", 40, 0, 4, 5)[0]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            fit(
+                self.X, self.Y, model_type="full", gradient_folds=None,
+                memory_budget=budget, stopping_rule=2, cv_folds=3,
+                progress=False, verbose=0, print_path=False,
+            )
+        plan_warnings = [w for w in caught if issubclass(w.category, SparseSCParameterWarning)]
+        self.assertEqual(len(plan_warnings), 1)
+        self.assertIn(" KB", str(plan_warnings[0].message))
+        self.assertNotIn("bytes", str(plan_warnings[0].message))
+
+
+class TestScoreCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        np.random.seed(101101001)
+        self.X = np.asmatrix(np.random.rand(30, 4))
+        self.Y = np.asmatrix(np.random.rand(30, 3))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def score(self, cache, v_pen=0.01):
+        from SparseSC.cross_validation import score_train_test
+
+        return score_train_test(
+            self.X, self.Y, train=np.arange(20), test=np.arange(20, 30),
+            grad_splits=4, v_pen=v_pen, w_pen=0.1, result_cache=cache,
+            print_path=False, verbose=0,
+        )
+
+    def test_hits_and_eviction(self):
+        cache = SparseSC.ScoreCache(self.dir)
+        v_mat, w_pen, score = self.score(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        v_mat2, w_pen2, score2 = self.score(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        np.testing.assert_array_equal(v_mat, v_mat2)
+        self.assertEqual(w_pen, w_pen2)
+        self.assertEqual(score, score2)
+
+        # a new library version misses
+        salted = SparseSC.ScoreCache(self.dir, salt="other")
+        self.score(salted)
+        self.assertEqual((salted.hits, salted.misses), (0, 1))
+
+        # a size cap of one entry evicts the least recently used
+        small = SparseSC.ScoreCache(self.dir, max_bytes=cache.stats()["bytes"] * 3 // 4)
+        self.score(small, v_pen=0.02)
+        self.assertEqual(small.stats()["entries"], 1)
+        self.assertGreater(small.evictions, 0)
+
+    def test_keyed_on_gradient_plan(self):
+        from SparseSC.cross_validation import score_train_test
+        from SparseSC.utils.planner import estimate_gradient_cost, plan_gradient
+
+        budget = estimate_gradient_cost("loo", 20, 0, 4)[0] - 1
+        self.assertEqual(plan_gradient(20, 4, memory_budget=budget).strategy, "fold")
+        cache = SparseSC.ScoreCache(self.dir)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for memory_budget in (np.inf, budget, 0.9 * budget, 2 * budget + 2):
+                score_train_test(
+                    self.X, self.Y, train=np.arange(20), test=np.arange(20, 30), v_pen=0.01, w_pen=0.1,
+                    memory_budget=memory_budget, result_cache=cache, print_path=False, verbose=0,
+                )
+        # the leave-one-out and fold gradients aren't mixed up, whatever the budget
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_parallel_stats(self):
+        import os
+        from SparseSC.cross_validation import CV_score
+
+        counts = {}
+        for parallel in (False, True):
+            cache = SparseSC.ScoreCache(os.path.join(self.dir, str(parallel)))
+            for _ in range(2):
+                CV_score(
+                    self.X, self.Y, v_pen=[0.01, 0.1], w_pen=0.1, splits=3, grad_splits=3, parallel=parallel,
+                    max_workers=2, result_cache=cache, quiet=True, progress=False, print_path=False,
+                )
+            counts[parallel] = cache.counts()
+        # the workers' hits and misses are counted too
+        self.assertEqual(counts[True][:2], (6, 6))
+        self.assertEqual(counts[True], counts[False])
+        # a w_pen read back from the cache has the same key as a float
+        self.assertEqual(cache.key(w_pen=0.1), cache.key(w_pen=np.float64(0.1)))
+        self.assertNotEqual(cache.key(w_pen=1), cache.key(w_pen=1.0))
+
+
+class TestAdaptiveSearch(unittest.TestCase):
+    def test_search(self):
+        from SparseSC.fit import _adaptive_search
+
+        grid = np.exp(np.linspace(np.log(1e-6), 0, 20))
+        evaluated = []
+
+        def score(pen):
+            evaluated.append(pen)
+            return (np.log(pen) - np.log(1e-3)) ** 2, 0.1
+
+        pens, scores, scores_se = _adaptive_search(score, grid, "min")
+        self.assertLessEqual(len(evaluated), 10)
+        self.assertEqual(len(pens), len(evaluated))
+        self.assertEqual(len(scores), len(scores_se))
+        self.assertTrue((np.diff(pens) > 0).all())
+        best = pens[np.argmin(scores)]
+        self.assertLess(abs(np.log(best) - np.log(1e-3)), np.log(grid[1] / grid[0]))
+
+    def test_fit(self):
+        np.random.seed(101101001)
+        X = np.random.rand(40, 4)
+        Y = np.random.rand(40, 3)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_res = fit(
+                X, Y, model_type="full", search="adaptive", stopping_rule=1,
+                cv_folds=3, gradient_folds=3, progress=False, verbose=0, print_path=False,
+            )
+        self.assertEqual(len(fit_res.scores), len(fit_res.initial_v_pen))
+        self.assertLess(len(fit_res.scores), 20)
+        self.assertIn(fit_res.fitted_v_pen, fit_res.initial_v_pen)
+
+
+class TestJointSearch(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.X = np.random.rand(40, 4)
+        self.Y = self.X[:, :2].dot(np.ones((2, 3))) + 0.1 * np.random.rand(40, 3)
+
+    def test_cv_score_grid(self):
+        from SparseSC.cross_validation import CV_score
+
+        v_pen, w_pen = [0.01, 0.1, 1], [0.01, 0.1]
+        for prune in (False, True):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                scores, scores_se = CV_score(
+                    np.asmatrix(self.X), np.asmatrix(self.Y), v_pen=v_pen, w_pen=w_pen,
+                    splits=5, grad_splits=3, quiet=True, progress=False,
+                    print_path=False, prune=prune,
+                )
+            self.assertEqual(scores.shape, (2, 3))
+            self.assertEqual(scores_se.shape, (2, 3))
+            self.assertTrue(np.isfinite(scores.min()))
+            if not prune:
+                self.assertTrue(np.isfinite(scores).all())
+
+    def test_fit(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit_res = fit(
+                self.X, self.Y, model_type="full", search="joint", grid_length=4,
+                cv_folds=5, gradient_folds=3, progress=False, verbose=0, print_path=False,
+            )
+        self.assertEqual(fit_res.scores.shape, (5, 4))
+        i, j = fit_res.selected_score
+        self.assertEqual(fit_res.fitted_w_pen, fit_res.initial_w_pen[i])
+        self.assertEqual(fit_res.fitted_v_pen, fit_res.initial_v_pen[j])
+        self.assertEqual(fit_res.summary()[0]["selected_score"].sum(), 1)
+
+    def test_1se_unsorted_grid(self):
+        from SparseSC.fit import _which_2d
+
+        scores = np.array([[1.0, 1.05, 3.0], [1.02, 2.0, 1.04]])
+        se = np.full(scores.shape, 0.1)
+        # the largest v_pen within 1 SE, then the largest w_pen
+        self.assertEqual(_which_2d(scores, se, "1se", [0.1, 1], [0.01, 0.1, 1]), (1, 2))
+        self.assertEqual(_which_2d(scores, se, "1se", [0.1, 1], [1, 0.01, 0.1]), (1, 0))
+        self.assertEqual(_which_2d(scores[:, :1], se[:, :1], "1se", [1, 0.1], [1]), (0, 0))
+
+
+class TestCVScoreIter(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(101101001)
+        self.X = np.asmatrix(np.random.rand(30, 3))
+        self.Y = np.asmatrix(self.X[:, :2].dot(np.ones((2, 2))) + 0.1 * np.random.rand(30, 2))
+        self.cv_kwargs = dict(
+            splits=3, grad_splits=3, quiet=True, progress=False, print_path=False
+        )
+
+    def test_records(self):
+        from SparseSC.cross_validation import CV_score_iter, CVScoreRecord
+
+        v_pen = [0.01, 0.1]
+        records = list(CV_score_iter(self.X, self.Y, v_pen=v_pen, w_pen=0.1, **self.cv_kwargs))
+        self.assertEqual(len(records), 3 * len(v_pen))
+        self.assertTrue(all(isinstance(r, CVScoreRecord) for r in records))
+        self.assertEqual(sorted((r.fold, r.index) for r in records),
+                         [(f, i) for f in range(3) for i in range(2)])
+        self.assertEqual(records[1].penalty, (v_pen[records[1].index], 0.1))
+        self.assertTrue(all(r.elapsed >= 0 for r in records))
+
+    def test_abort(self):
+        from SparseSC.cross_validation import CV_score_iter
+
+        records = list(CV_score_iter(
+            self.X, self.Y, v_pen=[0.01, 0.1], w_pen=0.1, abort=lambda r: True, **self.cv_kwargs
+        ))
+        self.assertEqual(len(records), 1)
+
+    def test_callback(self):
+        from SparseSC.cross_validation import CV_score
+
+        seen = []
+        score, score_se = CV_score(
+            self.X, self.Y, v_pen=0.1, w_pen=0.1, callback=seen.append, **self.cv_kwargs
+        )
+        self.assertEqual(len(seen), 3)
+        self.assertAlmostEqual(score, sum(r.score for r in seen))
+
+
 class TestFitForCorrectness(unittest.TestCase):
     @staticmethod
     def simple_summ(fit_res, Y):